@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+
+from telebot.async_telebot import AsyncTeleBot
+
+from outbound import PRIORITY_RELAY
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRuntime:
+    """Asyncio bot runtime, opt-in with BOT_RUNTIME=async.
+
+    Updates are received by the library's AsyncTeleBot and taken in
+    arrival order. Text relayed between random-chat partners, the bulk of
+    the traffic, is handled natively and sent through the outbound
+    scheduler, so the per-chat and global limits of threaded mode still
+    apply. Every other update (commands, setup steps, callbacks) goes to
+    the update dispatcher, whose per-chat ordered lanes and heavy/default
+    pools run the existing synchronous handlers, so the command set and
+    its isolation stay identical to threaded mode. A relay whose chat
+    still has an update in the dispatcher is dispatched too, so it can't
+    overtake that update.
+
+    Session lookups, which are socket calls with a shared coordinator, and
+    handing updates to the dispatcher, which waits when a pool is full,
+    run on an intake thread so nothing blocks the loop.
+    """
+
+    def __init__(self, sync_bot, chat_sessions, outbox, dispatcher):
+        self.sync_bot = sync_bot
+        self.chat_sessions = chat_sessions
+        self.outbox = outbox
+        self.dispatcher = dispatcher
+        self.bot = AsyncTeleBot(sync_bot.token)
+        self.bot.process_new_updates = self.process_new_updates
+        # One thread, so updates reach the dispatcher in the order they arrived
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='async-intake')
+        self._intake = asyncio.Lock()
+
+    async def run_blocking(self, func, *args):
+        """Run a blocking call (session lookup, dispatch) off the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    @staticmethod
+    def _may_relay(message):
+        text = message.text or ''
+        return bool(text) and not text.startswith('/') and text.lower() != 'end chat'
+
+    async def process_new_updates(self, updates):
+        """Relay chat text and dispatch everything else, in arrival order"""
+        # Polling hands each batch to a task of its own; the lock keeps batches in order
+        async with self._intake:
+            for update in updates:
+                message = update.message
+                if message is not None and self._may_relay(message) and not self.dispatcher.is_busy(message.chat.id):
+                    partner_chat_id = await self.run_blocking(self.chat_sessions.partner_of, message.chat.id)
+                    if partner_chat_id is not None:
+                        self._relay(message, partner_chat_id)
+                        continue
+                await self.run_blocking(self.dispatcher.dispatch, [update])
+
+    def _relay(self, message, partner_chat_id):
+        chat_id = message.chat.id
+
+        def on_error(e):
+            logger.error(f"Error relaying message: {e}")
+            self.outbox.submit(chat_id, self.sync_bot.send_message, chat_id,
+                               "Error sending message. The chat may have ended.")
+
+        self.outbox.submit(partner_chat_id, self.sync_bot.send_message, partner_chat_id, f"{message.text}",
+                           priority=PRIORITY_RELAY, on_error=on_error)
+
+    async def run(self):
+        logger.info("🤖 Starting async bot runtime...")
+        try:
+            await self.bot.infinity_polling(timeout=30, skip_pending=True)
+        finally:
+            await self.bot.close_session()
+            self.executor.shutdown(wait=False)
+
+
+def run_async(sync_bot, chat_sessions, outbox, dispatcher):
+    """Run the bot on the asyncio runtime until interrupted"""
+    asyncio.run(AsyncRuntime(sync_bot, chat_sessions, outbox, dispatcher).run())
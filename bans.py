@@ -0,0 +1,158 @@
+import threading
+import logging
+import time
+
+from sqlalchemy.dialects.postgresql import insert
+
+from models import BannedUser, get_db, close_db
+
+logger = logging.getLogger(__name__)
+
+# Seconds between re-syncs with banned_users, which pick up bans made by other workers
+RECONCILE_INTERVAL = 60
+
+
+class BanIndex:
+    """In-process set of banned chat_ids, mirrored from banned_users.
+
+    Membership is a plain set lookup with no lock and no query. ban_user
+    and unban_user update it right after committing. A periodic reconcile
+    reloads the table, so bans made by other workers or by hand show up
+    within RECONCILE_INTERVAL. Changes made while a reload is in flight
+    are replayed on top of it so they are not lost. Bans are rare, so an
+    exact set costs little and, unlike a bloom filter, never refuses
+    someone who isn't banned.
+    """
+
+    def __init__(self):
+        self._banned = set()
+        self._lock = threading.Lock()
+        self._changes = None
+        self._thread = None
+
+    def __contains__(self, chat_id):
+        return chat_id in self._banned
+
+    def __len__(self):
+        return len(self._banned)
+
+    def add(self, chat_id):
+        self._apply(chat_id, True)
+
+    def discard(self, chat_id):
+        self._apply(chat_id, False)
+
+    def _apply(self, chat_id, banned):
+        with self._lock:
+            if banned:
+                self._banned.add(chat_id)
+            else:
+                self._banned.discard(chat_id)
+            if self._changes is not None:
+                self._changes.append((chat_id, banned))
+
+    def load(self):
+        """Replace the index with the contents of banned_users. Returns its size"""
+        with self._lock:
+            self._changes = []
+        try:
+            db = get_db()
+            try:
+                banned = {user_id for user_id, in db.query(BannedUser.user_id)}
+            finally:
+                close_db(db)
+        except Exception:
+            with self._lock:
+                self._changes = None
+            raise
+
+        with self._lock:
+            for chat_id, is_banned in self._changes:
+                if is_banned:
+                    banned.add(chat_id)
+                else:
+                    banned.discard(chat_id)
+            self._changes = None
+            added, removed = len(banned - self._banned), len(self._banned - banned)
+            self._banned = banned
+        if added or removed:
+            logger.info(f"Ban index reconciled: {added} added, {removed} removed")
+        return len(banned)
+
+    def start_reconciler(self, interval=RECONCILE_INTERVAL):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._reconcile_forever, args=(interval,), name='ban-reconciler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _reconcile_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.load()
+            except Exception as e:
+                logger.error(f"Error reconciling ban index: {e}")
+
+
+ban_index = BanIndex()
+_ban_listeners = []
+
+
+def add_ban_listener(callback):
+    """Call callback(chat_id) after a user is banned"""
+    _ban_listeners.append(callback)
+
+
+def check_banned(chat_id):
+    return int(chat_id) in ban_index
+
+
+def ban_user(chat_id):
+    """Ban a user. Returns True if they weren't banned already"""
+    chat_id = int(chat_id)
+    db = get_db()
+    try:
+        inserted = db.execute(
+            insert(BannedUser).values(user_id=chat_id)
+            .on_conflict_do_nothing(index_elements=[BannedUser.user_id])
+            .returning(BannedUser.user_id)
+        ).first()
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error banning user {chat_id}: {e}")
+        return False
+    finally:
+        close_db(db)
+
+    ban_index.add(chat_id)
+    if inserted is None:
+        return False
+    logger.info(f"User {chat_id} banned")
+    for callback in _ban_listeners:
+        try:
+            callback(chat_id)
+        except Exception as e:
+            logger.error(f"Error in ban listener: {e}")
+    return True
+
+
+def unban_user(chat_id):
+    """Lift a ban. Returns True if the user was banned"""
+    chat_id = int(chat_id)
+    db = get_db()
+    try:
+        removed = db.query(BannedUser).filter(BannedUser.user_id == chat_id).delete(synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error unbanning user {chat_id}: {e}")
+        return False
+    finally:
+        close_db(db)
+
+    ban_index.discard(chat_id)
+    if removed:
+        logger.info(f"User {chat_id} unbanned")
+    return bool(removed)
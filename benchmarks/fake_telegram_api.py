@@ -0,0 +1,128 @@
+"""Local stand-in for the Telegram Bot API, used by the benchmarks.
+
+getUpdates hands out text messages from a fixed set of paired chats and
+sendMessage sleeps for a configurable latency before answering, which is
+enough to drive either bot runtime at full speed without touching
+Telegram.
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import itertools
+import threading
+import json
+import time
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients drop long polls when a benchmark run stops
+        pass
+
+
+class FakeTelegramAPI:
+    def __init__(self, pairs=100, messages=5000, latency=0.05, batch=100, port=0):
+        self.pairs = pairs
+        self.messages = messages
+        self.latency = latency
+        self.batch = batch
+        self.sent = 0
+        self.served = 0
+        self._lock = threading.Lock()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self.server = _Server(('127.0.0.1', port), self._handler())
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def chat_ids(self):
+        return list(range(1, self.pairs * 2 + 1))
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def _message(self, chat_id, text):
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': f"user{chat_id}"},
+            'text': text,
+        }
+
+    def get_updates(self, params):
+        if params.get('offset') == '-1':
+            return []
+        with self._lock:
+            count = min(self.batch, self.messages - self.served)
+            start = self.served
+            self.served += count
+        if count <= 0:
+            time.sleep(0.5)
+            return []
+        chats = self.chat_ids()
+        return [
+            {
+                'update_id': next(self._update_ids),
+                'message': self._message(chats[i % len(chats)], f"hello {i}"),
+            }
+            for i in range(start, start + count)
+        ]
+
+    def send_message(self, params):
+        time.sleep(self.latency)
+        with self._lock:
+            self.sent += 1
+        return self._message(int(params.get('chat_id', 0)), params.get('text', ''))
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _params(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = self.rfile.read(length).decode()
+                    if self.headers.get('Content-Type', '').startswith('application/json'):
+                        params.update({k: str(v) for k, v in json.loads(body).items()})
+                    else:
+                        params.update({k: v[0] for k, v in parse_qs(body).items()})
+                return url.path.rsplit('/', 1)[-1], params
+
+            def _respond(self):
+                method, params = self._params()
+                if method == 'getUpdates':
+                    result = api.get_updates(params)
+                elif method == 'sendMessage':
+                    result = api.send_message(params)
+                elif method == 'getMe':
+                    result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+                else:
+                    result = True
+                body = json.dumps({'ok': True, 'result': result}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = _respond
+            do_POST = _respond
+
+        return Handler
@@ -0,0 +1,87 @@
+"""Measure the per-call overhead of rate_limiter.is_allowed.
+
+Usage: python benchmarks/rate_limiter.py [--calls 200000] [--chats 10000] [--threads 4]
+
+Runs the limiter against an in-process GCRAStore and against a shared
+store on a local CoordinatorServer, with calls spread over --chats chats,
+and reports latency percentiles and how many keys each store kept.
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from coordinator import CoordinatorServer, LocalCoordinator, RemoteCoordinator
+from ratelimit import GCRAStore, RateLimiter
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def bench(limiter, calls, chats, threads):
+    commands = [None, None, None, 'view_profiles', 'find_random']
+    per_thread = calls // threads
+    samples = []
+    lock = threading.Lock()
+
+    def run(seed):
+        rng = random.Random(seed)
+        local = []
+        for _ in range(per_thread):
+            chat_id, command = rng.randrange(chats), rng.choice(commands)
+            started = time.perf_counter()
+            limiter.is_allowed(chat_id, command)
+            local.append(time.perf_counter() - started)
+        with lock:
+            samples.extend(local)
+
+    workers = [threading.Thread(target=run, args=(seed,)) for seed in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    return elapsed, samples
+
+
+def report(name, limiter, store, calls, elapsed, samples):
+    us = [sample * 1e6 for sample in (percentile(samples, 0.5), percentile(samples, 0.99), samples[-1])]
+    print(f"{name:>7}: {calls / elapsed:,.0f} calls/s, p50 {us[0]:.1f}us, p99 {us[1]:.1f}us, max {us[2]:.0f}us, "
+          f"allowed {limiter.stats['allowed']}, limited {limiter.stats['limited']}, keys {len(store)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=200000)
+    parser.add_argument('--chats', type=int, default=10000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=30, help="commands per minute per chat")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    store = GCRAStore()
+    limiter = RateLimiter(store, rate_per_minute=args.rate)
+    elapsed, samples = bench(limiter, args.calls, args.chats, args.threads)
+    report('local', limiter, store, args.calls, elapsed, samples)
+
+    coordinator = LocalCoordinator()
+    server = CoordinatorServer(('127.0.0.1', 0), coordinator)
+    server.serve_in_background()
+    remote_calls = min(args.calls, 20000)
+    limiter = RateLimiter(RemoteCoordinator(*server.server_address).rate_limits, rate_per_minute=args.rate)
+    elapsed, samples = bench(limiter, remote_calls, args.chats, args.threads)
+    report('shared', limiter, coordinator.rate_limits, remote_calls, elapsed, samples)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Compare relay throughput of the threaded and asyncio runtimes.
+
+Usage: python benchmarks/relay_throughput.py [--pairs 100] [--messages 5000] [--latency 0.05]
+
+Every generated message comes from a user in an active random chat, so
+each one costs exactly one relayed sendMessage.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import telebot
+from telebot import apihelper, asyncio_helper
+
+from async_runtime import AsyncRuntime
+from benchmarks.fake_telegram_api import FakeTelegramAPI
+from dispatcher import LanePool, UpdateDispatcher
+from outbound import OutboundScheduler
+from sessions import ChatSessions
+
+TOKEN = '123456:BENCHMARK'
+
+
+def make_sessions(api):
+    sessions = ChatSessions()
+    chats = api.chat_ids()
+    for a, b in zip(chats[::2], chats[1::2]):
+        sessions.pair(a, b)
+    return sessions
+
+
+def wait_for(api, total, timeout):
+    deadline = time.time() + timeout
+    while api.sent < total and time.time() < deadline:
+        time.sleep(0.05)
+
+
+def make_outbox():
+    # Telegram's rate limits are off so the runtimes themselves are compared
+    return OutboundScheduler(workers=32, global_rate=None, chat_rate=1000, chat_burst=1000)
+
+
+def bench_threaded(api, timeout):
+    sessions = make_sessions(api)
+    outbox = make_outbox()
+    bot = telebot.TeleBot(TOKEN, threaded=True, num_threads=8)
+
+    @bot.message_handler(func=lambda message: True)
+    def relay_message(message):
+        partner_chat_id = sessions.partner_of(message.chat.id)
+        if partner_chat_id is not None:
+            outbox.submit(partner_chat_id, bot.send_message, partner_chat_id, message.text)
+
+    thread = threading.Thread(target=bot.polling, kwargs={'non_stop': True, 'interval': 0, 'timeout': 10, 'long_polling_timeout': 1})
+    thread.daemon = True
+    started = time.time()
+    thread.start()
+    wait_for(api, api.messages, timeout)
+    elapsed = time.time() - started
+    bot.stop_polling()
+    return elapsed
+
+
+def bench_async(api, timeout):
+    sessions = make_sessions(api)
+    bot = telebot.TeleBot(TOKEN)
+    dispatcher = UpdateDispatcher(lambda update: 'default', [LanePool('default')]).install(bot)
+    runtime = AsyncRuntime(bot, sessions, make_outbox(), dispatcher)
+
+    async def run():
+        task = asyncio.create_task(runtime.bot.polling(non_stop=True, interval=0, timeout=1, request_timeout=10))
+        started = time.time()
+        await asyncio.get_running_loop().run_in_executor(None, wait_for, api, api.messages, timeout)
+        elapsed = time.time() - started
+        task.cancel()
+        await runtime.bot.close_session()
+        return elapsed
+
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pairs', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    for name, bench in (('threaded', bench_threaded), ('async', bench_async)):
+        api = FakeTelegramAPI(args.pairs, args.messages, args.latency).start()
+        apihelper.API_URL = api.url + '/bot{0}/{1}'
+        asyncio_helper.API_URL = api.url + '/bot{0}/{1}'
+        elapsed = bench(api, args.timeout)
+        api.stop()
+        print(f"{name:>8}: {api.sent}/{args.messages} relayed in {elapsed:.2f}s "
+              f"({api.sent / elapsed:.0f} msg/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+from concurrent.futures import wait
+from datetime import datetime, timedelta
+import logging
+import time
+
+from sqlalchemy import or_
+from sqlalchemy.dialects.postgresql import insert
+from telebot.apihelper import ApiTelegramException
+
+from models import User, TipCursor, BroadcastRun, get_db, close_db
+from outbound import PRIORITY_TIPS
+
+logger = logging.getLogger(__name__)
+
+
+def mark_blocked(chat_id):
+    """Stop broadcasting to a user who blocked the bot"""
+    set_blocked(chat_id, True)
+
+
+def subscribe(chat_id):
+    """(Re)enable broadcasts for a user, e.g. after they finish setup"""
+    set_blocked(chat_id, False)
+
+
+def set_blocked(chat_id, blocked):
+    db = get_db()
+    try:
+        stmt = insert(TipCursor).values(chat_id=chat_id, tip_index=0, blocked=blocked)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[TipCursor.chat_id],
+            set_={'blocked': blocked}
+        ))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error updating tip subscription for {chat_id}: {e}")
+    finally:
+        close_db(db)
+
+
+class TipBroadcaster:
+    """Sends the daily tip to every user, resumably.
+
+    Each user's position in the tip list lives in tip_cursors and each pass
+    is recorded in broadcast_runs. Recipients are read in keyset-paginated
+    batches ordered by chat_id. A batch is queued on the outbound scheduler
+    at tip priority, which handles rate limits. Once the batch settles, the
+    cursors and the run's checkpoint are committed. After a crash the
+    unfinished run picks up from its last checkpoint and skips users who
+    already got today's tip. With several bot workers, an optional
+    coordinator lease makes sure only one of them broadcasts.
+    """
+
+    name = 'tips'
+
+    def __init__(self, bot, outbox, tips, batch_size=500, interval=86400, lease=None):
+        self.bot = bot
+        self.outbox = outbox
+        self.tips = tips
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lease = lease
+
+    def run_forever(self):
+        while True:
+            try:
+                delay = self.seconds_until_due()
+                if delay > 0:
+                    time.sleep(delay)
+                    continue
+                if self.lease is not None and not self.lease.acquire(blocking=False):
+                    # Another worker is broadcasting
+                    time.sleep(60)
+                    continue
+                try:
+                    self.run()
+                finally:
+                    if self.lease is not None:
+                        self.lease.release()
+            except Exception as e:
+                logger.error(f"Error in tip broadcast: {e}")
+                time.sleep(60)
+
+    def seconds_until_due(self):
+        db = get_db()
+        try:
+            last = (db.query(BroadcastRun)
+                    .filter(BroadcastRun.name == self.name)
+                    .order_by(BroadcastRun.id.desc())
+                    .first())
+            if last is None or last.finished_at is None:
+                return 0
+            due = last.started_at + timedelta(seconds=self.interval)
+            return max(0, (due - datetime.utcnow()).total_seconds())
+        finally:
+            close_db(db)
+
+    def _current_run(self):
+        """Return (id, last_chat_id, started_at) of the unfinished run, starting one if needed"""
+        db = get_db()
+        try:
+            run = (db.query(BroadcastRun)
+                   .filter(BroadcastRun.name == self.name, BroadcastRun.finished_at.is_(None))
+                   .order_by(BroadcastRun.id.desc())
+                   .first())
+            if run is None:
+                run = BroadcastRun(name=self.name, started_at=datetime.utcnow())
+                db.add(run)
+                db.commit()
+            else:
+                logger.info(f"Resuming tip broadcast {run.id} after chat {run.last_chat_id}")
+            return run.id, run.last_chat_id, run.started_at
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            close_db(db)
+
+    def _next_batch(self, after_chat_id, started_at):
+        db = get_db()
+        try:
+            return (db.query(User.chat_id, TipCursor.tip_index)
+                    .outerjoin(TipCursor, TipCursor.chat_id == User.chat_id)
+                    .filter(User.chat_id > after_chat_id)
+                    .filter(or_(TipCursor.blocked.is_(None), TipCursor.blocked.is_(False)))
+                    .filter(or_(TipCursor.last_sent_at.is_(None), TipCursor.last_sent_at < started_at))
+                    .order_by(User.chat_id)
+                    .limit(self.batch_size)
+                    .all())
+        finally:
+            close_db(db)
+
+    def _checkpoint(self, run_id, last_chat_id, rows, counts, finished=False):
+        """Commit a settled batch's cursors and advance the run's checkpoint"""
+        db = get_db()
+        try:
+            if rows:
+                stmt = insert(TipCursor).values(rows)
+                db.execute(stmt.on_conflict_do_update(
+                    index_elements=[TipCursor.chat_id],
+                    set_={
+                        'tip_index': stmt.excluded.tip_index,
+                        'last_sent_at': stmt.excluded.last_sent_at,
+                        'blocked': stmt.excluded.blocked,
+                    }
+                ))
+            run = db.get(BroadcastRun, run_id)
+            run.last_chat_id = last_chat_id
+            for key, count in counts.items():
+                setattr(run, key, getattr(run, key) + count)
+            if finished:
+                run.finished_at = datetime.utcnow()
+            db.commit()
+            return {'delivered': run.delivered, 'failed': run.failed, 'blocked': run.blocked}
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            close_db(db)
+
+    def run(self):
+        """Run (or resume) one broadcast pass. Returns the delivery counts.
+
+        No session is held while a batch is being delivered: the batch is
+        read in one short session and its results written in a fresh one.
+        """
+        if not self.tips:
+            return {}
+
+        run_id, last_chat_id, started_at = self._current_run()
+        while True:
+            batch = self._next_batch(last_chat_id, started_at)
+            if not batch:
+                break
+
+            futures = {}
+            for chat_id, tip_index in batch:
+                index = (tip_index or 0) % len(self.tips)
+                future = self.outbox.submit(chat_id, self.bot.send_message, chat_id,
+                                            self.tips[index], priority=PRIORITY_TIPS)
+                futures[future] = (chat_id, index)
+            wait(futures)
+
+            rows = []
+            counts = {'delivered': 0, 'failed': 0, 'blocked': 0}
+            now = datetime.utcnow()
+            for future, (chat_id, index) in futures.items():
+                error = future.exception()
+                if error is None:
+                    counts['delivered'] += 1
+                    rows.append({'chat_id': chat_id, 'tip_index': (index + 1) % len(self.tips),
+                                 'last_sent_at': now, 'blocked': False})
+                elif isinstance(error, ApiTelegramException) and error.error_code == 403:
+                    counts['blocked'] += 1
+                    rows.append({'chat_id': chat_id, 'tip_index': index,
+                                 'last_sent_at': now, 'blocked': True})
+                else:
+                    counts['failed'] += 1
+
+            last_chat_id = batch[-1][0]
+            self._checkpoint(run_id, last_chat_id, rows, counts)
+
+            if self.lease is not None and not self.lease.extend():
+                logger.warning(f"Lost the broadcast lease; leaving run {run_id} to its new holder")
+                return {}
+
+        counts = self._checkpoint(run_id, last_chat_id, [], {}, finished=True)
+        logger.info(f"✅ Tip broadcast {run_id} finished: {counts}")
+        return counts
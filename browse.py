@@ -0,0 +1,188 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import logging
+
+import numpy as np
+from sqlalchemy import and_, or_
+
+from cache import LRUCache
+from interests import profile_interest_ids
+from matching import CANDIDATE_POOL, candidate_query, exclude_banned, user_coordinates
+from models import User, run_read
+from profiles import get_user_info, profile_cache
+from scoring import ProfileMatrix
+
+logger = logging.getLogger(__name__)
+
+
+def rank_pool(user_info, gender_preference, pool_cursor=None, pool_size=CANDIDATE_POOL, max_age_diff=None,
+              max_distance_km=None, min_shared_interests=None):
+    """Rank the pool of candidates after a (score, chat_id) keyset cursor.
+
+    Up to pool_size candidates are read in SQL score order and ranked
+    together with ProfileMatrix, so shared interests and distance order
+    the whole pool rather than a page. Banned users are dropped after the
+    query. Returns (ranked chat_ids, next_pool_cursor, exhausted).
+    """
+    def fetch(db):
+        query, score = candidate_query(db, user_info, gender_preference, max_age_diff, max_distance_km,
+                                       min_shared_interests)
+        if pool_cursor:
+            last_score, last_chat_id = pool_cursor
+            query = query.filter(or_(
+                score < last_score,
+                and_(score == last_score, User.chat_id < last_chat_id)
+            ))
+        rows = query.order_by(score.desc(), User.chat_id.desc()).limit(pool_size).all()
+        return [(user.to_dict(), row_score) for user, row_score in rows]
+
+    rows = run_read(fetch)
+    if not rows:
+        return [], pool_cursor, True
+    last_profile, last_score = rows[-1]
+    next_cursor = [last_score, last_profile['chat_id']]
+    exhausted = len(rows) < pool_size
+    rows = exclude_banned(rows)
+
+    coordinates = user_coordinates(user_info)
+    if coordinates:
+        user_info = dict(user_info, latitude=coordinates[0], longitude=coordinates[1])
+    matrix = ProfileMatrix((profile for profile, _ in rows), profile_interest_ids)
+    ranked = matrix.score(user_info, gender_preference, k=len(rows), max_distance_km=max_distance_km)
+    return [profile['chat_id'] for profile, _ in ranked], next_cursor, exhausted
+
+
+def load_profiles(chat_ids):
+    """Put the profiles of chat_ids missing from the profile cache into it, in one query"""
+    missing = [chat_id for chat_id in chat_ids if profile_cache.get(chat_id) is None]
+    if not missing:
+        return
+    users = run_read(lambda db: [user.to_dict() for user in db.query(User).filter(User.chat_id.in_(missing))])
+    for profile in users:
+        profile_cache.set(profile['chat_id'], profile)
+
+
+class ProfileBrowser:
+    """Cursor-based /view_profiles sessions.
+
+    Candidates are ranked a pool of up to pool_size at a time (see
+    rank_pool) and the ranked chat_ids of each session's current pool are
+    kept in a bounded in-process cache; a pool evicted from it is simply
+    ranked again. The session kept in the state store is only the filter
+    settings, a cursor (the keyset cursor of the pool and an offset into
+    its ranking) and a window of up to a page of prefetched chat_ids.
+    When the window runs low, the next page is fetched on a background
+    pool, so pressing next rarely waits on the database.
+    """
+
+    def __init__(self, state_store, page_size=5, low_water=2, workers=4, pool_size=CANDIDATE_POOL,
+                 ranking_cache_size=2000):
+        self.state_store = state_store
+        self.page_size = page_size
+        self.low_water = low_water
+        self.pool_size = pool_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='browse')
+        # Abandoned sessions' prefetches and rankings expire instead of piling up
+        self._pending = LRUCache(maxsize=10000, ttl=300)
+        self._rankings = LRUCache(maxsize=ranking_cache_size, ttl=600)
+        self._lock = threading.Lock()
+
+    def start(self, chat_id, user_info, gender_preference, prefs=None):
+        """Begin a browsing session. Returns False when nothing matches"""
+        prefs = prefs or {}
+        session = {
+            'gender_preference': gender_preference,
+            'max_age_diff': prefs.get('max_age_diff'),
+            'max_distance': prefs.get('max_distance'),
+            'min_shared_interests': prefs.get('min_shared_interests'),
+            'cursor': None,
+            'buffer': [],
+            'exhausted': False,
+        }
+        self._pending.delete(chat_id)
+        self._rankings.delete(chat_id)
+        self._merge(session, self._fetch(user_info, session))
+        self.state_store.update(chat_id, browse=session)
+        return bool(session['buffer'])
+
+    def next_profile(self, chat_id):
+        """Pop the next profile of the session, or None when exhausted"""
+        state = self.state_store.get(chat_id) or {}
+        session = state.get('browse')
+        if session is None:
+            return None
+
+        with self._lock:
+            pending = self._pending.get(chat_id)
+            if pending is not None and (pending.done() or not session['buffer']):
+                self._pending.delete(chat_id)
+            else:
+                pending = None
+        if pending is not None:
+            try:
+                self._merge(session, pending.result())
+            except Exception as e:
+                logger.error(f"Error prefetching profiles for {chat_id}: {e}")
+
+        if not session['buffer'] and not session['exhausted']:
+            user_info = get_user_info(chat_id)
+            if user_info:
+                self._merge(session, self._fetch(user_info, session))
+
+        profile = None
+        while session['buffer'] and profile is None:
+            profile = get_user_info(session['buffer'].pop(0))
+
+        if len(session['buffer']) < self.low_water and not session['exhausted']:
+            self._prefetch(chat_id, session)
+
+        self.state_store.update(chat_id, browse=session)
+        return profile
+
+    def _fetch(self, user_info, session):
+        """The next page of the session's ranking: (chat_ids, cursor, exhausted)"""
+        cursor = session['cursor'] if isinstance(session['cursor'], dict) else {'pool': None, 'offset': 0}
+        while True:
+            ranking = self._ranking(user_info, session, cursor['pool'])
+            offset = cursor['offset']
+            chat_ids = ranking['chat_ids'][offset:offset + self.page_size].tolist()
+            if chat_ids or ranking['exhausted']:
+                break
+            # This pool is used up, move on to the next one
+            cursor = {'pool': ranking['next_pool'], 'offset': 0}
+
+        offset += len(chat_ids)
+        exhausted = ranking['exhausted'] and offset >= len(ranking['chat_ids'])
+        # Prime the profile cache so showing these costs no query
+        load_profiles(chat_ids)
+        return chat_ids, {'pool': cursor['pool'], 'offset': offset}, exhausted
+
+    def _ranking(self, user_info, session, pool_cursor):
+        chat_id = user_info['chat_id']
+        ranking = self._rankings.get(chat_id)
+        if ranking is not None and ranking['pool'] == pool_cursor:
+            return ranking
+        chat_ids, next_pool, exhausted = rank_pool(
+            user_info, session['gender_preference'], pool_cursor, self.pool_size,
+            session['max_age_diff'], session['max_distance'], session.get('min_shared_interests')
+        )
+        ranking = {'pool': pool_cursor, 'chat_ids': np.array(chat_ids, dtype=np.int64),
+                   'next_pool': next_pool, 'exhausted': exhausted}
+        self._rankings.set(chat_id, ranking)
+        return ranking
+
+    def _merge(self, session, page):
+        chat_ids, cursor, exhausted = page
+        session['buffer'].extend(chat_ids)
+        session['cursor'] = cursor
+        session['exhausted'] = exhausted
+
+    def _prefetch(self, chat_id, session):
+        with self._lock:
+            if chat_id in self._pending:
+                return
+            user_info = get_user_info(chat_id)
+            if not user_info:
+                return
+            snapshot = dict(session, buffer=[])
+            self._pending.set(chat_id, self._executor.submit(self._fetch, user_info, snapshot))
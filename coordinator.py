@@ -0,0 +1,379 @@
+from abc import ABC, abstractmethod
+from urllib.parse import urlparse
+import socketserver
+import threading
+import argparse
+import logging
+import select
+import socket
+import json
+import time
+import uuid
+import os
+
+from matchmaking import MatchQueue
+from ratelimit import GCRAStore
+from reports import ReportAggregate
+from sessions import ChatSessions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = 'tcp://127.0.0.1:7700'
+
+
+class CoordinatorError(Exception):
+    """An operation failed on the coordinator server"""
+
+
+class Lease:
+    """A named lock held through a coordinator, with a time-to-live.
+
+    Mirrors threading.Lock: acquire(blocking, timeout), release() and use
+    as a context manager. The lease expires after ttl seconds unless it is
+    extended, so a worker that dies cannot hold it forever.
+    """
+
+    def __init__(self, coordinator, name, ttl=30):
+        self.coordinator = coordinator
+        self.name = name
+        self.ttl = ttl
+        self.owner = uuid.uuid4().hex
+
+    def acquire(self, blocking=True, timeout=-1):
+        deadline = time.monotonic() + timeout if blocking and timeout >= 0 else None
+        delay = 0.01
+        while True:
+            if self.coordinator.acquire_lease(self.name, self.owner, self.ttl):
+                return True
+            if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+    def extend(self):
+        """Restart the TTL. Returns False if the lease was lost meanwhile"""
+        return self.coordinator.acquire_lease(self.name, self.owner, self.ttl)
+
+    def release(self):
+        self.coordinator.release_lease(self.name, self.owner)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Coordinator(ABC):
+    """Shared matchmaking state: the /random queue, chat sessions, report
+    counts, rate limits and locks.
+
+    queue has the MatchQueue interface, sessions the ChatSessions one,
+    reports the ReportAggregate one and rate_limits the GCRAStore one, so
+    handlers don't care whether the state lives in this process or on a
+    coordinator server shared by several bot workers.
+    """
+
+    queue = None
+    sessions = None
+    reports = None
+    rate_limits = None
+
+    def lock(self, name, ttl=30):
+        return Lease(self, name, ttl)
+
+    @abstractmethod
+    def acquire_lease(self, name, owner, ttl):
+        pass
+
+    @abstractmethod
+    def release_lease(self, name, owner):
+        pass
+
+
+class LocalCoordinator(Coordinator):
+    """In-process coordinator, for a single bot process or behind a server"""
+
+    def __init__(self):
+        self.queue = MatchQueue()
+        self.sessions = ChatSessions()
+        self.reports = ReportAggregate()
+        self.rate_limits = GCRAStore()
+        self._leases = {}
+        self._leases_lock = threading.Lock()
+
+    def acquire_lease(self, name, owner, ttl):
+        now = time.monotonic()
+        with self._leases_lock:
+            holder = self._leases.get(name)
+            if holder is not None and holder[0] != owner and holder[1] > now:
+                return False
+            self._leases[name] = (owner, now + ttl)
+            return True
+
+    def release_lease(self, name, owner):
+        with self._leases_lock:
+            holder = self._leases.get(name)
+            if holder is not None and holder[0] == owner:
+                del self._leases[name]
+
+    def operations(self):
+        """Operations a CoordinatorServer exposes, by name"""
+        return {
+            'queue.enqueue': self.queue.enqueue,
+            'queue.cancel': self.queue.cancel,
+            'queue.contains': self.queue.__contains__,
+            'queue.len': self.queue.__len__,
+            'queue.status': self.queue.status,
+            'queue.expire': self.queue.expire,
+            'queue.metrics': self.queue.metrics,
+            'sessions.partner_of': self.sessions.partner_of,
+            'sessions.pair': self.sessions.pair,
+            'sessions.end': self.sessions.end,
+            'sessions.contains': self.sessions.__contains__,
+            'sessions.len': self.sessions.__len__,
+            'reports.add': self.reports.add,
+            'reports.counts': self.reports.counts,
+            'reports.load': self.reports.load,
+            'ratelimit.acquire': self.rate_limits.acquire,
+            'lease.acquire': self.acquire_lease,
+            'lease.release': self.release_lease,
+        }
+
+
+class CoordinatorClient:
+    """Newline-delimited JSON RPC over TCP, one connection per thread"""
+
+    def __init__(self, host, port, timeout=5):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._is_stale(conn[0]):
+            self._close()
+            conn = None
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = self._local.conn = (sock, sock.makefile('rwb'))
+            return conn, False
+        return conn, True
+
+    @staticmethod
+    def _is_stale(sock):
+        """Whether the server closed a pooled connection, e.g. by restarting"""
+        # No request is in flight, so a readable socket means EOF or an error
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable)
+
+    def _close(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn[1].close()
+                conn[0].close()
+            except OSError:
+                pass
+
+    def call(self, op, *args):
+        """Run op on the server. Only a request that couldn't be written is
+        sent again: once written the server may have applied it, and ops
+        such as queue.enqueue must not run twice."""
+        request = (json.dumps({'op': op, 'args': args}) + '\n').encode()
+        (sock, stream), reused = self._connection()
+        try:
+            stream.write(request)
+            stream.flush()
+        except OSError:
+            self._close()
+            if not reused:
+                raise
+            (sock, stream), _ = self._connection()
+            try:
+                stream.write(request)
+                stream.flush()
+            except OSError:
+                self._close()
+                raise
+        try:
+            line = stream.readline()
+        except OSError:
+            self._close()
+            raise
+        if not line:
+            self._close()
+            raise CoordinatorError(f"{op}: coordinator closed the connection")
+        response = json.loads(line)
+        if not response['ok']:
+            raise CoordinatorError(f"{op}: {response['error']}")
+        return response['result']
+
+
+class _RemoteQueue:
+    def __init__(self, client):
+        self._client = client
+
+    def enqueue(self, chat_id, gender, preference, looking_for):
+        return self._client.call('queue.enqueue', chat_id, gender, preference, looking_for)
+
+    def cancel(self, chat_id):
+        return self._client.call('queue.cancel', chat_id)
+
+    def __contains__(self, chat_id):
+        return self._client.call('queue.contains', chat_id)
+
+    def __len__(self):
+        return self._client.call('queue.len')
+
+    def status(self, chat_id):
+        return self._client.call('queue.status', chat_id)
+
+    def expire(self):
+        return self._client.call('queue.expire')
+
+    def metrics(self):
+        return self._client.call('queue.metrics')
+
+
+class _RemoteSessions:
+    def __init__(self, client):
+        self._client = client
+
+    def partner_of(self, chat_id):
+        return self._client.call('sessions.partner_of', chat_id)
+
+    def pair(self, chat_id, partner_chat_id):
+        return self._client.call('sessions.pair', chat_id, partner_chat_id)
+
+    def end(self, chat_id):
+        return self._client.call('sessions.end', chat_id)
+
+    def __contains__(self, chat_id):
+        return self._client.call('sessions.contains', chat_id)
+
+    def __len__(self):
+        return self._client.call('sessions.len')
+
+
+class _RemoteReports:
+    def __init__(self, client):
+        self._client = client
+
+    def add(self, chat_id, violation, hour=None, count=1):
+        return self._client.call('reports.add', chat_id, violation, hour, count)
+
+    def counts(self, chat_id, hour=None):
+        return self._client.call('reports.counts', chat_id, hour)
+
+    def load(self, rows):
+        return self._client.call('reports.load', [list(row) for row in rows])
+
+
+class _RemoteRateLimits:
+    def __init__(self, client):
+        self._client = client
+
+    def acquire(self, key, cost, rate, burst):
+        return self._client.call('ratelimit.acquire', key, cost, rate, burst)
+
+
+class RemoteCoordinator(Coordinator):
+    """Coordinator state held by a CoordinatorServer shared by all workers"""
+
+    def __init__(self, host, port, timeout=5):
+        self.client = CoordinatorClient(host, port, timeout)
+        self.queue = _RemoteQueue(self.client)
+        self.sessions = _RemoteSessions(self.client)
+        self.reports = _RemoteReports(self.client)
+        self.rate_limits = _RemoteRateLimits(self.client)
+
+    def acquire_lease(self, name, owner, ttl):
+        return self.client.call('lease.acquire', name, owner, ttl)
+
+    def release_lease(self, name, owner):
+        return self.client.call('lease.release', name, owner)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        operations = self.server.operations
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                operation = operations.get(request['op'])
+                if operation is None:
+                    raise CoordinatorError(f"unknown operation {request['op']}")
+                response = {'ok': True, 'result': operation(*request['args'])}
+            except Exception as e:
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write((json.dumps(response) + '\n').encode())
+            self.wfile.flush()
+
+
+class CoordinatorServer(socketserver.ThreadingTCPServer):
+    """Serves a LocalCoordinator to RemoteCoordinator clients.
+
+    A stand-in for a networked store such as Redis: state lives in this
+    process only and there is no authentication, so bind it to a private
+    interface. Other modules can expose more operations with register().
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, coordinator=None):
+        self.coordinator = coordinator or LocalCoordinator()
+        self.operations = self.coordinator.operations()
+        super().__init__(address, _RequestHandler)
+
+    def register(self, name, func):
+        self.operations[name] = func
+
+    def serve_in_background(self):
+        thread = threading.Thread(target=self.serve_forever, name='coordinator-server')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+def parse_address(url):
+    parsed = urlparse(url)
+    if parsed.scheme != 'tcp' or not parsed.hostname or not parsed.port:
+        raise ValueError(f"Coordinator URL must look like tcp://host:port, got {url}")
+    return parsed.hostname, parsed.port
+
+
+def coordinator_url():
+    """COORDINATOR_URL, defaulting to a local server when running several workers"""
+    url = os.getenv('COORDINATOR_URL')
+    if url is None and int(os.getenv('BOT_WORKERS', '1')) > 1:
+        url = DEFAULT_ADDRESS
+    return url
+
+
+def create_coordinator():
+    """Build a RemoteCoordinator for COORDINATOR_URL, or a LocalCoordinator"""
+    url = coordinator_url()
+    if not url:
+        return LocalCoordinator()
+    return RemoteCoordinator(*parse_address(url))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a standalone coordinator server")
+    parser.add_argument('--url', default=os.getenv('COORDINATOR_URL', DEFAULT_ADDRESS))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = CoordinatorServer(parse_address(args.url))
+    logger.info(f"Coordinator listening on {args.url}")
+    server.serve_forever()
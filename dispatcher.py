@@ -0,0 +1,193 @@
+from collections import deque
+import threading
+import logging
+import queue
+import time
+
+logger = logging.getLogger(__name__)
+
+# Weight of the latest sample in the queue wait moving average
+WAIT_EWMA_ALPHA = 0.05
+
+
+def chat_id_of(update):
+    """chat_id a telebot Update belongs to, or None"""
+    for kind in ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                 'my_chat_member', 'chat_member', 'chat_join_request'):
+        payload = getattr(update, kind, None)
+        if payload is not None:
+            return payload.chat.id
+    call = update.callback_query
+    if call is not None:
+        return call.message.chat.id if call.message is not None else call.from_user.id
+    for kind in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query'):
+        payload = getattr(update, kind, None)
+        if payload is not None:
+            return payload.from_user.id
+    return None
+
+
+class LanePool:
+    """A pool of lanes, worker threads handling one update at a time.
+
+    Capacity is checked when an update is admitted, counting both updates
+    queued for the lanes and those still waiting behind an earlier update
+    of their chat. When maxsize are admitted, admit waits up to
+    block_timeout seconds (None waits indefinitely, which slows intake
+    down to the pool's pace) and then rejects the update, calling
+    on_reject(chat_id, update). Admitted updates are never refused, so
+    handing one over when its turn comes can't block.
+    """
+
+    def __init__(self, name, lanes=4, maxsize=1000, block_timeout=None, on_reject=None):
+        self.name = name
+        self.lanes = lanes
+        self.maxsize = maxsize
+        self.block_timeout = block_timeout
+        self.on_reject = on_reject
+        self._queue = queue.Queue()
+        self._admitted = 0
+        self._cond = threading.Condition()
+        self._handler = None
+        self._on_done = None
+        self.stats = {'handled': 0, 'rejected': 0, 'errors': 0, 'wait_ms_avg': 0.0, 'wait_ms_max': 0.0}
+
+    def start(self, handler, on_done=None):
+        """Run handler([update]) on the lanes, then on_done(chat_id)"""
+        self._handler = handler
+        self._on_done = on_done
+        for index in range(self.lanes):
+            thread = threading.Thread(target=self._worker, name=f"{self.name}-lane-{index}")
+            thread.daemon = True
+            thread.start()
+
+    def admit(self, chat_id, update):
+        """Reserve room for an update. Returns False if it was rejected"""
+        with self._cond:
+            if self.block_timeout != 0:
+                self._cond.wait_for(lambda: self._admitted < self.maxsize, timeout=self.block_timeout)
+            if self._admitted < self.maxsize:
+                self._admitted += 1
+                return True
+            self.stats['rejected'] += 1
+        if self.on_reject is not None:
+            try:
+                self.on_reject(chat_id, update)
+            except Exception as e:
+                logger.error(f"Error in {self.name} reject callback: {e}")
+        return False
+
+    def run(self, chat_id, update, queued_at):
+        """Queue an admitted update for the lanes"""
+        self._queue.put((chat_id, update, queued_at))
+
+    def submit(self, chat_id, update):
+        """Admit and queue an update straight away"""
+        if not self.admit(chat_id, update):
+            return False
+        self.run(chat_id, update, time.monotonic())
+        return True
+
+    def depth(self):
+        with self._cond:
+            return self._admitted
+
+    def metrics(self):
+        with self._cond:
+            return dict(self.stats, depth=self._admitted, lanes=self.lanes)
+
+    def _worker(self):
+        while True:
+            chat_id, update, queued_at = self._queue.get()
+            wait_ms = (time.monotonic() - queued_at) * 1000
+            try:
+                self._handler([update])
+                failed = False
+            except Exception as e:
+                failed = True
+                logger.error(f"Error handling update {update.update_id} in {self.name} pool: {e}")
+            with self._cond:
+                self._admitted -= 1
+                self.stats['errors' if failed else 'handled'] += 1
+                self.stats['wait_ms_max'] = max(self.stats['wait_ms_max'], wait_ms)
+                self.stats['wait_ms_avg'] += WAIT_EWMA_ALPHA * (wait_ms - self.stats['wait_ms_avg'])
+                self._cond.notify()
+            if self._on_done is not None:
+                self._on_done(chat_id)
+
+
+class UpdateDispatcher:
+    """Routes updates to lane pools by kind while keeping each chat's updates in order.
+
+    classify(update) names the pool an update belongs to, e.g. relays to a
+    small latency-sensitive pool and matching queries to a separate heavy
+    pool, so a burst of /view_profiles can't delay chat relays. Order is
+    kept per chat across pools: a chat has at most one update in any pool
+    at a time, and its later updates wait in a FIFO of their own until it
+    is done. So an /end_chat can't overtake a message still being relayed,
+    and the reply to /random's question is handled only after /random has
+    registered its next-step handler.
+
+    Installing the dispatcher replaces bot.process_new_updates, so polling,
+    webhook and worker-process intake all go through it (the async runtime
+    calls dispatch itself), and makes the bot
+    run handlers inline on the lanes instead of its own thread pool.
+    """
+
+    def __init__(self, classify, pools, default='default'):
+        self.classify = classify
+        self.pools = {pool.name: pool for pool in pools}
+        self.default = default
+        self._process = None
+        self._chats = {}
+        self._lock = threading.Lock()
+
+    def install(self, bot):
+        self._process = bot.process_new_updates
+        bot.threaded = False
+        for pool in self.pools.values():
+            pool.start(self._process, self._done)
+        bot.process_new_updates = self.dispatch
+        return self
+
+    def dispatch(self, updates):
+        for update in updates:
+            try:
+                name = self.classify(update)
+            except Exception as e:
+                logger.error(f"Error classifying update {update.update_id}: {e}")
+                name = self.default
+            pool = self.pools.get(name) or self.pools[self.default]
+            chat_id = chat_id_of(update)
+            if not pool.admit(chat_id, update):
+                continue
+            queued_at = time.monotonic()
+            if chat_id is not None:
+                with self._lock:
+                    waiting = self._chats.get(chat_id)
+                    if waiting is not None:
+                        # The chat is busy: run once its earlier updates are done
+                        waiting.append((pool, update, queued_at))
+                        continue
+                    self._chats[chat_id] = deque()
+            pool.run(chat_id, update, queued_at)
+
+    def is_busy(self, chat_id):
+        """Whether an update of the chat is still queued or being handled"""
+        return chat_id in self._chats
+
+    def _done(self, chat_id):
+        if chat_id is None:
+            return
+        with self._lock:
+            waiting = self._chats[chat_id]
+            if not waiting:
+                del self._chats[chat_id]
+                return
+            pool, update, queued_at = waiting.popleft()
+        pool.run(chat_id, update, queued_at)
+
+    def metrics(self):
+        with self._lock:
+            busy_chats = len(self._chats)
+        return dict({name: pool.metrics() for name, pool in self.pools.items()}, busy_chats=busy_chats)
@@ -0,0 +1,202 @@
+import argparse
+import logging
+import math
+import re
+import os
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+GEOHASH_PRECISION = 9
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Approximate geohash cell size in km at the equator, by precision
+CELL_WIDTH_KM = [40075.0, 5009.4, 1252.3, 156.5, 39.1, 4.9, 1.2, 0.153, 0.038, 0.0048]
+CELL_HEIGHT_KM = [19970.0, 4992.6, 624.1, 156.0, 19.5, 4.9, 0.61, 0.153, 0.019, 0.0048]
+
+COORDINATES_PATTERN = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$')
+
+
+def parse_coordinates(location):
+    """Parse a "lat, lon" location string. Returns (lat, lon) or None"""
+    if not location:
+        return None
+    match = COORDINATES_PATTERN.match(location)
+    if not match:
+        return None
+    lat, lon = float(match.group(1)), float(match.group(2))
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in km"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def geohash_bounds(geohash):
+    """Return (min_lat, max_lat, min_lon, max_lon) of a geohash cell"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (value >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+
+def precision_for_radius(radius_km, lat=0.0):
+    """Finest precision whose cells are at least radius_km on each side"""
+    shrink = max(math.cos(math.radians(lat)), 0.01)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        if min(CELL_WIDTH_KM[precision] * shrink, CELL_HEIGHT_KM[precision]) >= radius_km:
+            return precision
+    return 1
+
+
+def covering_cells(lat, lon, radius_km):
+    """Geohash prefixes of the cell containing the point and its neighbours.
+
+    Cells are chosen at least radius_km wide, so together they cover every
+    point within radius_km of (lat, lon).
+    """
+    precision = precision_for_radius(radius_km, lat)
+    center = geohash_encode(lat, lon, precision)
+    min_lat, max_lat, min_lon, max_lon = geohash_bounds(center)
+    dlat, dlon = max_lat - min_lat, max_lon - min_lon
+    center_lat, center_lon = (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+
+    cells = set()
+    for i in (-1, 0, 1):
+        for j in (-1, 0, 1):
+            cell_lat = center_lat + i * dlat
+            if not -90 <= cell_lat <= 90:
+                continue
+            cell_lon = (center_lon + j * dlon + 180) % 360 - 180
+            cells.add(geohash_encode(cell_lat, cell_lon, precision))
+    return sorted(cells)
+
+
+def bounding_box(lat, lon, radius_km):
+    """(min_lat, max_lat, min_lon, max_lon) around a point, ignoring dateline wrap"""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    dlon = math.degrees(radius_km / (EARTH_RADIUS_KM * max(math.cos(math.radians(lat)), 0.01)))
+    return lat - dlat, lat + dlat, max(lon - dlon, -180.0), min(lon + dlon, 180.0)
+
+
+def within_radius_filter(model, lat, lon, radius_km):
+    """SQLAlchemy filter for rows of model within roughly radius_km of a point.
+
+    Restricts to the covering geohash cells (an indexed prefix scan) and
+    then to the bounding box. Callers trim the corners with haversine_km.
+    """
+    from sqlalchemy import and_, or_
+
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    return and_(
+        or_(*[model.geohash.like(f"{cell}%") for cell in covering_cells(lat, lon, radius_km)]),
+        model.latitude.between(min_lat, max_lat),
+        model.longitude.between(min_lon, max_lon),
+    )
+
+
+def users_within_radius(lat, lon, radius_km, limit=100):
+    """Return [(profile, distance_km)] of users within radius_km, nearest first"""
+    from models import User, get_db, close_db
+
+    db = get_db()
+    try:
+        users = db.query(User).filter(within_radius_filter(User, lat, lon, radius_km)).all()
+    finally:
+        close_db(db)
+
+    nearby = []
+    for user in users:
+        distance = haversine_km(lat, lon, user.latitude, user.longitude)
+        if distance <= radius_km:
+            nearby.append((user.to_dict(), distance))
+    nearby.sort(key=lambda item: item[1])
+    return nearby[:limit]
+
+
+def backfill_coordinates(batch_size=1000):
+    """Parse coordinates for existing users whose location predates the geo columns"""
+    from models import User, get_db, close_db
+
+    db = get_db()
+    updated = 0
+    last_chat_id = None
+    try:
+        while True:
+            query = db.query(User).filter(User.location.isnot(None), User.latitude.is_(None))
+            if last_chat_id is not None:
+                query = query.filter(User.chat_id > last_chat_id)
+            users = query.order_by(User.chat_id).limit(batch_size).all()
+            if not users:
+                break
+            for user in users:
+                # Assigning location re-runs the coordinate parsing on the model
+                user.location = user.location
+                if user.latitude is not None:
+                    updated += 1
+            last_chat_id = users[-1].chat_id
+            db.commit()
+        logger.info(f"✅ Backfilled coordinates for {updated} users")
+        return updated
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error backfilling coordinates: {e}")
+        return updated
+    finally:
+        close_db(db)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Geo maintenance")
+    parser.add_argument('command', choices=['backfill'], help="backfill: parse coordinates and geohashes "
+                                                               "for profiles saved before the geo columns")
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'))
+    args = parser.parse_args()
+
+    from models import init_database
+
+    logging.basicConfig(level=logging.INFO)
+    if not init_database(args.database_url):
+        raise SystemExit(1)
+    backfill_coordinates()
@@ -0,0 +1,170 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import OrderedDict
+from datetime import datetime
+import threading
+import logging
+import time
+import csv
+import os
+import re
+
+from geo import parse_coordinates
+from models import GeocodeCache, get_db, close_db
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text):
+    """Normalize a typed location so spelling variants share a cache entry"""
+    text = re.sub(r'\s+', ' ', (text or '').strip().lower())
+    return text.strip(' .,;')
+
+
+class NominatimGeocoder:
+    """OpenStreetMap geocoder via geopy, limited to one request per second"""
+
+    def __init__(self, user_agent='matching-bot', min_delay_seconds=1.0):
+        from geopy.geocoders import Nominatim
+
+        self._geocoder = Nominatim(user_agent=user_agent, timeout=10)
+        self._min_delay = min_delay_seconds
+        self._lock = threading.Lock()
+        self._last_call = 0.0
+
+    def geocode(self, query):
+        with self._lock:
+            wait = self._last_call + self._min_delay - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_call = time.monotonic()
+        location = self._geocoder.geocode(query)
+        if location is None:
+            return None
+        return location.latitude, location.longitude
+
+
+class GazetteerGeocoder:
+    """Offline geocoder backed by a CSV file of name,latitude,longitude rows"""
+
+    def __init__(self, path):
+        self.places = {}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if len(row) < 3 or row[0].startswith('#'):
+                    continue
+                try:
+                    self.places[normalize_query(row[0])] = (float(row[1]), float(row[2]))
+                except ValueError:
+                    continue
+        logger.info(f"Loaded {len(self.places)} places from gazetteer {path}")
+
+    def geocode(self, query):
+        return self.places.get(normalize_query(query))
+
+
+class GeocodingService:
+    """Resolves typed locations to coordinates without blocking handlers.
+
+    Lookups check an in-process LRU, then the geocode_cache table, and only
+    then the geocoder. Misses are cached as well. Concurrent requests for
+    the same query share one in-flight lookup, and resolve_async runs the
+    whole chain on a small background pool.
+    """
+
+    def __init__(self, geocoder, lru_size=10000, workers=2):
+        self.geocoder = geocoder
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='geocode')
+        self.stats = {'lru_hits': 0, 'db_hits': 0, 'lookups': 0}
+
+    def cached(self, text):
+        """Return cached (lat, lon) from the LRU, or None. Never blocks"""
+        with self._lock:
+            return self._lru.get(normalize_query(text))
+
+    def resolve(self, text):
+        """Return (lat, lon) for a location, or None when it can't be found"""
+        coordinates = parse_coordinates(text)
+        if coordinates:
+            return coordinates
+
+        query = normalize_query(text)
+        if not query:
+            return None
+
+        with self._lock:
+            if query in self._lru:
+                self._lru.move_to_end(query)
+                self.stats['lru_hits'] += 1
+                return self._lru[query]
+            future = self._in_flight.get(query)
+            owner = future is None
+            if owner:
+                future = self._in_flight[query] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = self._lookup(query)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            logger.error(f"Error geocoding '{query}': {e}")
+            future.set_result(None)
+            return None
+        finally:
+            with self._lock:
+                self._in_flight.pop(query, None)
+
+    def resolve_async(self, text, callback):
+        """Resolve in the background and call callback(coordinates) if found"""
+        def run():
+            coordinates = self.resolve(text)
+            if coordinates:
+                callback(coordinates)
+        return self._executor.submit(run)
+
+    def _remember(self, query, result):
+        with self._lock:
+            self._lru[query] = result
+            self._lru.move_to_end(query)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def _lookup(self, query):
+        db = get_db()
+        try:
+            row = db.get(GeocodeCache, query)
+            if row is not None:
+                self.stats['db_hits'] += 1
+                result = (row.latitude, row.longitude) if row.latitude is not None else None
+                self._remember(query, result)
+                return result
+
+            self.stats['lookups'] += 1
+            result = self.geocoder.geocode(query)
+            db.merge(GeocodeCache(
+                query=query,
+                latitude=result[0] if result else None,
+                longitude=result[1] if result else None,
+                created_at=datetime.utcnow()
+            ))
+            db.commit()
+            self._remember(query, result)
+            return result
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            close_db(db)
+
+
+def create_geocoder():
+    """Pick the geocoder from GEOCODER (nominatim or gazetteer) and GAZETTEER_FILE"""
+    if os.getenv('GEOCODER', 'nominatim') == 'gazetteer':
+        return GazetteerGeocoder(os.getenv('GAZETTEER_FILE', 'gazetteer.csv'))
+    return NominatimGeocoder()
@@ -0,0 +1,264 @@
+from collections import Counter
+from datetime import timedelta
+import threading
+import argparse
+import logging
+import time
+import os
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+
+from models import User, Interest, UserInterest, UserInterestUpdate, get_db, close_db, init_database
+from scoring import split_interests
+
+logger = logging.getLogger(__name__)
+
+# Seconds between reloads of users whose interests changed, e.g. on another worker
+RECONCILE_INTERVAL = 60
+# Changes stamped this long before the last one seen are read again, in case they committed late
+RECONCILE_OVERLAP = 60
+
+
+class InterestIndex:
+    """Inverted index from interest to users, mirrored from the database.
+
+    The interests table is the vocabulary and user_interests the
+    association. In memory, each interest ID maps to the set of chat_ids
+    that have it (a posting list) and each user to their interest IDs.
+    set_user_interests writes the database first and then the posting
+    lists, so the two stay in step. "Users sharing at least k interests
+    with X" only walks X's own posting lists.
+
+    Each change is also stamped in user_interest_updates. With several
+    workers, a periodic reconcile reloads just the users stamped since the
+    last one, so edits made on other workers show up within
+    RECONCILE_INTERVAL.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._names = {}
+        self._postings = {}
+        self._user_interests = {}
+        self._synced_at = None
+        self._thread = None
+
+    def load(self, batch_size=10000):
+        """Load the vocabulary and posting lists from the database"""
+        db = get_db()
+        try:
+            # Read first: changes stamped after this are picked up by the next reconcile
+            synced_at = db.query(func.max(UserInterestUpdate.updated_at)).scalar()
+            ids = {name: interest_id for interest_id, name in db.query(Interest.id, Interest.name)}
+            postings = {}
+            user_interests = {}
+            last = (0, 0)
+            while True:
+                rows = (db.query(UserInterest.chat_id, UserInterest.interest_id)
+                        .filter((UserInterest.chat_id > last[0]) |
+                                ((UserInterest.chat_id == last[0]) & (UserInterest.interest_id > last[1])))
+                        .order_by(UserInterest.chat_id, UserInterest.interest_id)
+                        .limit(batch_size)
+                        .all())
+                if not rows:
+                    break
+                for chat_id, interest_id in rows:
+                    postings.setdefault(interest_id, set()).add(chat_id)
+                    user_interests.setdefault(chat_id, set()).add(interest_id)
+                last = tuple(rows[-1])
+        finally:
+            close_db(db)
+
+        with self._lock:
+            self._ids = ids
+            self._names = {interest_id: name for name, interest_id in ids.items()}
+            self._postings = postings
+            self._user_interests = {chat_id: frozenset(s) for chat_id, s in user_interests.items()}
+            self._synced_at = synced_at
+        logger.info(f"✅ Loaded {len(ids)} interests for {len(user_interests)} users")
+
+    def _intern(self, db, names):
+        """Return {name: id}, adding unseen names to the vocabulary table"""
+        missing = [name for name in names if name not in self._ids]
+        if missing:
+            db.execute(insert(Interest).values([{'name': name} for name in missing])
+                       .on_conflict_do_nothing(index_elements=[Interest.name]))
+            for interest_id, name in db.query(Interest.id, Interest.name).filter(Interest.name.in_(missing)):
+                with self._lock:
+                    self._ids[name] = interest_id
+                    self._names[interest_id] = name
+        return {name: self._ids[name] for name in names}
+
+    def set_user_interests(self, chat_id, interests):
+        """Replace a user's interests (comma-joined string or list) in DB and index"""
+        names = split_interests(interests if isinstance(interests, str) else ', '.join(interests))
+        db = get_db()
+        try:
+            ids = set(self._intern(db, names).values())
+            db.query(UserInterest).filter(UserInterest.chat_id == chat_id).delete(synchronize_session=False)
+            if ids:
+                db.execute(insert(UserInterest).values(
+                    [{'chat_id': chat_id, 'interest_id': interest_id} for interest_id in ids]
+                ))
+            stamp = insert(UserInterestUpdate).values(chat_id=chat_id, updated_at=func.now())
+            db.execute(stamp.on_conflict_do_update(
+                index_elements=[UserInterestUpdate.chat_id],
+                set_={'updated_at': stamp.excluded.updated_at}
+            ))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error saving interests for {chat_id}: {e}")
+            return False
+        finally:
+            close_db(db)
+
+        with self._lock:
+            self._replace(chat_id, ids)
+        return True
+
+    def _replace(self, chat_id, ids):
+        for interest_id in self._user_interests.get(chat_id, ()):
+            self._postings.get(interest_id, set()).discard(chat_id)
+        for interest_id in ids:
+            self._postings.setdefault(interest_id, set()).add(chat_id)
+        self._user_interests[chat_id] = frozenset(ids)
+
+    def reconcile(self, batch_size=1000):
+        """Reload the users whose interests changed since the last load or reconcile. Returns how many"""
+        db = get_db()
+        try:
+            query = db.query(UserInterestUpdate.chat_id, UserInterestUpdate.updated_at)
+            if self._synced_at is not None:
+                query = query.filter(
+                    UserInterestUpdate.updated_at >= self._synced_at - timedelta(seconds=RECONCILE_OVERLAP))
+            changed = query.all()
+            ids = {chat_id: set() for chat_id, _ in changed}
+            chat_ids = list(ids)
+            for start in range(0, len(chat_ids), batch_size):
+                batch = chat_ids[start:start + batch_size]
+                for chat_id, interest_id in (db.query(UserInterest.chat_id, UserInterest.interest_id)
+                                             .filter(UserInterest.chat_id.in_(batch))):
+                    ids[chat_id].add(interest_id)
+            unknown = list(set().union(*ids.values()) - self._names.keys())
+            names = db.query(Interest.id, Interest.name).filter(Interest.id.in_(unknown)).all() if unknown else []
+        finally:
+            close_db(db)
+
+        with self._lock:
+            for interest_id, name in names:
+                self._ids[name] = interest_id
+                self._names[interest_id] = name
+            for chat_id, interest_ids in ids.items():
+                self._replace(chat_id, interest_ids)
+            if changed:
+                self._synced_at = max(self._synced_at or changed[0][1], *(updated_at for _, updated_at in changed))
+        return len(changed)
+
+    def start_reconciler(self, interval=RECONCILE_INTERVAL):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._reconcile_forever, args=(interval,),
+                                        name='interest-reconciler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _reconcile_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.error(f"Error reconciling interest index: {e}")
+
+    def remove_user(self, chat_id):
+        with self._lock:
+            for interest_id in self._user_interests.pop(chat_id, ()):
+                self._postings.get(interest_id, set()).discard(chat_id)
+
+    def is_indexed(self, chat_id):
+        return chat_id in self._user_interests
+
+    def interests_of(self, chat_id):
+        """Interest names of a user, from the index"""
+        return sorted(self._names[i] for i in self._user_interests.get(chat_id, ()))
+
+    def count(self, chat_id, fallback=None):
+        """Number of interests a user has; parses fallback if they aren't indexed yet"""
+        ids = self._user_interests.get(chat_id)
+        if ids is None:
+            return len(split_interests(fallback or ''))
+        return len(ids)
+
+    def ids_of(self, chat_id, fallback=None):
+        """Interest IDs of a user; for users not indexed yet, those of the known names in fallback"""
+        ids = self._user_interests.get(chat_id)
+        if ids is not None:
+            return ids
+        names = split_interests(fallback or '')
+        return frozenset(self._ids[name] for name in names if name in self._ids)
+
+    def users_with(self, name):
+        interest_id = self._ids.get(name.strip().lower())
+        return set(self._postings.get(interest_id, ()))
+
+    def users_sharing(self, chat_id, min_shared=1, limit=None):
+        """Users sharing at least min_shared interests with chat_id, most shared first.
+
+        Returns [(chat_id, shared_count)].
+        """
+        with self._lock:
+            ids = self._user_interests.get(chat_id, ())
+            counts = Counter()
+            for interest_id in ids:
+                counts.update(self._postings.get(interest_id, ()))
+        counts.pop(chat_id, None)
+        shared = [(other, count) for other, count in counts.most_common() if count >= min_shared]
+        return shared[:limit] if limit else shared
+
+
+def backfill_user_interests(index, batch_size=1000):
+    """Index the interests column of every existing profile"""
+    db = get_db()
+    last_chat_id = None
+    indexed = 0
+    try:
+        while True:
+            query = db.query(User.chat_id, User.interests).filter(User.interests.isnot(None))
+            if last_chat_id is not None:
+                query = query.filter(User.chat_id > last_chat_id)
+            rows = query.order_by(User.chat_id).limit(batch_size).all()
+            if not rows:
+                break
+            for chat_id, interests in rows:
+                if index.set_user_interests(chat_id, interests):
+                    indexed += 1
+            last_chat_id = rows[-1][0]
+    finally:
+        close_db(db)
+    logger.info(f"✅ Indexed interests for {indexed} users")
+    return indexed
+
+
+interest_index = InterestIndex()
+
+
+def profile_interest_ids(profile):
+    """Interest IDs of a profile dict, as ProfileMatrix wants them"""
+    return interest_index.ids_of(profile.get('chat_id'), profile.get('interests'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Interest maintenance")
+    parser.add_argument('command', choices=['backfill'], help="backfill: index the interests of profiles "
+                                                               "saved before the interests tables")
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not init_database(args.database_url):
+        raise SystemExit(1)
+    interest_index.load()
+    backfill_user_interests(interest_index)
@@ -1,15 +1,5 @@
-from flask import Flask
-from threading import Thread
-
-app = Flask(__name__)
-
-@app.route('/')
-def home():
-    return "I'm alive!"
-
-def run():
-    app.run(host='0.0.0.0', port=8080)
+from webhook import app, serve_in_background
 
 def keep_alive():  # Make sure this function exists
-    t = Thread(target=run)
-    t.start()
+    """Answer health checks and /metrics from the production server while polling"""
+    return serve_in_background()
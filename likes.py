@@ -0,0 +1,191 @@
+import argparse
+import hashlib
+import logging
+import os
+
+from sqlalchemy import bindparam, or_, text, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY, BIGINT
+from sqlalchemy.dialects.postgresql import insert
+
+from models import Like, Match, get_db, close_db, init_database
+
+logger = logging.getLogger(__name__)
+
+
+def _pair(chat_id, other_chat_id):
+    return min(chat_id, other_chat_id), max(chat_id, other_chat_id)
+
+
+def _pair_lock_key(pair):
+    """Advisory lock key of an unordered pair, the same in every process"""
+    digest = hashlib.blake2b(f"{pair[0]}:{pair[1]}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def _lock_pairs(db, likes):
+    """Hold a transaction-scoped lock on each liked pair until commit.
+
+    Likes of A and B can flush concurrently from different workers; each
+    transaction would then miss the other's uncommitted like and neither
+    would record the match. With the pair locked, the second transaction
+    waits for the first to commit and then sees its like. Keys are taken
+    in sorted order so concurrent batches can't deadlock.
+    """
+    keys = sorted({_pair_lock_key(_pair(liker, liked)) for liker, liked in likes})
+    db.execute(
+        # unnest scans the array in order, taking one lock per row
+        text("SELECT pg_advisory_xact_lock(key) FROM unnest(:keys) AS key")
+        .bindparams(bindparam('keys', type_=ARRAY(BIGINT))),
+        {'keys': keys}
+    )
+
+
+def record_like(liker_chat_id, liked_chat_id, note=None):
+    """Store a like idempotently and detect a mutual match.
+
+    Returns (created, mutual): created is False when the like already
+    existed, and mutual is True when this like completed a new match.
+    Each step is a single index lookup or insert on likes and matches.
+    """
+    liker_chat_id, liked_chat_id = int(liker_chat_id), int(liked_chat_id)
+    db = get_db()
+    try:
+        created = insert_likes(db, {(liker_chat_id, liked_chat_id): note})
+        db.commit()
+        if not created:
+            return False, False
+        return True, created[0][2]
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error recording like {liker_chat_id} -> {liked_chat_id}: {e}")
+        return False, False
+    finally:
+        close_db(db)
+
+
+def insert_likes(db, likes):
+    """Upsert {(liker, liked): note} in bulk and record the matches they complete.
+
+    Runs in the caller's transaction, which holds a lock on each pair until
+    it ends. Returns [(liker, liked, mutual)] for
+    the likes that were new; mutual is True for the like that completed a
+    new match, once per match.
+    """
+    _lock_pairs(db, likes)
+    created = []
+    with_note = [(pair, note) for pair, note in likes.items() if note]
+    without_note = [(pair, note) for pair, note in likes.items() if not note]
+    for rows in (with_note, without_note):
+        if not rows:
+            continue
+        stmt = insert(Like).values([
+            {'liker_chat_id': liker, 'liked_chat_id': liked, 'note': note}
+            for (liker, liked), note in rows
+        ])
+        if rows is with_note:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Like.liker_chat_id, Like.liked_chat_id],
+                set_={'note': stmt.excluded.note}
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[Like.liker_chat_id, Like.liked_chat_id])
+        # xmax = 0 only for freshly inserted rows, not for ones updated on conflict
+        result = db.execute(stmt.returning(Like.liker_chat_id, Like.liked_chat_id, text('xmax = 0')))
+        created.extend((liker, liked) for liker, liked, inserted in result if inserted)
+    if not created:
+        return []
+
+    reciprocal = {
+        (liked, liker) for liker, liked in db.query(Like.liker_chat_id, Like.liked_chat_id)
+        .filter(tuple_(Like.liker_chat_id, Like.liked_chat_id).in_([(b, a) for a, b in created]))
+    }
+    pairs = {_pair(*like) for like in created if like in reciprocal}
+    matched = set()
+    if pairs:
+        result = db.execute(
+            insert(Match).values([{'user_a': a, 'user_b': b} for a, b in sorted(pairs)])
+            .on_conflict_do_nothing(index_elements=[Match.user_a, Match.user_b])
+            .returning(Match.user_a, Match.user_b)
+        )
+        matched = {tuple(row) for row in result}
+
+    results = []
+    for like in created:
+        pair = _pair(*like)
+        mutual = pair in matched
+        matched.discard(pair)
+        results.append((like[0], like[1], mutual))
+    return results
+
+
+def is_match(chat_id, other_chat_id):
+    user_a, user_b = _pair(int(chat_id), int(other_chat_id))
+    db = get_db()
+    try:
+        return db.get(Match, (user_a, user_b)) is not None
+    finally:
+        close_db(db)
+
+
+def get_matches(chat_id, limit=50):
+    """chat_ids this user has matched with, newest first"""
+    chat_id = int(chat_id)
+    db = get_db()
+    try:
+        rows = (db.query(Match)
+                .filter(or_(Match.user_a == chat_id, Match.user_b == chat_id))
+                .order_by(Match.created_at.desc())
+                .limit(limit)
+                .all())
+        return [m.user_b if m.user_a == chat_id else m.user_a for m in rows]
+    finally:
+        close_db(db)
+
+
+def backfill_matches(batch_size=10000):
+    """Build matches from existing reciprocal likes, one liker range per transaction"""
+    db = get_db()
+    created = 0
+    last_liker = None
+    try:
+        while True:
+            query = db.query(Like.liker_chat_id).distinct()
+            if last_liker is not None:
+                query = query.filter(Like.liker_chat_id > last_liker)
+            likers = [row[0] for row in query.order_by(Like.liker_chat_id).limit(batch_size)]
+            if not likers:
+                break
+            result = db.execute(text("""
+                INSERT INTO matches (user_a, user_b, created_at)
+                SELECT l1.liker_chat_id, l1.liked_chat_id, GREATEST(l1.timestamp, l2.timestamp)
+                FROM likes l1
+                JOIN likes l2
+                  ON l2.liker_chat_id = l1.liked_chat_id AND l2.liked_chat_id = l1.liker_chat_id
+                WHERE l1.liker_chat_id < l1.liked_chat_id
+                  AND l1.liker_chat_id BETWEEN :first AND :last
+                ON CONFLICT DO NOTHING
+            """), {'first': likers[0], 'last': likers[-1]})
+            db.commit()
+            created += result.rowcount
+            last_liker = likers[-1]
+        logger.info(f"✅ Backfilled {created} mutual matches")
+        return created
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error backfilling matches: {e}")
+        return created
+    finally:
+        close_db(db)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Like maintenance")
+    parser.add_argument('command', choices=['backfill'], help="backfill: record matches for reciprocal "
+                                                               "likes made before the matches table")
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not init_database(args.database_url):
+        raise SystemExit(1)
+    backfill_matches()
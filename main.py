@@ -1,16 +1,78 @@
+import os
+
+import broadcast
+from bans import ban_index, check_banned, add_ban_listener
+from broadcast import TipBroadcaster
+from browse import ProfileBrowser
+from coordinator import CoordinatorServer, create_coordinator, coordinator_url, parse_address
+from dispatcher import LanePool, UpdateDispatcher
+from geocoding import GeocodingService, create_geocoder
+from interests import interest_index
+from matchmaking import start_reaper
+from matching import user_coordinates
+from reports import VIOLATIONS, record_report, load_report_aggregate
+from ratelimit import GCRAStore, RateLimiter
+from profiles import get_user_info, save_user_to_db, update_user_field, update_user_coordinates, profile_cache
+from scoring import shared_interest_count
+from state_store import create_state_store
+from outbound import OutboundScheduler, GLOBAL_RATE, PRIORITY_RELAY, PRIORITY_MATCH
+from writebehind import get_write_queue, worker_journal_path
+from models import pool_stats
+import webhook
+
+# Conversation state: partial profiles and browsing state, and matching preferences
+user_data = create_state_store('user_data', ttl=24 * 3600)
+user_cache = create_state_store('preferences', ttl=90 * 24 * 3600)
+
+# Paginated /view_profiles sessions
+profile_browser = ProfileBrowser(user_data)
+
+# Matchmaking queue and active random chats, shared by all bot workers
+coordinator = create_coordinator()
+match_queue = coordinator.queue
+chat_sessions = coordinator.sessions
+
+# Resolves typed city names to coordinates in the background
+geocoder = GeocodingService(create_geocoder())
+
+def geocode_user_location(chat_id, location):
+    """Resolve a typed location off the handler thread and store its coordinates"""
+    geocoder.resolve_async(location, lambda coordinates: update_user_coordinates(chat_id, *coordinates, location=location))
+
+# Outbound message scheduler; workers split Telegram's global rate limit
+outbox = OutboundScheduler(global_rate=GLOBAL_RATE / int(os.getenv('BOT_WORKERS', '1')))
+
+# Per-chat command limits, shared by all workers through the coordinator unless RATE_LIMIT_BACKEND=local
+rate_limiter = RateLimiter(
+    GCRAStore() if os.getenv('RATE_LIMIT_BACKEND', 'shared') == 'local' else coordinator.rate_limits
+)
+
+# Choices offered for the maximum distance of browsed profiles
+DISTANCE_CHOICES_KM = (5, 10, 25, 50, 100, 250)
+
 # Queue information helper
-def get_queue_info():
-    """Get queue information for user feedback"""
-    with pending_users_lock:
-        queue_size = len(pending_users)
-        estimated_wait = queue_size * 30  # 30 seconds per person in queue
-        
-        return (
-            f"🔍 Searching for compatible matches...\n\n"
-            f"📊 Queue position: {queue_size}\n"
-            f"⏱️ Estimated wait: {estimated_wait} seconds\n\n"
-            f"💡 Tip: Complete your profile for better matches!"
-        )
+def format_wait(seconds):
+    if seconds is None:
+        return "estimating..."
+    if seconds < 60:
+        return f"~{max(1, round(seconds))} seconds"
+    return f"~{round(seconds / 60)} minutes"
+
+def get_queue_info(chat_id):
+    """Get a waiter's queue position and estimated wait for user feedback"""
+    # A waiter matched right after joining has already left the queue
+    if chat_id in chat_sessions:
+        return "🎉 You've been matched! Your chat is starting now. (Type 'End Chat' to stop)"
+    status = match_queue.status(chat_id)
+    if status is None:
+        return "❌ You are not in the queue. Use /random to find a chat partner."
+    
+    return (
+        f"🔍 Searching for compatible matches...\n\n"
+        f"📊 Queue position: {status['position']} of {status['waiting']}\n"
+        f"⏱️ Estimated wait: {format_wait(status['eta'])}\n\n"
+        f"💡 Tip: Complete your profile for better matches!"
+    )
 
 # Profile setup functions
 @bot.message_handler(commands=['start', 'setup'])
@@ -20,7 +82,7 @@ def send_welcome(message):
         username = message.from_user.username
 
         # Rate limiting
-        if not rate_limiter.is_allowed(chat_id):
+        if not rate_limiter.is_allowed(chat_id, 'start'):
             bot.send_message(chat_id, "⏳ Too many requests. Please wait a moment.")
             return
 
@@ -75,7 +137,7 @@ def handle_returning_user(message):
 def ask_name(message):
     try:
         chat_id = message.chat.id
-        user_data.set(chat_id, {'name': message.text})
+        user_data.update(chat_id, name=message.text)
         msg = bot.reply_to(message, "Please enter your age:")
         bot.register_next_step_handler(msg, validate_age)
     except Exception as e:
@@ -158,6 +220,7 @@ def validate_looking_for(message):
         if looking_for in ['1', '2']:
             user_data_obj = user_data.get(chat_id) or {}
             user_data_obj['looking_for'] = looking_for
+            user_data.set(chat_id, user_data_obj)
             
             markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
             location_button = types.KeyboardButton("📍 Share Location", request_location=True)
@@ -245,6 +308,8 @@ def ask_interests(message):
         
         # Save to database
         save_user_to_db(chat_id, user_data_obj)
+        interest_index.set_user_interests(chat_id, user_data_obj['interests'])
+        geocode_user_location(chat_id, user_data_obj['location'])
         
         # Show profile summary
         profile_summary = (
@@ -273,8 +338,8 @@ def ask_interests(message):
         
         bot.send_message(chat_id, commands_text)
         
-        # Add user to interacted set for tips
-        users_interacted.add(chat_id)
+        # Subscribe user to daily tips
+        broadcast.subscribe(chat_id)
         
         logger.info(f"User profile created for {chat_id}: {user_data_obj}")
         
@@ -288,7 +353,7 @@ def my_profile(message):
     chat_id = message.chat.id
     
     # Rate limiting
-    if not rate_limiter.is_allowed(chat_id):
+    if not rate_limiter.is_allowed(chat_id, 'my_profile'):
         bot.send_message(chat_id, "⏳ Too many requests. Please wait a moment.")
         return
     
@@ -304,7 +369,7 @@ def my_profile(message):
             f"⚧️ Gender: {user_info['gender']}\n"
             f"📍 Location: {user_info['location']}\n"
             f"🎯 Looking for: {'💑 Dating' if user_info['looking_for'] == '1' else '👥 Friends'}\n"
-            f"🎨 Interests: {', '.join(user_info['interests'].split(', '))}\n\n"
+            f"🎨 Interests: {user_info['interests']}\n\n"
             f"📊 Profile Quality: {quality['rating']}\n"
             f"📈 Score: {quality['score']}/100 ({quality['percentage']:.0f}%)\n"
         )
@@ -313,7 +378,7 @@ def my_profile(message):
             profile_summary += "\n💡 Tips to improve:\n"
             if not user_info.get('photo'):
                 profile_summary += "• Add a profile photo\n"
-            if len(user_info.get('interests', '').split(', ')) < 5:
+            if interest_index.count(chat_id, user_info.get('interests')) < 5:
                 profile_summary += "• Add more interests\n"
             if ',' not in user_info.get('location', ''):
                 profile_summary += "• Share your exact location\n"
@@ -331,7 +396,7 @@ def edit_profile(message):
     chat_id = message.chat.id
     
     # Rate limiting
-    if not rate_limiter.is_allowed(chat_id):
+    if not rate_limiter.is_allowed(chat_id, 'edit_profile'):
         bot.send_message(chat_id, "⏳ Too many requests. Please wait a moment.")
         return
     
@@ -449,10 +514,10 @@ def save_edit(message, edit_field):
     if db_field:
         success = update_user_field(chat_id, db_field, new_value)
         if success:
-            # Update cache
-            user_data_obj = user_data.get(chat_id) or {}
-            user_data_obj[edit_field] = new_value
-            user_data.set(chat_id, user_data_obj)
+            if db_field == 'location':
+                geocode_user_location(chat_id, new_value)
+            elif db_field == 'interests':
+                interest_index.set_user_interests(chat_id, new_value)
             
             bot.reply_to(message, f"✅ Your {edit_field.replace('_', ' ')} has been updated.")
         else:
@@ -467,22 +532,16 @@ def show_profiles(message):
     chat_id = message.chat.id
     
     # Rate limiting
-    if not rate_limiter.is_allowed(chat_id):
+    if not rate_limiter.is_allowed(chat_id, 'view_profiles'):
         bot.send_message(chat_id, "⏳ Too many requests. Please wait a moment.")
         return
     
     user_info = get_user_info(chat_id)
     if user_info:
         gender_preference = get_gender_preference(user_info)
-        matched_profiles = get_matched_profiles(user_info, gender_preference)
+        prefs = user_cache.get(chat_id) or {}
         
-        if matched_profiles:
-            # Store in user data
-            user_data_obj = user_data.get(chat_id) or {}
-            user_data_obj['matched_profiles'] = matched_profiles
-            user_data_obj['current_profile_index'] = -1
-            user_data.set(chat_id, user_data_obj)
-            
+        if profile_browser.start(chat_id, user_info, gender_preference, prefs):
             # Show first profile
             display_next_profile(chat_id)
         else:
@@ -496,13 +555,37 @@ def show_profiles(message):
     else:
         bot.reply_to(message, "Please set up your profile first using /start.")
 
+def display_next_profile(chat_id):
+    """Show the next profile of the user's browsing session"""
+    profile = profile_browser.next_profile(chat_id)
+    if not profile:
+        bot.send_message(chat_id, "That's everyone for now! 🎉\n\nCheck back later or adjust /preferences.")
+        return
+    
+    markup = types.InlineKeyboardMarkup()
+    markup.row(
+        InlineKeyboardButton("👍 Like", callback_data=f"like_{profile['chat_id']}"),
+        InlineKeyboardButton("👎 Dislike", callback_data=f"dislike_{profile['chat_id']}")
+    )
+    markup.row(InlineKeyboardButton("➡️ Next", callback_data="next_profile"))
+    
+    caption = (
+        f"👤 {profile['name']}, {profile['age']}\n"
+        f"📍 {profile['location']}\n"
+        f"🎨 Interests: {profile['interests']}"
+    )
+    if profile.get('photo'):
+        bot.send_photo(chat_id, profile['photo'], caption=caption, reply_markup=markup)
+    else:
+        bot.send_message(chat_id, caption, reply_markup=markup)
+
 # Random chat command
 @bot.message_handler(commands=['random'])
 def ask_match_preference(message):
     chat_id = message.chat.id
     
     # Rate limiting
-    if not rate_limiter.is_allowed(chat_id):
+    if not rate_limiter.is_allowed(chat_id, 'random'):
         bot.send_message(chat_id, "⏳ Too many requests. Please wait a moment.")
         return
     
@@ -525,8 +608,13 @@ def find_compatible_random_chat(message):
     chat_id = message.chat.id
     gender_preference = message.text
     
+    # /cancel typed at the preference prompt
+    if gender_preference and gender_preference.split('@')[0] == '/cancel':
+        cancel_search(message)
+        return
+    
     # Rate limiting
-    if not rate_limiter.is_allowed(chat_id):
+    if not rate_limiter.is_allowed(chat_id, 'find_random'):
         bot.send_message(chat_id, "⏳ Too many requests. Please wait a moment.")
         return
     
@@ -544,74 +632,60 @@ def find_compatible_random_chat(message):
     gender_preference = gender_map.get(gender_preference, "BOTH")
     
     # Save preference
-    user_cache.set(chat_id, {'gender_preference': gender_preference})
+    user_cache.update(chat_id, gender_preference=gender_preference)
     
-    with pending_users_lock:
-        if chat_id in pending_users:
-            bot.reply_to(message, "⏳ You're already in the queue. Please wait for a match.")
-            return
+    if chat_id in ban_index:
+        bot.send_message(chat_id, "❌ You have been banned and cannot use this bot.")
+        return
+    
+    if chat_id in match_queue:
+        bot.reply_to(message, "⏳ You're already in the queue. Please wait for a match.")
+        return
     
     user_info = get_user_info(chat_id)
     if not user_info:
         bot.reply_to(message, "❌ Please set up your profile using /start.")
         return
     
-    # Get compatible matches
-    matched_profiles = get_matched_profiles(user_info, gender_preference, limit=10)
-    
-    if matched_profiles:
-        # Weighted random selection based on compatibility
-        profiles = [p[0] for p in matched_profiles]
-        scores = [p[1] for p in matched_profiles]
-        
-        # Normalize scores for probability
-        total_score = sum(scores)
-        if total_score > 0:
-            probabilities = [score/total_score for score in scores]
-            chosen_idx = random.choices(range(len(profiles)), weights=probabilities)[0]
-            partner_info = profiles[chosen_idx]
-            partner_chat_id = partner_info['chat_id']
-            
-            with pending_users_lock:
-                if partner_chat_id in pending_users:
-                    pending_users.remove(partner_chat_id)
-                    
-                    # Create chat session
-                    with active_chats_lock:
-                        active_chats[chat_id] = partner_chat_id
-                        active_chats[partner_chat_id] = chat_id
-                    
-                    # Show match notification
-                    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-                    markup.add("🚪 End Chat")
-                    
-                    welcome_msg = (
-                        f"🎉 You've been matched with {partner_info['name']}!\n\n"
-                        f"💬 Start chatting now! (Type 'End Chat' to stop)\n\n"
-                        f"🎯 Shared interests: {len(set(user_info['interests'].split(', ')) & set(partner_info['interests'].split(', ')))}"
-                    )
-                    
-                    bot.send_message(chat_id, welcome_msg, reply_markup=markup)
-                    bot.send_message(partner_chat_id, 
-                        f"🎉 You've been matched with {user_info['name']}!\n\n"
-                        f"💬 Start chatting now! (Type 'End Chat' to stop)\n\n"
-                        f"🎯 Shared interests: {len(set(partner_info['interests'].split(', ')) & set(user_info['interests'].split(', ')))}",
-                        reply_markup=markup
-                    )
-                else:
-                    pending_users.append(chat_id)
-                    queue_info = get_queue_info()
-                    bot.reply_to(message, queue_info)
-        else:
-            with pending_users_lock:
-                pending_users.append(chat_id)
-            queue_info = get_queue_info()
-            bot.reply_to(message, queue_info)
-    else:
-        with pending_users_lock:
-            pending_users.append(chat_id)
-        queue_info = get_queue_info()
-        bot.reply_to(message, queue_info)
+    # Pair with a compatible waiter, or join the queue
+    partner_info = None
+    while partner_info is None:
+        partner_chat_id = match_queue.enqueue(
+            chat_id, user_info['gender'], gender_preference, user_info['looking_for']
+        )
+        if partner_chat_id is None:
+            bot.reply_to(message, get_queue_info(chat_id))
+            return
+        
+        if partner_chat_id in ban_index:
+            # Banned while waiting; the ban listener may not have removed them yet
+            continue
+        
+        partner_info = get_user_info(partner_chat_id)
+        if not partner_info:
+            logger.warning(f"Dropping queued user {partner_chat_id} with no profile")
+    
+    # Create chat session
+    chat_sessions.pair(chat_id, partner_chat_id)
+    
+    # Show match notification
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    markup.add("🚪 End Chat")
+    
+    welcome_msg = (
+        f"🎉 You've been matched with {partner_info['name']}!\n\n"
+        f"💬 Start chatting now! (Type 'End Chat' to stop)\n\n"
+        f"🎯 Shared interests: {shared_interest_count(user_info['interests'], partner_info['interests'])}"
+    )
+    
+    outbox.submit(chat_id, bot.send_message, chat_id, welcome_msg,
+        priority=PRIORITY_MATCH, reply_markup=markup)
+    outbox.submit(partner_chat_id, bot.send_message, partner_chat_id, 
+        f"🎉 You've been matched with {user_info['name']}!\n\n"
+        f"💬 Start chatting now! (Type 'End Chat' to stop)\n\n"
+        f"🎯 Shared interests: {shared_interest_count(partner_info['interests'], user_info['interests'])}",
+        priority=PRIORITY_MATCH, reply_markup=markup
+    )
 
 # New commands for better UX
 @bot.message_handler(commands=['quality'])
@@ -620,7 +694,7 @@ def show_profile_quality(message):
     chat_id = message.chat.id
     
     # Rate limiting
-    if not rate_limiter.is_allowed(chat_id):
+    if not rate_limiter.is_allowed(chat_id, 'quality'):
         bot.send_message(chat_id, "⏳ Too many requests. Please wait a moment.")
         return
     
@@ -640,7 +714,7 @@ def show_profile_quality(message):
             quality_report += "💡 Tips to improve:\n"
             if not user_info.get('photo'):
                 quality_report += "• Add a profile photo (+30 points)\n"
-            interests_count = len(user_info.get('interests', '').split(', '))
+            interests_count = interest_index.count(chat_id, user_info.get('interests'))
             if interests_count < 5:
                 quality_report += f"• Add more interests (current: {interests_count}, +5 each)\n"
             if ',' not in user_info.get('location', ''):
@@ -656,7 +730,7 @@ def set_preferences(message):
     chat_id = message.chat.id
     
     # Rate limiting
-    if not rate_limiter.is_allowed(chat_id):
+    if not rate_limiter.is_allowed(chat_id, 'preferences'):
         bot.send_message(chat_id, "⏳ Too many requests. Please wait a moment.")
         return
     
@@ -695,7 +769,7 @@ def set_filters(message):
     chat_id = message.chat.id
     
     # Rate limiting
-    if not rate_limiter.is_allowed(chat_id):
+    if not rate_limiter.is_allowed(chat_id, 'filter'):
         bot.send_message(chat_id, "⏳ Too many requests. Please wait a moment.")
         return
     
@@ -710,6 +784,69 @@ def set_filters(message):
     
     bot.send_message(chat_id, "🔍 Filter profiles:", reply_markup=markup)
 
+@bot.callback_query_handler(func=lambda call: call.data == "filter_interests")
+def choose_interest_filter(call):
+    """Ask how many interests browsed profiles must share"""
+    chat_id = call.message.chat.id
+    current = (user_cache.get(chat_id) or {}).get('min_shared_interests')
+    
+    markup = types.InlineKeyboardMarkup(row_width=3)
+    markup.add(*[
+        InlineKeyboardButton(f"{'✅ ' if current == n else ''}{n}+", callback_data=f"filter_interests_{n}")
+        for n in (1, 2, 3)
+    ])
+    markup.add(InlineKeyboardButton("Any", callback_data="filter_interest_clear"))
+    bot.answer_callback_query(call.id)
+    bot.send_message(chat_id, "🎯 Only show profiles sharing at least how many of your interests?", reply_markup=markup)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("filter_interests_") or call.data == "filter_interest_clear")
+def set_interest_filter(call):
+    """Save the shared interests filter; /view_profiles browses with it"""
+    chat_id = call.message.chat.id
+    min_shared = int(call.data.rsplit('_', 1)[1]) if call.data != "filter_interest_clear" else 0
+    user_cache.update(chat_id, min_shared_interests=min_shared or None)
+    
+    bot.answer_callback_query(call.id, "Filter saved")
+    if not min_shared:
+        bot.send_message(chat_id, "🗑️ Interest filter cleared. Use /view_profiles to browse.")
+    elif not interest_index.count(chat_id):
+        bot.send_message(chat_id, "🎯 Filter saved, but you have no interests yet. Add some with /edit_profile.")
+    else:
+        bot.send_message(chat_id, f"🎯 Showing profiles sharing at least {min_shared} of your interests. "
+                                  f"Use /view_profiles to browse.")
+
+@bot.callback_query_handler(func=lambda call: call.data in ("pref_distance", "filter_distance"))
+def choose_distance_filter(call):
+    """Ask how far away browsed profiles may be"""
+    chat_id = call.message.chat.id
+    current = (user_cache.get(chat_id) or {}).get('max_distance')
+    
+    markup = types.InlineKeyboardMarkup(row_width=4)
+    markup.add(*[
+        InlineKeyboardButton(f"{'✅ ' if current == km else ''}{km} km", callback_data=f"distance_{km}")
+        for km in DISTANCE_CHOICES_KM
+    ])
+    markup.add(InlineKeyboardButton("Any distance", callback_data="distance_0"))
+    bot.answer_callback_query(call.id)
+    bot.send_message(chat_id, "📍 Only show profiles within how many kilometres?", reply_markup=markup)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("distance_"))
+def set_distance_filter(call):
+    """Save the maximum distance; /view_profiles browses with it"""
+    chat_id = call.message.chat.id
+    max_distance = int(call.data.rsplit('_', 1)[1])
+    user_cache.update(chat_id, max_distance=max_distance or None)
+    
+    bot.answer_callback_query(call.id, "Distance saved")
+    user_info = get_user_info(chat_id)
+    if not max_distance:
+        bot.send_message(chat_id, "🗑️ Distance limit cleared. Use /view_profiles to browse.")
+    elif not user_info or not user_coordinates(user_info):
+        bot.send_message(chat_id, "📍 Distance saved, but we don't know where you are yet. "
+                                  "Share your location with /edit_profile.")
+    else:
+        bot.send_message(chat_id, f"📍 Showing profiles within {max_distance} km. Use /view_profiles to browse.")
+
 # Database fix command
 @bot.message_handler(commands=['fixdb'])
 def fix_database(message):
@@ -768,82 +905,185 @@ def handle_inline_response(call):
         logger.error(f"Error in handle_inline_response: {e}")
         bot.send_message(call.message.chat.id, "An unexpected error occurred.")
 
+def handle_like_action(chat_id, other_user_chat_id, user_info, liked_user_info):
+    """Queue a like; notify_like announces it once it is stored"""
+    get_write_queue().like(chat_id, other_user_chat_id)
+    bot.send_message(chat_id, f"👍 You liked {liked_user_info['name']}!")
+
+def notify_like(liker_chat_id, liked_chat_id, mutual):
+    """Notify the liked user of a new like, or both users of a new match"""
+    if not mutual:
+        outbox.submit(liked_chat_id, bot.send_message, liked_chat_id,
+            "💌 Someone liked your profile! Browse with /view_profiles to find them.",
+            priority=PRIORITY_MATCH)
+        return
+    
+    liker_info = get_user_info(liker_chat_id)
+    liked_info = get_user_info(liked_chat_id)
+    if not liker_info or not liked_info:
+        return
+    for to_chat_id, partner in ((liker_chat_id, liked_info), (liked_chat_id, liker_info)):
+        contact = f"@{partner['username']}" if partner.get('username') else partner['name']
+        outbox.submit(to_chat_id, bot.send_message, to_chat_id,
+            f"💞 It's a match! You and {partner['name']} like each other.\n\nSay hi to {contact}!",
+            priority=PRIORITY_MATCH)
+
+def start_write_queue():
+    """Open this process's write-behind journal, replaying what it holds, and start flushing"""
+    write_queue = get_write_queue()
+    write_queue.add_like_listener(notify_like)
+    webhook.register_metrics('write_behind', write_queue.metrics)
+    write_queue.start()
+
 @bot.callback_query_handler(func=lambda call: call.data == "next_profile")
 def handle_next_profile(call):
     """Handle next profile button"""
     chat_id = call.message.chat.id
     display_next_profile(chat_id)
 
+# Leave the /random queue
+@bot.message_handler(commands=['cancel'])
+def cancel_search(message):
+    chat_id = message.chat.id
+    markup = types.ReplyKeyboardRemove()
+    if match_queue.cancel(chat_id):
+        bot.send_message(chat_id, "🛑 You left the queue. Use /random to search again.", reply_markup=markup)
+    else:
+        bot.send_message(chat_id, "❌ You are not in the queue.", reply_markup=markup)
+
+def notify_queue_expired(chat_id):
+    outbox.submit(chat_id, bot.send_message, chat_id,
+        "⌛ No match found this time, so you were removed from the queue. Use /random to try again.",
+        priority=PRIORITY_MATCH)
+
+def start_queue_reaper():
+    start_reaper(match_queue, notify_queue_expired)
+
+# Report the current chat partner
+@bot.message_handler(commands=['report'])
+def report_partner(message):
+    chat_id = message.chat.id
+    
+    partner_chat_id = chat_sessions.partner_of(chat_id)
+    if partner_chat_id is None:
+        bot.send_message(chat_id, "❌ You can only report someone you're chatting with.")
+        return
+    
+    args = message.text.split()[1:]
+    violation = args[0].lower() if args else 'other'
+    if violation not in VIOLATIONS:
+        bot.send_message(chat_id, f"Usage: /report [{'|'.join(VIOLATIONS)}]")
+        return
+    
+    if record_report(chat_id, partner_chat_id, violation, coordinator.reports):
+        bot.send_message(chat_id, "🛡️ Thanks, your report was recorded.")
+    else:
+        bot.send_message(chat_id, "You've already reported this user.")
+
 # Message relay for active chats
 @bot.message_handler(func=lambda message: True)
 def relay_message(message):
     chat_id = message.chat.id
     
-    with active_chats_lock:
-        if chat_id in active_chats:
-            partner_chat_id = active_chats[chat_id]
-            
-            if message.text and message.text.lower() == 'end chat':
-                end_chat(chat_id)
-            else:
-                # Relay the message
-                try:
-                    bot.send_message(partner_chat_id, f"{message.text}")
-                except Exception as e:
-                    logger.error(f"Error relaying message: {e}")
-                    bot.send_message(chat_id, "Error sending message. The chat may have ended.")
-        else:
-            # Handle other messages if needed
-            pass
+    partner_chat_id = chat_sessions.partner_of(chat_id)
+    if partner_chat_id is None:
+        # Handle other messages if needed
+        return
+    
+    if message.text and message.text.lower() == 'end chat':
+        end_chat(chat_id)
+    else:
+        # Relay the message
+        def on_error(e):
+            logger.error(f"Error relaying message: {e}")
+            bot.send_message(chat_id, "Error sending message. The chat may have ended.")
+        
+        outbox.submit(partner_chat_id, bot.send_message, partner_chat_id, f"{message.text}",
+            priority=PRIORITY_RELAY, on_error=on_error)
 
 def end_chat(chat_id):
     try:
-        with active_chats_lock:
-            if chat_id in active_chats:
-                partner_chat_id = active_chats[chat_id]
-                
-                # Remove from active chats
-                del active_chats[chat_id]
-                if partner_chat_id in active_chats:
-                    del active_chats[partner_chat_id]
-                
-                # Send end chat messages
-                markup = types.InlineKeyboardMarkup()
-                like_button = InlineKeyboardButton("👍 Like", callback_data=f"like_{partner_chat_id}")
-                dislike_button = InlineKeyboardButton("👎 Dislike", callback_data=f"dislike_{partner_chat_id}")
-                markup.row(like_button, dislike_button)
-                
-                end_msg = "Chat ended. How was your conversation?"
-                bot.send_message(chat_id, end_msg, reply_markup=markup)
-                bot.send_message(partner_chat_id, end_msg, reply_markup=markup)
-                
-                logger.info(f"Chat ended between {chat_id} and {partner_chat_id}")
-            else:
-                bot.send_message(chat_id, "❌ You are not in a chat currently.")
+        partner_chat_id = chat_sessions.end(chat_id)
+        if partner_chat_id is None:
+            outbox.submit(chat_id, bot.send_message, chat_id, "❌ You are not in a chat currently.")
+            return
+        
+        # Send end chat messages
+        markup = types.InlineKeyboardMarkup()
+        like_button = InlineKeyboardButton("👍 Like", callback_data=f"like_{partner_chat_id}")
+        dislike_button = InlineKeyboardButton("👎 Dislike", callback_data=f"dislike_{partner_chat_id}")
+        markup.row(like_button, dislike_button)
+        
+        end_msg = "Chat ended. How was your conversation?"
+        outbox.submit(chat_id, bot.send_message, chat_id, end_msg, reply_markup=markup)
+        outbox.submit(partner_chat_id, bot.send_message, partner_chat_id, end_msg, reply_markup=markup)
+        
+        logger.info(f"Chat ended between {chat_id} and {partner_chat_id}")
 
     except Exception as e:
         logger.error(f"Error in end_chat: {e}")
 
 # Tip system
-def send_tips():
-    while True:
-        time.sleep(86400)  # 24 hours
-        for chat_id in list(users_interacted):
-            try:
-                index = tip_index.get(chat_id, 0)
-                if index < len(tips):
-                    bot.send_message(chat_id, tips[index])
-                    tip_index[chat_id] = (index + 1) % len(tips)
-            except Exception as e:
-                logger.error(f"Error sending tip to {chat_id}: {e}")
-                # Remove from set if user blocked bot
-                users_interacted.discard(chat_id)
-
 def start_tip_thread():
-    tip_thread = threading.Thread(target=send_tips)
+    # With several workers only the holder of the lease broadcasts
+    broadcaster = TipBroadcaster(bot, outbox, tips, lease=coordinator.lock('tip-broadcast', ttl=600))
+    tip_thread = threading.Thread(target=broadcaster.run_forever)
     tip_thread.daemon = True
     tip_thread.start()
 
+# Stop sending tips to users who blocked the bot
+outbox.add_blocked_listener(broadcast.mark_blocked)
+
+# Banned users and users who blocked the bot leave the /random queue at once
+add_ban_listener(match_queue.cancel)
+outbox.add_blocked_listener(match_queue.cancel)
+
+# Exposed on /metrics
+webhook.register_metrics('outbox', lambda: dict(outbox.stats, pending=outbox.pending()))
+webhook.register_metrics('db_pool', pool_stats)
+webhook.register_metrics('rate_limit', rate_limiter.metrics)
+webhook.register_metrics('queue', match_queue.metrics)
+webhook.register_metrics('profile_cache', profile_cache.metrics)
+
+# Update dispatch: per-chat ordered lanes, with relays and heavy matching queries in their own pools
+HEAVY_COMMANDS = ('/view_profiles',)
+# Next-step handlers that run matching; /random itself only asks a question
+HEAVY_STEPS = ('find_compatible_random_chat',)
+
+def pending_step(chat_id):
+    """Name of the next-step handler waiting for a chat's reply, or None"""
+    handlers = getattr(bot.next_step_backend, 'handlers', {}).get(chat_id) or ()
+    for handler in handlers:
+        return getattr(handler.callback, '__name__', None)
+    return None
+
+def classify_update(update):
+    """Pick the dispatch pool of an update"""
+    if update.callback_query is not None:
+        return 'heavy' if update.callback_query.data == 'next_profile' else 'default'
+    message = update.message
+    if message is not None and pending_step(message.chat.id) in HEAVY_STEPS:
+        return 'heavy'
+    if message is None or not message.text:
+        return 'relay' if message is not None and message.chat.id in chat_sessions else 'default'
+    if message.text.startswith('/'):
+        command = message.text.split()[0].split('@')[0]
+        return 'heavy' if command in HEAVY_COMMANDS else 'default'
+    return 'relay' if message.chat.id in chat_sessions else 'default'
+
+def reject_busy(chat_id, update):
+    """Tell a user their matching request was shed because the heavy pool is full"""
+    outbox.submit(chat_id, bot.send_message, chat_id,
+        "⏳ Lots of people are searching right now. Please try again in a moment.",
+        priority=PRIORITY_MATCH)
+
+dispatcher = UpdateDispatcher(classify_update, [
+    LanePool('relay', lanes=int(os.getenv('RELAY_LANES', '8')), maxsize=1000),
+    LanePool('heavy', lanes=int(os.getenv('HEAVY_LANES', '4')), maxsize=50, block_timeout=0, on_reject=reject_busy),
+    LanePool('default', lanes=int(os.getenv('DEFAULT_LANES', '4')), maxsize=1000),
+]).install(bot)
+webhook.register_metrics('dispatch', dispatcher.metrics)
+
 # Help command
 @bot.message_handler(commands=['help'])
 def help_command(message):
@@ -857,13 +1097,15 @@ def help_command(message):
             "🔍 *Finding Matches:*\n"
             "/view_profiles - Browse compatible profiles\n" 
             "/random - Chat with a random user\n"
+            "/cancel - Leave the random chat queue\n"
             "/preferences - Set your matching preferences\n"
             "/filter - Filter profiles\n\n"
             "📊 *Profile Management:*\n"
             "/quality - Check your profile quality score\n"
             "/edit_profile - Edit specific profile fields\n\n"
             "👥 *Community:*\n"
-            "/community - Create or join communities\n\n"
+            "/community - Create or join communities\n"
+            "/report - Report your current chat partner\n\n"
             "🛠️ *Support:*\n"
             "/help - This help message\n"
             "Contact: @meh9061\n\n"
@@ -885,12 +1127,64 @@ def community_options(message):
     pass
 
 # Main execution
+def serve_partition(index, updates):
+    """Worker process entry point: handle the chats routed to this worker"""
+    from workers import consume_updates
+    
+    logger.info(f"🤖 Worker {index} starting...")
+    # Each worker journals its deferred writes to a file of its own
+    os.environ['WRITE_BEHIND_JOURNAL'] = worker_journal_path(index)
+    interest_index.load()
+    interest_index.start_reconciler()
+    ban_index.load()
+    ban_index.start_reconciler()
+    if index == 0:
+        # The report aggregate is shared, so one worker fills it
+        load_report_aggregate(coordinator.reports)
+    start_write_queue()
+    start_tip_thread()
+    start_queue_reaper()
+    consume_updates(bot, updates)
+
 if __name__ == '__main__':
     logger.info("🤖 Bot starting...")
     
+    # Several worker processes behind one polling router
+    workers = int(os.getenv('BOT_WORKERS', '1'))
+    if workers > 1:
+        from workers import UpdateRouter
+        if os.getenv('COORDINATOR_SERVE', '1') == '1':
+            CoordinatorServer(parse_address(coordinator_url())).serve_in_background()
+        UpdateRouter(bot, serve_partition, workers).run()
+        raise SystemExit(0)
+    
+    # Load the interest inverted index
+    interest_index.load()
+    interest_index.start_reconciler()
+    ban_index.load()
+    ban_index.start_reconciler()
+    load_report_aggregate(coordinator.reports)
+    
+    # Flush deferred writes, including any replayed from the journal
+    start_write_queue()
+    
     # Start tip thread
     start_tip_thread()
     
+    # Drop /random waiters nobody matched in time
+    start_queue_reaper()
+    
+    # Opt-in webhook ingestion, served by waitress
+    if os.getenv('BOT_RUNTIME', 'threaded') == 'webhook':
+        webhook.run_webhook(bot)
+        raise SystemExit(0)
+    
+    # Opt-in asyncio runtime
+    if os.getenv('BOT_RUNTIME', 'threaded') == 'async':
+        from async_runtime import run_async
+        run_async(bot, chat_sessions, outbox, dispatcher)
+        raise SystemExit(0)
+    
     # Start polling with better error handling
     poll_count = 0
     while True:
@@ -0,0 +1,67 @@
+import logging
+
+from sqlalchemy import func, and_, exists, literal
+
+from bans import ban_index
+from geo import parse_coordinates, within_radius_filter
+from interests import interest_index
+from models import User, Like
+from scoring import BASE_SCORE, AGE_DIFF_PENALTY
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_AGE_DIFF = 10
+# Candidates browse ranks together, and most users sharing interests an interest filter considers
+CANDIDATE_POOL = 2000
+
+
+def user_coordinates(user_info):
+    """(lat, lon) of a profile dict, or None when its location isn't coordinates"""
+    if user_info.get('latitude') is not None and user_info.get('longitude') is not None:
+        return user_info['latitude'], user_info['longitude']
+    return parse_coordinates(user_info.get('location'))
+
+
+def candidate_query(db, user_info, gender_preference, max_age_diff=None, max_distance_km=None,
+                    min_shared_interests=None):
+    """Build the indexed candidate query for a user.
+
+    Filters on gender, looking_for, an age window and optionally distance
+    and shared interests, and excludes the user and profiles they already
+    liked. Banned users are not excluded here; callers drop them with
+    exclude_banned. Returns the query and the SQL score expression it is
+    ranked by.
+    """
+    max_age_diff = max_age_diff or DEFAULT_MAX_AGE_DIFF
+    age = int(user_info['age'] or 0)
+
+    score = (literal(BASE_SCORE) - AGE_DIFF_PENALTY * func.abs(User.age - age)).label('score')
+
+    query = db.query(User, score).filter(
+        User.chat_id != user_info['chat_id'],
+        User.looking_for == user_info['looking_for'],
+        User.age.between(age - max_age_diff, age + max_age_diff),
+        ~exists().where(and_(
+            Like.liker_chat_id == user_info['chat_id'],
+            Like.liked_chat_id == User.chat_id
+        )),
+    )
+    if gender_preference in ('M', 'F'):
+        query = query.filter(User.gender == gender_preference)
+
+    coordinates = user_coordinates(user_info)
+    if max_distance_km and coordinates:
+        query = query.filter(within_radius_filter(User, *coordinates, max_distance_km))
+
+    if min_shared_interests:
+        sharing = interest_index.users_sharing(user_info['chat_id'], min_shared_interests, limit=CANDIDATE_POOL)
+        query = query.filter(User.chat_id.in_([chat_id for chat_id, _ in sharing]))
+
+    return query, score
+
+
+def exclude_banned(rows):
+    """Drop (profile, score) rows of banned users, using the in-memory ban index"""
+    if not len(ban_index):
+        return rows
+    return [(profile, score) for profile, score in rows if profile['chat_id'] not in ban_index]
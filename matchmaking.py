@@ -0,0 +1,281 @@
+from collections import OrderedDict
+import itertools
+import threading
+import logging
+import heapq
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+GENDERS = ('M', 'F')
+
+# Seconds a waiter stays in the /random queue without being matched
+QUEUE_TTL = int(os.getenv('QUEUE_TTL', '600'))
+# Seconds between sweeps for expired waiters
+REAP_INTERVAL = 5
+
+# Weight of the latest sample in the per-bucket wait and match interval averages
+MATCH_EWMA_ALPHA = 0.1
+
+
+class Waiter:
+    """A user waiting in the /random queue"""
+    __slots__ = ('chat_id', 'gender', 'preference', 'looking_for', 'enqueued_at', 'expires_at', 'seq')
+
+    def __init__(self, chat_id, gender, preference, looking_for, seq=0, ttl=None):
+        self.chat_id = chat_id
+        self.gender = gender
+        self.preference = preference
+        self.looking_for = looking_for
+        self.enqueued_at = time.time()
+        self.expires_at = self.enqueued_at + ttl if ttl else None
+        self.seq = seq
+
+    @property
+    def bucket(self):
+        return (self.gender, self.preference, self.looking_for)
+
+
+class _BucketStats:
+    """Arrival counter and pairing averages of one bucket"""
+    __slots__ = ('next_seq', 'matched', 'cancelled', 'expired', 'wait_avg', 'interval_avg', 'busy_since', 'last_match_at')
+
+    def __init__(self):
+        self.next_seq = 0
+        self.matched = 0
+        self.cancelled = 0
+        self.expired = 0
+        self.wait_avg = None
+        self.interval_avg = None
+        self.busy_since = None
+        self.last_match_at = None
+
+    def record_match(self, waiter, now):
+        wait = now - waiter.enqueued_at
+        self.wait_avg = wait if self.wait_avg is None else self.wait_avg + MATCH_EWMA_ALPHA * (wait - self.wait_avg)
+        # Time between matches only counts while someone was waiting in the bucket
+        interval = now - max(self.last_match_at or 0, self.busy_since or now)
+        self.interval_avg = (interval if self.interval_avg is None
+                             else self.interval_avg + MATCH_EWMA_ALPHA * (interval - self.interval_avg))
+        self.last_match_at = now
+        self.matched += 1
+
+
+class MatchQueue:
+    """Matchmaking queue bucketed by (gender, gender preference, looking_for).
+
+    Each bucket is an insertion-ordered dict, so enqueue, dequeue of the
+    oldest waiter and cancel are all O(1). A new waiter is paired with the
+    oldest waiter in any compatible bucket, of which there are at most four.
+
+    Waiters are numbered in arrival order per bucket, so a position is the
+    distance from the bucket's head. Cancellations leave gaps in the
+    numbering; they are assumed to be spread evenly, which keeps status()
+    O(1) at the cost of an approximate position when people leave mid-queue.
+    Each bucket keeps moving averages of the time its waiters took to be
+    matched and of the time between matches, from which the ETA follows.
+
+    Waiters expire ttl seconds after joining. Expiry times sit in a heap
+    whose entries are left behind when a waiter leaves early and skipped
+    once they surface; the heap is rebuilt when such entries outnumber the
+    live ones. Expired waiters are dropped before every pairing, so nobody
+    is matched with someone who gave up, and handed out by expire() so
+    they can be told.
+    """
+
+    def __init__(self, ttl=QUEUE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._index = {}
+        self._stats = {}
+        self._expiries = []
+        self._expiry_order = itertools.count()
+        self._expired = []
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, chat_id):
+        return chat_id in self._index
+
+    @staticmethod
+    def compatible_buckets(gender, preference, looking_for):
+        """Buckets holding waiters that would accept this user and be accepted by them"""
+        partner_genders = GENDERS if preference == 'BOTH' else (preference,)
+        return [
+            (partner_gender, partner_preference, looking_for)
+            for partner_gender in partner_genders
+            for partner_preference in (gender, 'BOTH')
+        ]
+
+    def enqueue(self, chat_id, gender, preference, looking_for):
+        """Pair the user with a compatible waiter, or queue them.
+
+        Returns the partner's chat_id when a pair was made, otherwise None.
+        """
+        with self._lock:
+            if chat_id in self._index:
+                return None
+            self._expire(time.time())
+
+            oldest = None
+            for key in self.compatible_buckets(gender, preference, looking_for):
+                bucket = self._buckets.get(key)
+                if not bucket:
+                    continue
+                head = next(iter(bucket.values()))
+                if oldest is None or head.enqueued_at < oldest.enqueued_at:
+                    oldest = head
+
+            if oldest is not None:
+                self._remove(oldest.chat_id, matched=True)
+                return oldest.chat_id
+
+            key = (gender, preference, looking_for)
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _BucketStats()
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = OrderedDict()
+                stats.busy_since = time.time()
+            waiter = bucket[chat_id] = Waiter(chat_id, gender, preference, looking_for, stats.next_seq, self.ttl)
+            stats.next_seq += 1
+            self._index[chat_id] = key
+            if waiter.expires_at is not None:
+                heapq.heappush(self._expiries, (waiter.expires_at, next(self._expiry_order), waiter))
+                if len(self._expiries) > 2 * len(self._index) + 64:
+                    self._compact_expiries()
+            return None
+
+    def dequeue(self, bucket_key):
+        """Pop the oldest waiter from a bucket"""
+        with self._lock:
+            bucket = self._buckets.get(bucket_key)
+            if not bucket:
+                return None
+            chat_id = next(iter(bucket))
+            return self._remove(chat_id, matched=True)
+
+    def cancel(self, chat_id):
+        """Remove a user from the queue. Returns True if they were queued"""
+        with self._lock:
+            return self._remove(chat_id) is not None
+
+    def expire(self):
+        """Drop waiters past their ttl. Returns the chat_ids expired since the last call"""
+        with self._lock:
+            self._expire(time.time())
+            expired, self._expired = self._expired, []
+            return expired
+
+    def _expire(self, now):
+        expiries = self._expiries
+        while expiries and expiries[0][0] <= now:
+            waiter = heapq.heappop(expiries)[2]
+            if self._is_queued(waiter):
+                self._remove(waiter.chat_id, expired=True)
+                self._expired.append(waiter.chat_id)
+
+    def _compact_expiries(self):
+        self._expiries = [entry for entry in self._expiries if self._is_queued(entry[2])]
+        heapq.heapify(self._expiries)
+
+    def _is_queued(self, waiter):
+        # False for entries left behind by a waiter who left, even if they queued again since
+        key = self._index.get(waiter.chat_id)
+        return key is not None and self._buckets[key][waiter.chat_id] is waiter
+
+    def status(self, chat_id):
+        """A waiter's position in their bucket and estimated seconds until a match.
+
+        Returns None if they aren't queued. eta is None until the bucket
+        has seen a match to estimate from.
+        """
+        now = time.time()
+        with self._lock:
+            key = self._index.get(chat_id)
+            if key is None:
+                return None
+            bucket = self._buckets[key]
+            stats = self._stats[key]
+            waiter = bucket[chat_id]
+            head = next(iter(bucket.values()))
+            tail = next(reversed(bucket.values()))
+            ahead = waiter.seq - head.seq
+            if tail.seq > head.seq:
+                ahead = round(ahead * (len(bucket) - 1) / (tail.seq - head.seq))
+            waited = now - waiter.enqueued_at
+
+            if stats.interval_avg is not None:
+                since_match = now - max(stats.last_match_at, stats.busy_since)
+                eta = max(0.0, (ahead + 1) * stats.interval_avg - since_match)
+            elif stats.wait_avg is not None:
+                eta = max(0.0, stats.wait_avg - waited)
+            else:
+                eta = None
+            return {'position': ahead + 1, 'waiting': len(bucket), 'waited': waited, 'eta': eta}
+
+    def metrics(self):
+        """Queue size and, per bucket, waiters, matches and pairing averages"""
+        with self._lock:
+            buckets = {}
+            for key, stats in self._stats.items():
+                values = {
+                    'waiting': len(self._buckets.get(key, ())),
+                    'matched': stats.matched,
+                    'cancelled': stats.cancelled,
+                    'expired': stats.expired,
+                }
+                if stats.wait_avg is not None:
+                    values['wait_seconds_avg'] = stats.wait_avg
+                    values['match_interval_seconds_avg'] = stats.interval_avg
+                buckets['_'.join(map(str, key))] = values
+            return {'waiting': len(self._index), 'buckets': buckets}
+
+    def _remove(self, chat_id, matched=False, expired=False):
+        key = self._index.pop(chat_id, None)
+        if key is None:
+            return None
+        bucket = self._buckets[key]
+        waiter = bucket.pop(chat_id)
+        stats = self._stats[key]
+        if matched:
+            stats.record_match(waiter, time.time())
+        elif expired:
+            stats.expired += 1
+        else:
+            stats.cancelled += 1
+        if not bucket:
+            del self._buckets[key]
+            stats.busy_since = None
+        return waiter
+
+
+def start_reaper(queue, on_expired, interval=REAP_INTERVAL):
+    """Expire waiters every interval seconds, calling on_expired(chat_id) for each.
+
+    queue may be a MatchQueue or a coordinator's remote queue; each expired
+    waiter is handed to exactly one reaper.
+    """
+
+    def reap_forever():
+        while True:
+            time.sleep(interval)
+            try:
+                expired = queue.expire()
+            except Exception as e:
+                logger.error(f"Error expiring queued users: {e}")
+                continue
+            for chat_id in expired:
+                try:
+                    on_expired(chat_id)
+                except Exception as e:
+                    logger.error(f"Error in queue expiry callback: {e}")
+
+    thread = threading.Thread(target=reap_forever, name='queue-reaper')
+    thread.daemon = True
+    thread.start()
+    return thread
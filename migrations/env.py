@@ -0,0 +1,33 @@
+from logging.config import fileConfig
+import os
+
+from alembic import context
+from sqlalchemy import create_engine
+
+from models import Base, fix_database_url
+
+config = context.config
+target_metadata = Base.metadata
+
+
+def run_migrations(connection):
+    context.configure(connection=connection, target_metadata=target_metadata)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+# Migrations inspect the live schema, so there is no offline (--sql) mode
+if context.is_offline_mode():
+    raise SystemExit("Offline migrations are not supported; run against a database")
+
+# models.upgrade_schema hands over its connection; the alembic CLI builds one
+connection = config.attributes.get('connection')
+if connection is not None:
+    run_migrations(connection)
+else:
+    if config.config_file_name is not None:
+        fileConfig(config.config_file_name, disable_existing_loggers=False)
+    engine = create_engine(fix_database_url(os.getenv('DATABASE_URL')))
+    with engine.connect() as connection:
+        run_migrations(connection)
+        connection.commit()
@@ -0,0 +1,25 @@
+"""Schema checks that let migrations run against databases created before
+versioning, when init_database built tables and indexes on every boot."""
+from alembic import op
+import sqlalchemy as sa
+
+
+def has_table(table):
+    return sa.inspect(op.get_bind()).has_table(table)
+
+
+def has_column(table, column):
+    return column in {c['name'] for c in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def has_index(table, index):
+    return index in {i['name'] for i in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def create_index(name, table, columns, **kwargs):
+    if not has_index(table, name):
+        op.create_index(name, table, columns, **kwargs)
+
+
+def is_postgres():
+    return op.get_bind().dialect.name == 'postgresql'
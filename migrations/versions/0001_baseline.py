@@ -0,0 +1,91 @@
+"""Baseline: the original users, likes, banned_users, reports and groups tables
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 09:00:00
+
+Databases that predate versioning already have these tables, possibly
+with INTEGER chat IDs; only those columns are converted to BIGINT.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import has_table, is_postgres
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+CHAT_ID_COLUMNS = [
+    ('users', 'chat_id'),
+    ('likes', 'liker_chat_id'),
+    ('likes', 'liked_chat_id'),
+    ('banned_users', 'user_id'),
+    ('reports', 'reporter_chat_id'),
+    ('reports', 'reported_chat_id'),
+    ('groups', 'created_by'),
+]
+
+
+def upgrade():
+    if not has_table('users'):
+        op.create_table(
+            'users',
+            sa.Column('chat_id', sa.BigInteger, primary_key=True),
+            sa.Column('username', sa.String(100), nullable=True),
+            sa.Column('name', sa.String(100), nullable=True),
+            sa.Column('age', sa.Integer, nullable=True),
+            sa.Column('gender', sa.String(1), nullable=True),
+            sa.Column('location', sa.String(200), nullable=True),
+            sa.Column('photo', sa.String(500), nullable=True),
+            sa.Column('interests', sa.Text, nullable=True),
+            sa.Column('looking_for', sa.String(10), nullable=True),
+            sa.Column('created_at', sa.DateTime),
+        )
+    if not has_table('likes'):
+        op.create_table(
+            'likes',
+            sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
+            sa.Column('liker_chat_id', sa.BigInteger),
+            sa.Column('liked_chat_id', sa.BigInteger),
+            sa.Column('note', sa.Text, nullable=True),
+            sa.Column('timestamp', sa.DateTime),
+        )
+    if not has_table('banned_users'):
+        op.create_table(
+            'banned_users',
+            sa.Column('user_id', sa.BigInteger, primary_key=True),
+        )
+    if not has_table('reports'):
+        op.create_table(
+            'reports',
+            sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
+            sa.Column('reporter_chat_id', sa.BigInteger),
+            sa.Column('reported_chat_id', sa.BigInteger),
+            sa.Column('violation', sa.String(50)),
+            sa.Column('created_at', sa.DateTime),
+        )
+    if not has_table('groups'):
+        op.create_table(
+            'groups',
+            sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
+            sa.Column('name', sa.String(200)),
+            sa.Column('description', sa.Text),
+            sa.Column('photo', sa.String(500)),
+            sa.Column('invite_link', sa.String(500)),
+            sa.Column('created_at', sa.DateTime),
+            sa.Column('created_by', sa.BigInteger, nullable=True),
+        )
+
+    if is_postgres():
+        inspector = sa.inspect(op.get_bind())
+        for table, column in CHAT_ID_COLUMNS:
+            column_type = {c['name']: c['type'] for c in inspector.get_columns(table)}[column]
+            if not isinstance(column_type, sa.BigInteger):
+                op.alter_column(table, column, type_=sa.BigInteger)
+
+
+def downgrade():
+    for table in ('groups', 'reports', 'banned_users', 'likes', 'users'):
+        op.drop_table(table)
@@ -0,0 +1,45 @@
+"""Profile search: candidate indexes, coordinates with geohash, geocode cache
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:10:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import has_table, has_column, create_index
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for column, column_type in (('latitude', sa.Float), ('longitude', sa.Float), ('geohash', sa.String(12))):
+        if not has_column('users', column):
+            op.add_column('users', sa.Column(column, column_type, nullable=True))
+
+    create_index('ix_users_gender_looking_for_age', 'users', ['gender', 'looking_for', 'age'])
+    create_index('ix_users_looking_for_age', 'users', ['looking_for', 'age'])
+    create_index('ix_users_created_at', 'users', ['created_at'])
+    # Pattern ops so Postgres can serve geohash LIKE 'prefix%' from the index
+    create_index('ix_users_geohash', 'users', ['geohash'], postgresql_ops={'geohash': 'varchar_pattern_ops'})
+
+    if not has_table('geocode_cache'):
+        op.create_table(
+            'geocode_cache',
+            sa.Column('query', sa.String(200), primary_key=True),
+            sa.Column('latitude', sa.Float, nullable=True),
+            sa.Column('longitude', sa.Float, nullable=True),
+            sa.Column('created_at', sa.DateTime),
+        )
+
+
+def downgrade():
+    op.drop_table('geocode_cache')
+    for index in ('ix_users_geohash', 'ix_users_created_at', 'ix_users_looking_for_age',
+                  'ix_users_gender_looking_for_age'):
+        op.drop_index(index, table_name='users')
+    for column in ('geohash', 'longitude', 'latitude'):
+        op.drop_column('users', column)
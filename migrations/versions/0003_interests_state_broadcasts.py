@@ -0,0 +1,68 @@
+"""Interest index, conversation state and tip broadcast tables
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 09:20:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import has_table, create_index
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_table('interests'):
+        op.create_table(
+            'interests',
+            sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
+            sa.Column('name', sa.String(100), nullable=False, unique=True),
+        )
+    if not has_table('user_interests'):
+        op.create_table(
+            'user_interests',
+            sa.Column('chat_id', sa.BigInteger, primary_key=True),
+            sa.Column('interest_id', sa.Integer, primary_key=True),
+        )
+    create_index('ix_user_interests_interest_id', 'user_interests', ['interest_id', 'chat_id'])
+
+    if not has_table('conversation_state'):
+        op.create_table(
+            'conversation_state',
+            sa.Column('namespace', sa.String(50), primary_key=True),
+            sa.Column('key', sa.String(100), primary_key=True),
+            sa.Column('value', sa.Text, nullable=False),
+            sa.Column('expires_at', sa.DateTime, nullable=True),
+        )
+    create_index('ix_conversation_state_expires_at', 'conversation_state', ['expires_at'])
+
+    if not has_table('tip_cursors'):
+        op.create_table(
+            'tip_cursors',
+            sa.Column('chat_id', sa.BigInteger, primary_key=True),
+            sa.Column('tip_index', sa.Integer, nullable=False, server_default='0'),
+            sa.Column('last_sent_at', sa.DateTime, nullable=True),
+            sa.Column('blocked', sa.Boolean, nullable=False, server_default=sa.false()),
+        )
+    if not has_table('broadcast_runs'):
+        op.create_table(
+            'broadcast_runs',
+            sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
+            sa.Column('name', sa.String(50)),
+            sa.Column('started_at', sa.DateTime),
+            sa.Column('finished_at', sa.DateTime, nullable=True),
+            sa.Column('last_chat_id', sa.BigInteger, nullable=False, server_default='0'),
+            sa.Column('delivered', sa.Integer, nullable=False, server_default='0'),
+            sa.Column('failed', sa.Integer, nullable=False, server_default='0'),
+            sa.Column('blocked', sa.Integer, nullable=False, server_default='0'),
+        )
+    create_index('ix_broadcast_runs_name', 'broadcast_runs', ['name'])
+
+
+def downgrade():
+    for table in ('broadcast_runs', 'tip_cursors', 'conversation_state', 'user_interests', 'interests'):
+        op.drop_table(table)
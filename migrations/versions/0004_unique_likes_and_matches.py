@@ -0,0 +1,53 @@
+"""One like per pair, reverse likes index and the matches table
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 09:30:00
+
+matches starts empty here; run `python -m likes backfill` once after
+upgrading to record the mutual likes made before it.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import has_table, has_index, create_index
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_index('likes', 'ux_likes_liker_liked'):
+        # Duplicate likes must go before the unique index can be built
+        op.execute("""
+            DELETE FROM likes WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (
+                        PARTITION BY liker_chat_id, liked_chat_id ORDER BY id
+                    ) AS duplicate
+                    FROM likes
+                ) ranked WHERE duplicate > 1
+            )
+        """)
+        if has_index('likes', 'ix_likes_liker_liked'):
+            op.drop_index('ix_likes_liker_liked', table_name='likes')
+        op.create_index('ux_likes_liker_liked', 'likes', ['liker_chat_id', 'liked_chat_id'], unique=True)
+    create_index('ix_likes_liked_liker', 'likes', ['liked_chat_id', 'liker_chat_id'])
+
+    if not has_table('matches'):
+        op.create_table(
+            'matches',
+            sa.Column('user_a', sa.BigInteger, primary_key=True),
+            sa.Column('user_b', sa.BigInteger, primary_key=True),
+            sa.Column('created_at', sa.DateTime),
+        )
+    create_index('ix_matches_user_b', 'matches', ['user_b'])
+
+
+def downgrade():
+    op.drop_table('matches')
+    op.drop_index('ix_likes_liked_liker', table_name='likes')
+    op.drop_index('ux_likes_liker_liked', table_name='likes')
+    op.create_index('ix_likes_liker_liked', 'likes', ['liker_chat_id', 'liked_chat_id'])
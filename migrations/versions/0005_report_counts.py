@@ -0,0 +1,36 @@
+"""Index reports by reported user and add hourly report counts
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 10:00:00
+
+report_counts starts empty here; run `python -m reports rebuild` once
+after upgrading so existing reports count towards automatic bans.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import has_table, create_index
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    create_index('ix_reports_reported_created', 'reports', ['reported_chat_id', 'created_at'])
+
+    if not has_table('report_counts'):
+        op.create_table(
+            'report_counts',
+            sa.Column('reported_chat_id', sa.BigInteger, primary_key=True),
+            sa.Column('violation', sa.String(50), primary_key=True),
+            sa.Column('hour', sa.DateTime, primary_key=True),
+            sa.Column('count', sa.Integer, nullable=False, server_default='0'),
+        )
+
+
+def downgrade():
+    op.drop_table('report_counts')
+    op.drop_index('ix_reports_reported_created', table_name='reports')
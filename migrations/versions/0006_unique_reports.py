@@ -0,0 +1,39 @@
+"""One report row per reporter, reported user and time
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 14:00:00
+
+Reports replayed from the write-behind journal carry their original
+timestamp, so the unique index turns a replay into a no-op. Duplicates
+already stored are removed; run `python -m reports rebuild` afterwards
+to drop them from report_counts too.
+"""
+from alembic import op
+
+from migrations.helpers import has_index
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_index('reports', 'ux_reports_reporter_reported_created'):
+        op.execute("""
+            DELETE FROM reports WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (
+                        PARTITION BY reporter_chat_id, reported_chat_id, created_at ORDER BY id
+                    ) AS duplicate
+                    FROM reports
+                ) ranked WHERE duplicate > 1
+            )
+        """)
+        op.create_index('ux_reports_reporter_reported_created', 'reports',
+                        ['reporter_chat_id', 'reported_chat_id', 'created_at'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ux_reports_reporter_reported_created', table_name='reports')
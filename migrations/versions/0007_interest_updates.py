@@ -0,0 +1,32 @@
+"""Stamp interest changes so other workers can reload them
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 09:00:00
+
+Users indexed before this start unstamped; workers load them in full at
+startup, and only later changes need to travel through the stamps.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import has_table, create_index
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_table('user_interest_updates'):
+        op.create_table(
+            'user_interest_updates',
+            sa.Column('chat_id', sa.BigInteger, primary_key=True),
+            sa.Column('updated_at', sa.DateTime, nullable=False),
+        )
+    create_index('ix_user_interest_updates_updated_at', 'user_interest_updates', ['updated_at'])
+
+
+def downgrade():
+    op.drop_table('user_interest_updates')
@@ -1,10 +1,17 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, BigInteger, inspect, text
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, BigInteger, Boolean, Float, Index, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.orm import sessionmaker, scoped_session, validates
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
 from datetime import datetime
+import threading
 import logging
+import time
+import os
 import re
 
+from geo import parse_coordinates, geohash_encode
+
 logger = logging.getLogger(__name__)
 
 Base = declarative_base()
@@ -23,6 +30,49 @@ class User(Base):
     interests = Column(Text, nullable=True)
     looking_for = Column(String(10), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Parsed from location; geohash is the spatial index used for radius queries
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    geohash = Column(String(12), nullable=True)
+    
+    __table_args__ = (
+        # Candidate retrieval filters on gender and looking_for, then ranges over age
+        Index('ix_users_gender_looking_for_age', 'gender', 'looking_for', 'age'),
+        Index('ix_users_looking_for_age', 'looking_for', 'age'),
+        Index('ix_users_created_at', 'created_at'),
+        # Pattern ops so Postgres can serve geohash LIKE 'prefix%' from the index
+        Index('ix_users_geohash', 'geohash', postgresql_ops={'geohash': 'varchar_pattern_ops'}),
+    )
+    
+    @validates('location')
+    def validate_location(self, key, location):
+        coordinates = parse_coordinates(location)
+        if coordinates:
+            self.set_coordinates(*coordinates)
+        elif location != self.location:
+            # Typed place names are filled in later by the geocoding service
+            self.set_coordinates(None, None)
+        return location
+    
+    def set_coordinates(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.geohash = geohash_encode(latitude, longitude) if latitude is not None else None
+    
+    def to_dict(self):
+        return {
+            'chat_id': self.chat_id,
+            'username': self.username,
+            'name': self.name,
+            'age': self.age,
+            'gender': self.gender,
+            'location': self.location,
+            'photo': self.photo,
+            'interests': self.interests or '',
+            'looking_for': self.looking_for,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+        }
 
 class Like(Base):
     __tablename__ = 'likes'
@@ -32,6 +82,25 @@ class Like(Base):
     liked_chat_id = Column(BigInteger)
     note = Column(Text, nullable=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # One like per pair; also serves "did X like Y" and X's likes
+        Index('ux_likes_liker_liked', 'liker_chat_id', 'liked_chat_id', unique=True),
+        # "Who liked Y", used for reciprocal checks
+        Index('ix_likes_liked_liker', 'liked_chat_id', 'liker_chat_id'),
+    )
+
+class Match(Base):
+    __tablename__ = 'matches'
+    
+    # Mutual likes, stored once per pair with user_a < user_b
+    user_a = Column(BigInteger, primary_key=True)
+    user_b = Column(BigInteger, primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('ix_matches_user_b', 'user_b'),
+    )
 
 class BannedUser(Base):
     __tablename__ = 'banned_users'
@@ -46,6 +115,23 @@ class Report(Base):
     reported_chat_id = Column(BigInteger)
     violation = Column(String(50))
     created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # Reports against a user, newest first, without a scan
+        Index('ix_reports_reported_created', 'reported_chat_id', 'created_at'),
+        # created_at comes from the journaled report, so a replayed report is recognised
+        Index('ux_reports_reporter_reported_created', 'reporter_chat_id', 'reported_chat_id', 'created_at',
+              unique=True),
+    )
+
+class ReportCount(Base):
+    __tablename__ = 'report_counts'
+    
+    # Reports per user, violation and hour; the aggregate behind auto-bans
+    reported_chat_id = Column(BigInteger, primary_key=True)
+    violation = Column(String(50), primary_key=True)
+    hour = Column(DateTime, primary_key=True)
+    count = Column(Integer, default=0, nullable=False)
 
 class Group(Base):
     __tablename__ = 'groups'
@@ -58,9 +144,138 @@ class Group(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     created_by = Column(BigInteger, nullable=True)
 
+class Interest(Base):
+    __tablename__ = 'interests'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(100), unique=True, nullable=False)
+
+class UserInterest(Base):
+    __tablename__ = 'user_interests'
+    
+    chat_id = Column(BigInteger, primary_key=True)
+    interest_id = Column(Integer, primary_key=True)
+    
+    __table_args__ = (
+        Index('ix_user_interests_interest_id', 'interest_id', 'chat_id'),
+    )
+
+class UserInterestUpdate(Base):
+    __tablename__ = 'user_interest_updates'
+    
+    # When a user's interests were last replaced, so other workers can reload just them
+    chat_id = Column(BigInteger, primary_key=True)
+    updated_at = Column(DateTime, nullable=False)
+    
+    __table_args__ = (
+        Index('ix_user_interest_updates_updated_at', 'updated_at'),
+    )
+
+class ConversationState(Base):
+    __tablename__ = 'conversation_state'
+    
+    namespace = Column(String(50), primary_key=True)
+    key = Column(String(100), primary_key=True)
+    value = Column(Text, nullable=False)
+    expires_at = Column(DateTime, nullable=True, index=True)
+
+class TipCursor(Base):
+    __tablename__ = 'tip_cursors'
+    
+    chat_id = Column(BigInteger, primary_key=True)
+    tip_index = Column(Integer, default=0, nullable=False)
+    last_sent_at = Column(DateTime, nullable=True)
+    blocked = Column(Boolean, default=False, nullable=False)
+
+class BroadcastRun(Base):
+    __tablename__ = 'broadcast_runs'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(50), index=True)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+    last_chat_id = Column(BigInteger, default=0, nullable=False)
+    delivered = Column(Integer, default=0, nullable=False)
+    failed = Column(Integer, default=0, nullable=False)
+    blocked = Column(Integer, default=0, nullable=False)
+
+class GeocodeCache(Base):
+    __tablename__ = 'geocode_cache'
+    
+    query = Column(String(200), primary_key=True)
+    # NULL coordinates cache a lookup that found nothing
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 # Database setup
 engine = None
 SessionLocal = None
+replica_engine = None
+ReadSessionLocal = None
+
+# Seconds to send reads to the primary after the replica fails
+REPLICA_RETRY_AFTER = 30
+_replica_down_until = 0.0
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+    
+    def _do_get(self):
+        started = time.monotonic()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.monotonic() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+    
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'size': self.size(),
+                'checked_out': self.checkedout(),
+                'idle': self.checkedin(),
+                'overflow': max(self.overflow(), 0),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_avg_ms': self.wait_total / self.checkouts * 1000 if self.checkouts else 0.0,
+                'wait_max_ms': self.wait_max * 1000,
+            }
+
+def pool_settings(prefix='DB_'):
+    """Engine pool options from <prefix>POOL_SIZE, MAX_OVERFLOW, POOL_TIMEOUT, POOL_RECYCLE and POOL_PRE_PING"""
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': int(os.getenv(f'{prefix}POOL_SIZE', '5')),
+        'max_overflow': int(os.getenv(f'{prefix}MAX_OVERFLOW', '10')),
+        'pool_timeout': float(os.getenv(f'{prefix}POOL_TIMEOUT', '30')),
+        'pool_recycle': int(os.getenv(f'{prefix}POOL_RECYCLE', '300')),
+        # Off by default: recycling already retires connections before the server drops them
+        'pool_pre_ping': os.getenv(f'{prefix}POOL_PRE_PING', '0') == '1',
+    }
+
+def pool_stats():
+    """Checked-out, overflow and wait-time figures of the primary and replica pools"""
+    stats = {}
+    for name, bound in (('primary', engine), ('replica', replica_engine)):
+        if bound is not None and isinstance(bound.pool, TimedQueuePool):
+            stats[name] = bound.pool.stats()
+    return stats
 
 def fix_database_url(database_url):
     """Fix Render database URLs that have incomplete hostnames"""
@@ -87,8 +302,8 @@ def fix_database_url(database_url):
     
     return database_url
 
-def init_database(database_url):
-    """Initialize database - checks and creates missing tables/columns"""
+def init_database(database_url, replica_url=None):
+    """Initialize database - connects and applies pending schema migrations"""
     global engine, SessionLocal
     
     try:
@@ -102,52 +317,19 @@ def init_database(database_url):
         database_url = fix_database_url(database_url)
         
         # Create engine with connection pool
-        engine = create_engine(
-            database_url,
-            pool_size=5,
-            max_overflow=10,
-            pool_pre_ping=True,
-            pool_recycle=300
-        )
+        engine = create_engine(database_url, **pool_settings())
         
         # Test connection
         logger.info("Testing connection...")
         with engine.connect() as conn:
             conn.execute(text("SELECT 1"))
         
-        # Create all tables (SQLAlchemy will skip existing ones)
-        logger.info("Creating tables if they don't exist...")
-        Base.metadata.create_all(bind=engine)
-        
-        # Check and fix column types
-        logger.info("Checking and fixing column types...")
-        with engine.connect() as conn:
-            # Check if any INTEGER columns need to be BIGINT
-            columns_to_check = [
-                ('users', 'chat_id'),
-                ('likes', 'liker_chat_id'),
-                ('likes', 'liked_chat_id'),
-                ('banned_users', 'user_id'),
-                ('reports', 'reporter_chat_id'),
-                ('reports', 'reported_chat_id'),
-                ('groups', 'created_by')
-            ]
-            
-            for table, column in columns_to_check:
-                try:
-                    # Try to alter to BIGINT if it's INTEGER
-                    conn.execute(text(f"""
-                        ALTER TABLE {table} 
-                        ALTER COLUMN {column} TYPE BIGINT
-                    """))
-                    logger.info(f"✅ Fixed {table}.{column} to BIGINT")
-                except Exception as e:
-                    logger.debug(f"Column {table}.{column} already BIGINT or error: {e}")
-            
-            conn.commit()
+        # Apply pending schema migrations; a no-op version check when up to date
+        upgrade_schema(engine)
         
         # Create session factory
         SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        init_replica(replica_url or os.getenv('DATABASE_REPLICA_URL'))
         logger.info("✅ Database initialized successfully")
         return True
         
@@ -157,6 +339,43 @@ def init_database(database_url):
         logger.error(f"Traceback: {traceback.format_exc()}")
         return False
 
+def alembic_config():
+    from alembic.config import Config
+    
+    root = os.path.dirname(os.path.abspath(__file__))
+    config = Config(os.path.join(root, 'alembic.ini'))
+    config.set_main_option('script_location', os.path.join(root, 'migrations'))
+    return config
+
+def upgrade_schema(engine):
+    """Bring the schema to the latest migration.
+    
+    Compares the version recorded in alembic_version with the head
+    revision and only runs migrations when they differ. On Postgres an
+    advisory lock keeps concurrently starting workers from migrating
+    twice. Returns True if anything was applied.
+    """
+    from alembic import command
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+    
+    config = alembic_config()
+    head = ScriptDirectory.from_config(config).get_current_head()
+    with engine.connect() as conn:
+        current = MigrationContext.configure(conn).get_current_revision()
+    if current == head:
+        logger.info(f"✅ Schema is up to date (revision {head})")
+        return False
+    
+    logger.info(f"🔧 Migrating schema from {current or 'unversioned'} to {head}...")
+    with engine.begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('matching-bot-migrations'))"))
+        config.attributes['connection'] = conn
+        command.upgrade(config, 'head')
+    logger.info(f"✅ Schema migrated to revision {head}")
+    return True
+
 def get_db():
     """Get database session"""
     if SessionLocal is None:
@@ -174,3 +393,41 @@ def close_db(db):
     """Close database session"""
     if db:
         db.close()
+
+def init_replica(replica_url):
+    """Set up the optional read-replica engine, sized by the DB_REPLICA_* settings"""
+    global replica_engine, ReadSessionLocal
+    
+    if not replica_url:
+        replica_engine = ReadSessionLocal = None
+        return False
+    replica_engine = create_engine(fix_database_url(replica_url), **pool_settings('DB_REPLICA_'))
+    ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+    logger.info("✅ Read replica configured")
+    return True
+
+def run_read(fn):
+    """Run fn(db) on the read replica when there is one, else on the primary.
+    
+    A replica that fails with a connection error is skipped for
+    REPLICA_RETRY_AFTER seconds and the read is retried on the primary.
+    Replicas lag, so only use this for reads that tolerate slightly stale
+    data.
+    """
+    global _replica_down_until
+    
+    if ReadSessionLocal is not None and time.monotonic() >= _replica_down_until:
+        db = ReadSessionLocal()
+        try:
+            return fn(db)
+        except OperationalError as e:
+            _replica_down_until = time.monotonic() + REPLICA_RETRY_AFTER
+            logger.warning(f"Read replica unavailable, reading from primary: {e}")
+        finally:
+            db.close()
+    
+    db = get_db()
+    try:
+        return fn(db)
+    finally:
+        close_db(db)
@@ -0,0 +1,250 @@
+from concurrent.futures import Future
+from collections import OrderedDict, deque
+import itertools
+import threading
+import logging
+import heapq
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+logger = logging.getLogger(__name__)
+
+# Lower value is sent first
+PRIORITY_RELAY = 0
+PRIORITY_MATCH = 1
+PRIORITY_TIPS = 2
+
+# Telegram allows roughly 30 messages/second overall and 1/second per chat
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+
+
+class TokenBucket:
+    """Token bucket that reports how long to wait instead of sleeping"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now=None):
+        """Seconds until a token is available"""
+        now = now or time.monotonic()
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self, now=None):
+        """Take a token, possibly going into debt. Returns the wait required"""
+        now = now or time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_full(self, now=None):
+        now = now or time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ('func', 'args', 'kwargs', 'priority', 'on_error', 'future', 'attempts')
+
+    def __init__(self, func, args, kwargs, priority, on_error):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.on_error = on_error
+        self.future = Future()
+        self.attempts = 0
+
+
+class OutboundScheduler:
+    """Central scheduler for outbound Telegram calls.
+
+    Jobs are kept in a FIFO per destination chat, so a chat's messages
+    never overtake each other. Chats whose per-chat bucket allows a send
+    wait in a ready heap ordered by priority (relays, then match
+    notifications, then tips). A worker pool drains the heap, pacing
+    itself with a global bucket. 429 responses are retried after
+    retry_after, other transient errors with exponential backoff, and
+    users who blocked the bot are reported to on_blocked listeners.
+    """
+
+    def __init__(self, workers=8, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE,
+                 chat_burst=CHAT_BURST, max_attempts=5):
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self._global = TokenBucket(global_rate, global_rate) if global_rate else None
+        self._global_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._chats = {}
+        self._buckets = OrderedDict()
+        self._ready = []
+        self._delayed = []
+        self._scheduled = set()
+        self._seq = itertools.count()
+        self._blocked_listeners = []
+        self._threads = []
+        self._started = False
+        self.stats = {'sent': 0, 'retried': 0, 'failed': 0, 'blocked': 0}
+
+    def start(self):
+        with self._cond:
+            if self._started:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"outbound-{i}")
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+
+    def add_blocked_listener(self, callback):
+        """Call callback(chat_id) when a user turns out to have blocked the bot"""
+        self._blocked_listeners.append(callback)
+
+    def submit(self, chat_id, func, *args, priority=PRIORITY_RELAY, on_error=None, **kwargs):
+        """Queue func(*args, **kwargs) for chat_id. Returns a Future with its result"""
+        if not self._started:
+            self.start()
+        job = _Job(func, args, kwargs, priority, on_error)
+        with self._cond:
+            jobs = self._chats.get(chat_id)
+            if jobs is None:
+                jobs = self._chats[chat_id] = deque()
+            jobs.append(job)
+            if chat_id not in self._scheduled:
+                self._schedule(chat_id, time.monotonic())
+            self._cond.notify()
+        return job.future
+
+    def pending(self):
+        with self._cond:
+            return sum(len(jobs) for jobs in self._chats.values())
+
+    def _bucket(self, chat_id, now):
+        """The chat's bucket, in least recently used order.
+
+        A bucket left idle until it refilled is no different from a new
+        one, so such buckets are dropped from the front on every call and
+        only chats messaged within the refill horizon keep one.
+        """
+        buckets = self._buckets
+        while buckets:
+            oldest_chat_id, oldest = next(iter(buckets.items()))
+            if oldest_chat_id == chat_id or not oldest.is_full(now):
+                break
+            del buckets[oldest_chat_id]
+        bucket = buckets.get(chat_id)
+        if bucket is None:
+            bucket = buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        else:
+            buckets.move_to_end(chat_id)
+        return bucket
+
+    def _schedule(self, chat_id, now, extra_delay=0):
+        """Put a chat with pending jobs on the ready or delayed heap"""
+        self._scheduled.add(chat_id)
+        ready_at = now + max(extra_delay, self._bucket(chat_id, now).delay(now))
+        priority = self._chats[chat_id][0].priority
+        if ready_at <= now:
+            heapq.heappush(self._ready, (priority, next(self._seq), chat_id))
+        else:
+            heapq.heappush(self._delayed, (ready_at, priority, next(self._seq), chat_id))
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, priority, seq, chat_id = heapq.heappop(self._delayed)
+                    heapq.heappush(self._ready, (priority, seq, chat_id))
+                if self._ready:
+                    _, _, chat_id = heapq.heappop(self._ready)
+                    self._bucket(chat_id, now).reserve(now)
+                    return chat_id, self._chats[chat_id].popleft()
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._cond.wait(timeout)
+
+    def _pace(self):
+        if self._global is None:
+            return
+        with self._global_lock:
+            wait = self._global.reserve()
+        if wait:
+            time.sleep(wait)
+
+    def _finish(self, chat_id, retry_job=None, retry_delay=0):
+        with self._cond:
+            jobs = self._chats[chat_id]
+            if retry_job is not None:
+                jobs.appendleft(retry_job)
+            now = time.monotonic()
+            if jobs:
+                self._schedule(chat_id, now, retry_delay)
+                self._cond.notify()
+            else:
+                self._scheduled.discard(chat_id)
+                del self._chats[chat_id]
+
+    def _worker(self):
+        while True:
+            chat_id, job = self._next_job()
+            self._pace()
+            job.attempts += 1
+            try:
+                result = job.func(*job.args, **job.kwargs)
+            except Exception as e:
+                retry_delay = self._retry_delay(job, e)
+                if retry_delay is not None:
+                    self.stats['retried'] += 1
+                    self._finish(chat_id, job, retry_delay)
+                    continue
+                self._fail(chat_id, job, e)
+            else:
+                self.stats['sent'] += 1
+                job.future.set_result(result)
+            self._finish(chat_id)
+
+    def _retry_delay(self, job, error):
+        """Seconds to wait before retrying, or None when the error is final"""
+        if job.attempts >= self.max_attempts:
+            return None
+        if isinstance(error, ApiTelegramException):
+            if error.error_code == 429:
+                parameters = (error.result_json or {}).get('parameters') or {}
+                return parameters.get('retry_after', 2 ** job.attempts)
+            if error.error_code < 500:
+                return None
+        return min(2 ** job.attempts, 60)
+
+    def _fail(self, chat_id, job, error):
+        blocked = isinstance(error, ApiTelegramException) and error.error_code == 403
+        if blocked:
+            self.stats['blocked'] += 1
+            logger.info(f"User {chat_id} blocked the bot")
+            for callback in self._blocked_listeners:
+                try:
+                    callback(chat_id)
+                except Exception as e:
+                    logger.error(f"Error in blocked listener: {e}")
+        else:
+            self.stats['failed'] += 1
+            logger.error(f"Error in outbound send to {chat_id}: {error}")
+
+        job.future.set_exception(error)
+        if job.on_error:
+            try:
+                job.on_error(error)
+            except Exception as e:
+                logger.error(f"Error in send error callback: {e}")
@@ -0,0 +1,118 @@
+import logging
+import os
+
+from cache import LRUCache
+from geo import parse_coordinates
+from models import User, get_db, close_db, run_read
+from writebehind import get_write_queue
+
+logger = logging.getLogger(__name__)
+
+# Read-through / write-through cache of profile dicts keyed by chat_id
+profile_cache = LRUCache(
+    maxsize=int(os.getenv('PROFILE_CACHE_SIZE', '50000')),
+    ttl=int(os.getenv('PROFILE_CACHE_TTL', '600'))
+)
+
+PROFILE_FIELDS = ('username', 'name', 'age', 'gender', 'location', 'photo', 'interests', 'looking_for')
+
+
+def get_user_info(chat_id, primary=False):
+    """Return a user's profile dict, or None if they have no profile.
+
+    A cache miss reads a replica unless primary is set, which write paths
+    use so they never build an edit on top of a lagging copy.
+    """
+    chat_id = int(chat_id)
+    profile = profile_cache.get(chat_id)
+    if profile is not None:
+        return profile
+
+    def fetch(db):
+        user = db.get(User, chat_id)
+        return user.to_dict() if user is not None else None
+
+    try:
+        profile = _read_primary(fetch) if primary else run_read(fetch)
+    except Exception as e:
+        logger.error(f"Error fetching user {chat_id}: {e}")
+        return None
+    if profile is None:
+        return None
+
+    profile_cache.set(chat_id, profile)
+    return profile
+
+
+def _read_primary(fetch):
+    db = get_db()
+    try:
+        return fetch(db)
+    finally:
+        close_db(db)
+
+
+def save_user_to_db(chat_id, user_data_obj):
+    """Create or replace a user's profile from the setup flow data"""
+    values = {field: user_data_obj.get(field) for field in PROFILE_FIELDS}
+    if values['interests'] is not None and not isinstance(values['interests'], str):
+        values['interests'] = ', '.join(values['interests'])
+
+    db = get_db()
+    try:
+        user = db.get(User, chat_id)
+        if user is None:
+            user = User(chat_id=chat_id)
+            db.add(user)
+        for field, value in values.items():
+            setattr(user, field, value)
+        db.commit()
+        profile_cache.set(chat_id, user.to_dict())
+        return True
+    except Exception as e:
+        db.rollback()
+        profile_cache.delete(chat_id)
+        logger.error(f"Error saving user {chat_id}: {e}")
+        return False
+    finally:
+        close_db(db)
+
+
+def update_user_field(chat_id, field, value):
+    """Update one profile field.
+
+    The cache is updated at once and the database write is queued on the
+    write-behind queue, so readers see the edit before it is flushed.
+    """
+    if field not in PROFILE_FIELDS:
+        raise ValueError(f"Unknown profile field: {field}")
+    profile = get_user_info(chat_id, primary=True)
+    if profile is None:
+        return False
+    profile = dict(profile, **{field: value})
+    if field == 'location':
+        # Mirror User.validate_location
+        coordinates = parse_coordinates(value)
+        if coordinates:
+            profile['latitude'], profile['longitude'] = coordinates
+        else:
+            profile['latitude'] = profile['longitude'] = None
+    get_write_queue().profile(chat_id, fields={field: value})
+    profile_cache.set(int(chat_id), profile)
+    return True
+
+
+def update_user_coordinates(chat_id, latitude, longitude, location=None):
+    """Store coordinates resolved for a user's typed location.
+
+    Coordinates resolved for a location the user has since changed are
+    dropped.
+    """
+    profile = get_user_info(chat_id, primary=True)
+    if profile is None:
+        return False
+    if location is not None and profile.get('location') != location:
+        return False
+    get_write_queue().profile(chat_id, coordinates=(latitude, longitude), resolved_for=location)
+    profile_cache.set(int(chat_id), dict(profile, latitude=latitude, longitude=longitude))
+    return True
@@ -0,0 +1,101 @@
+from collections import OrderedDict
+import threading
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+# Sustained commands per minute per chat, and how many may arrive at once
+RATE_PER_MINUTE = float(os.getenv('RATE_LIMIT_PER_MINUTE', '30'))
+BURST = int(os.getenv('RATE_LIMIT_BURST', '10'))
+
+# Commands that cost more than one request, e.g. the ones that run matching
+# queries. find_random is the /random step that actually joins the queue
+COMMAND_COSTS = {
+    'view_profiles': 3,
+    'find_random': 2,
+    'filter': 2,
+}
+
+
+class GCRAStore:
+    """Generic cell rate algorithm state: one theoretical arrival time per key.
+
+    A key at rate r may spend cost c when tat - now + c/r stays within the
+    burst allowance, which then advances tat by c/r. That behaves like a
+    sliding window of burst requests refilled at r per second, but needs
+    one float per key instead of a timestamp per request. Keys are kept in
+    the order they were last used; a key whose tat has passed is in the
+    same state as an absent one, so such keys are evicted from the front
+    on every call, keeping memory proportional to the active keys.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._tats = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'allowed': 0, 'limited': 0, 'evicted': 0}
+
+    def __len__(self):
+        return len(self._tats)
+
+    def acquire(self, key, cost, rate, burst):
+        """Spend cost at rate/second for key. Returns 0 if allowed, else seconds to wait"""
+        interval = 1.0 / rate
+        with self._lock:
+            now = self._clock()
+            self._evict_idle(now)
+            tat = max(self._tats.get(key, now), now)
+            new_tat = tat + min(cost, burst) * interval
+            if new_tat - now > burst * interval:
+                self.stats['limited'] += 1
+                return new_tat - now - burst * interval
+            self._tats[key] = new_tat
+            self._tats.move_to_end(key)
+            self.stats['allowed'] += 1
+            return 0
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats, keys=len(self._tats))
+
+    def _evict_idle(self, now):
+        tats = self._tats
+        while tats:
+            key = next(iter(tats))
+            if tats[key] > now:
+                break
+            del tats[key]
+            self.stats['evicted'] += 1
+
+
+class RateLimiter:
+    """Per-chat limits for bot commands, weighted by command cost.
+
+    store is a GCRAStore or anything with its acquire(), such as the one
+    a coordinator shares between workers. If a shared store can't be
+    reached the limiter lets requests through rather than locking every
+    user out.
+    """
+
+    def __init__(self, store, rate_per_minute=RATE_PER_MINUTE, burst=BURST, costs=None):
+        self.store = store
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.costs = COMMAND_COSTS if costs is None else costs
+        self.stats = {'allowed': 0, 'limited': 0, 'errors': 0}
+
+    def is_allowed(self, chat_id, command=None):
+        cost = self.costs.get(command, 1)
+        try:
+            wait = self.store.acquire(chat_id, cost, self.rate, self.burst)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Rate limiter unavailable, allowing {chat_id}: {e}")
+            return True
+        self.stats['limited' if wait else 'allowed'] += 1
+        return not wait
+
+    def metrics(self):
+        return dict(self.stats, rate_per_minute=self.rate * 60, burst=self.burst)
@@ -0,0 +1,310 @@
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+import threading
+import argparse
+import logging
+import time
+import os
+
+from sqlalchemy import text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from bans import ban_user, check_banned
+from cache import LRUCache
+from models import Report, ReportCount, get_db, close_db, init_database
+from writebehind import get_write_queue
+
+logger = logging.getLogger(__name__)
+
+# Reports count towards a ban for this many hours
+WINDOW_HOURS = int(os.getenv('REPORT_WINDOW_HOURS', '24'))
+# Distinct reporters within the window that trigger an automatic ban
+BAN_THRESHOLD = int(os.getenv('REPORT_BAN_THRESHOLD', '5'))
+# Lower thresholds for serious violations
+VIOLATION_THRESHOLDS = {'harassment': 3, 'underage': 2}
+# No single reporter can get anyone banned, whatever the thresholds say
+MIN_REPORTERS = 2
+
+VIOLATIONS = ('spam', 'offensive', 'harassment', 'fake', 'underage', 'other')
+
+
+def current_hour(ts=None):
+    return int((ts or time.time()) // 3600)
+
+
+class _UserReports:
+    __slots__ = ('hours', 'buckets', 'by_violation', 'total')
+
+    def __init__(self):
+        self.hours = deque()
+        self.buckets = {}
+        self.by_violation = {}
+        self.total = 0
+
+
+class ReportAggregate:
+    """Per-user report counts by violation over a sliding window of hourly buckets.
+
+    Each user keeps a deque of the hours they were reported in, the counts
+    of every hour, and running totals. Adding a report updates one bucket
+    and the totals; buckets that slid out of the window are subtracted
+    as they are reached, so each is dropped once and a check is amortized
+    O(1). Users with nothing left in the window are evicted in the order
+    they were last reported.
+    """
+
+    def __init__(self, window_hours=WINDOW_HOURS):
+        self.window_hours = window_hours
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._users)
+
+    def add(self, chat_id, violation, hour=None, count=1):
+        """Count a report and return the user's window counts"""
+        hour = hour if hour is not None else current_hour()
+        with self._lock:
+            self._evict_users(hour)
+            user = self._users.get(chat_id)
+            if user is None:
+                user = self._users[chat_id] = _UserReports()
+            else:
+                self._users.move_to_end(chat_id)
+            self._expire(user, hour)
+            self._increment(user, hour, violation, count)
+            return self._counts(user)
+
+    def counts(self, chat_id, hour=None):
+        """{'total': n, 'by_violation': {violation: n}} within the window"""
+        hour = hour if hour is not None else current_hour()
+        with self._lock:
+            user = self._users.get(chat_id)
+            if user is None:
+                return {'total': 0, 'by_violation': {}}
+            self._expire(user, hour)
+            return self._counts(user)
+
+    def load(self, rows):
+        """Set bucket counts from [(chat_id, violation, hour, count)], e.g. from report_counts"""
+        with self._lock:
+            for chat_id, violation, hour, count in sorted(rows, key=lambda row: row[2]):
+                user = self._users.get(chat_id)
+                if user is None:
+                    user = self._users[chat_id] = _UserReports()
+                current = user.buckets.get(hour, {}).get(violation, 0)
+                if count != current:
+                    self._increment(user, hour, violation, count - current)
+        return len(rows)
+
+    def _increment(self, user, hour, violation, count):
+        bucket = user.buckets.get(hour)
+        if bucket is None:
+            bucket = user.buckets[hour] = {}
+            # Buckets mostly arrive in order; keep the deque sorted otherwise
+            if user.hours and user.hours[-1] > hour:
+                user.hours = deque(sorted([*user.hours, hour]))
+            else:
+                user.hours.append(hour)
+        bucket[violation] = bucket.get(violation, 0) + count
+        user.by_violation[violation] = user.by_violation.get(violation, 0) + count
+        user.total += count
+
+    def _expire(self, user, hour):
+        oldest = hour - self.window_hours + 1
+        while user.hours and user.hours[0] < oldest:
+            for violation, count in user.buckets.pop(user.hours.popleft()).items():
+                user.by_violation[violation] -= count
+                if not user.by_violation[violation]:
+                    del user.by_violation[violation]
+                user.total -= count
+
+    def _evict_users(self, hour):
+        oldest = hour - self.window_hours + 1
+        while self._users:
+            chat_id, user = next(iter(self._users.items()))
+            if user.hours and user.hours[-1] >= oldest:
+                break
+            del self._users[chat_id]
+
+    @staticmethod
+    def _counts(user):
+        return {'total': user.total, 'by_violation': dict(user.by_violation)}
+
+
+def should_ban(counts):
+    """Whether window counts, in distinct reporters, warrant an automatic ban"""
+    if counts['total'] >= max(BAN_THRESHOLD, MIN_REPORTERS):
+        return True
+    return any(counts['by_violation'].get(violation, 0) >= max(threshold, MIN_REPORTERS)
+               for violation, threshold in VIOLATION_THRESHOLDS.items())
+
+
+# (reporter, reported) pairs seen within the window, in front of the reports
+# table; updates are partitioned by the reporter's chat, so each worker sees
+# all of its reporters' reports
+_recent_reports = LRUCache(maxsize=100000, ttl=WINDOW_HOURS * 3600)
+
+
+def reported_within_window(reporter_chat_id, reported_chat_id):
+    """Whether reports holds a report of this user by this reporter within the window"""
+    since = datetime.utcnow() - timedelta(hours=WINDOW_HOURS)
+    db = get_db()
+    try:
+        return db.query(Report.id).filter(
+            Report.reporter_chat_id == reporter_chat_id,
+            Report.reported_chat_id == reported_chat_id,
+            Report.created_at >= since
+        ).first() is not None
+    finally:
+        close_db(db)
+
+
+def record_report(reporter_chat_id, reported_chat_id, violation, aggregate):
+    """Record a report and auto-ban the reported user once they cross a threshold.
+
+    The row is written through the write-behind queue, which also keeps
+    report_counts current. Only a reporter's first report of a user within
+    the window counts, checked against the reports table so a restart
+    doesn't reset it. Returns True if the report was counted.
+    """
+    reporter_chat_id, reported_chat_id = int(reporter_chat_id), int(reported_chat_id)
+    if reporter_chat_id == reported_chat_id:
+        return False
+    key = (reporter_chat_id, reported_chat_id)
+    if key in _recent_reports:
+        return False
+    try:
+        countable = not reported_within_window(reporter_chat_id, reported_chat_id)
+    except Exception as e:
+        # Keep the report, but one that can't be deduped doesn't count towards a ban here
+        logger.error(f"Error checking earlier reports by {reporter_chat_id}: {e}")
+        countable = None
+    _recent_reports.set(key, True)
+    if countable is False:
+        return False
+
+    violation = violation if violation in VIOLATIONS else 'other'
+    get_write_queue().report(reporter_chat_id, reported_chat_id, violation)
+    if not countable:
+        return True
+    counts = aggregate.add(reported_chat_id, violation)
+    if should_ban(counts) and not check_banned(reported_chat_id):
+        logger.info(f"Auto-banning {reported_chat_id} after reports: {counts}")
+        ban_user(reported_chat_id)
+    return True
+
+
+def count_reports(db, inserted):
+    """Add newly inserted reports, [(reporter, reported, violation, created_at)], to report_counts.
+
+    Like the in-memory aggregate, report_counts counts distinct reporters:
+    a report is skipped when the same reporter reported the same user
+    earlier within the window. Runs in the transaction that inserted them,
+    so it sees them too.
+    """
+    window = timedelta(hours=WINDOW_HOURS)
+    earlier = {}
+    for reporter, reported, created_at in db.query(
+        Report.reporter_chat_id, Report.reported_chat_id, Report.created_at
+    ).filter(
+        tuple_(Report.reporter_chat_id, Report.reported_chat_id).in_(
+            {(reporter, reported) for reporter, reported, _, _ in inserted}
+        ),
+        Report.created_at >= min(created_at for _, _, _, created_at in inserted) - window,
+        Report.created_at <= max(created_at for _, _, _, created_at in inserted)
+    ):
+        earlier.setdefault((reporter, reported), []).append(created_at)
+
+    counts = Counter(
+        (reported, violation, created_at.replace(minute=0, second=0, microsecond=0))
+        for reporter, reported, violation, created_at in inserted
+        if not any(created_at - window <= other < created_at for other in earlier.get((reporter, reported), ()))
+    )
+    if not counts:
+        return
+    stmt = insert(ReportCount).values([
+        {'reported_chat_id': reported, 'violation': violation, 'hour': hour, 'count': count}
+        for (reported, violation, hour), count in counts.items()
+    ])
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[ReportCount.reported_chat_id, ReportCount.violation, ReportCount.hour],
+        set_={'count': ReportCount.count + stmt.excluded.count}
+    ))
+
+
+def load_report_aggregate(aggregate, batch_size=1000):
+    """Load the window's buckets from report_counts into an aggregate"""
+    since = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=WINDOW_HOURS - 1)
+    db = get_db()
+    try:
+        rows = [
+            (chat_id, violation, current_hour(hour.replace(tzinfo=timezone.utc).timestamp()), count)
+            for chat_id, violation, hour, count in db.query(
+                ReportCount.reported_chat_id, ReportCount.violation, ReportCount.hour, ReportCount.count
+            ).filter(ReportCount.hour >= since)
+        ]
+    finally:
+        close_db(db)
+    for start in range(0, len(rows), batch_size):
+        aggregate.load(rows[start:start + batch_size])
+    logger.info(f"✅ Loaded {len(rows)} report buckets")
+    return len(rows)
+
+
+def rebuild_report_counts(batch_size=10000):
+    """Recompute report_counts from the reports table, one reported-user range per transaction"""
+    db = get_db()
+    rebuilt = 0
+    last_reported = None
+    try:
+        while True:
+            query = db.query(Report.reported_chat_id).distinct()
+            if last_reported is not None:
+                query = query.filter(Report.reported_chat_id > last_reported)
+            reported = [row[0] for row in query.order_by(Report.reported_chat_id).limit(batch_size)]
+            if not reported:
+                break
+            params = {'first': reported[0], 'last': reported[-1], 'window': WINDOW_HOURS}
+            db.execute(text("""
+                DELETE FROM report_counts WHERE reported_chat_id BETWEEN :first AND :last
+            """), params)
+            result = db.execute(text("""
+                INSERT INTO report_counts (reported_chat_id, violation, hour, count)
+                SELECT r.reported_chat_id, COALESCE(r.violation, 'other'), date_trunc('hour', r.created_at), COUNT(*)
+                FROM reports r
+                WHERE r.reported_chat_id BETWEEN :first AND :last
+                -- Distinct reporters, as count_reports does
+                AND NOT EXISTS (
+                    SELECT 1 FROM reports earlier
+                    WHERE earlier.reporter_chat_id = r.reporter_chat_id
+                    AND earlier.reported_chat_id = r.reported_chat_id
+                    AND earlier.created_at < r.created_at
+                    AND earlier.created_at >= r.created_at - :window * INTERVAL '1 hour'
+                )
+                GROUP BY r.reported_chat_id, COALESCE(r.violation, 'other'), date_trunc('hour', r.created_at)
+            """), params)
+            db.commit()
+            rebuilt += result.rowcount
+            last_reported = reported[-1]
+        logger.info(f"✅ Rebuilt {rebuilt} report count buckets")
+        return rebuilt
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error rebuilding report counts: {e}")
+        return rebuilt
+    finally:
+        close_db(db)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Report maintenance")
+    parser.add_argument('command', choices=['rebuild'], help="rebuild: recompute report_counts from the "
+                                                              "reports table, e.g. after upgrading")
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not init_database(args.database_url):
+        raise SystemExit(1)
+    rebuild_report_counts()
@@ -0,0 +1,116 @@
+from functools import lru_cache
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Scoring weights
+BASE_SCORE = 100
+AGE_DIFF_PENALTY = 3
+SHARED_INTEREST_BONUS = 10
+
+GENDER_CODES = {'M': 0, 'F': 1}
+EARTH_RADIUS_KM = 6371.0
+
+# Number of set bits in every byte value, for popcount over bitsets
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+@lru_cache(maxsize=65536)
+def split_interests(interests):
+    """Split a comma-joined interests string into normalized names"""
+    if not interests:
+        return ()
+    return tuple(sorted({part.strip().lower() for part in interests.split(',') if part.strip()}))
+
+
+def shared_interest_count(interests_a, interests_b):
+    return len(set(split_interests(interests_a or '')) & set(split_interests(interests_b or '')))
+
+
+def interest_bitset(columns, words):
+    bits = np.zeros(words, dtype=np.uint64)
+    for column in columns:
+        bits[column >> 6] |= np.uint64(1) << np.uint64(column & 63)
+    return bits
+
+
+class ProfileMatrix:
+    """Candidate profiles packed into column arrays for vectorized scoring.
+
+    Each candidate is one row: age, gender code, looking_for, lat/lon (NaN
+    when unknown) and its interests as a bitset of uint64 words. Scoring a
+    user against all rows is a handful of NumPy operations; shared
+    interests are a bitwise AND followed by a byte-table popcount.
+
+    interests_of(profile) gives a profile's interest IDs, e.g. those of
+    the interests table. Only the IDs present in the matrix get a bit
+    column, so its width follows the candidates, not the vocabulary.
+    """
+
+    def __init__(self, profiles, interests_of):
+        self.profiles = list(profiles)
+        self.interests_of = interests_of
+        n = len(self.profiles)
+        id_sets = [interests_of(p) for p in self.profiles]
+        self.columns = {interest_id: column for column, interest_id
+                        in enumerate(sorted(set().union(*id_sets)))}
+        self.words = max(1, (len(self.columns) + 63) // 64)
+
+        self.ages = np.array([p.get('age') or 0 for p in self.profiles], dtype=np.float32)
+        self.genders = np.array([GENDER_CODES.get(p.get('gender'), -1) for p in self.profiles], dtype=np.int8)
+        self.looking_for = np.array([p.get('looking_for') or '' for p in self.profiles])
+        self.lats = np.array([np.nan if p.get('latitude') is None else p['latitude'] for p in self.profiles],
+                             dtype=np.float64)
+        self.lons = np.array([np.nan if p.get('longitude') is None else p['longitude'] for p in self.profiles],
+                             dtype=np.float64)
+        self.interests = np.zeros((n, self.words), dtype=np.uint64)
+        rows = np.repeat(np.arange(n), [len(ids) for ids in id_sets])
+        columns = np.fromiter((self.columns[i] for id_set in id_sets for i in id_set), dtype=np.uint64,
+                              count=len(rows))
+        np.bitwise_or.at(self.interests, (rows, (columns >> np.uint64(6)).astype(np.intp)),
+                         np.left_shift(np.uint64(1), columns & np.uint64(63)))
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def shared_interests(self, ids):
+        """Number of the interest IDs ids shared by each row"""
+        user_bits = interest_bitset((self.columns[i] for i in ids if i in self.columns), self.words)
+        common = np.bitwise_and(self.interests, user_bits)
+        return POPCOUNT[common.view(np.uint8)].reshape(len(self), -1).sum(axis=1)
+
+    def distances_km(self, lat, lon):
+        lat1, lon1 = np.radians(lat), np.radians(lon)
+        lat2, lon2 = np.radians(self.lats), np.radians(self.lons)
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+    def score(self, user_info, gender_preference='BOTH', k=10, max_age_diff=None, max_distance_km=None):
+        """Score user_info against every row and return the top k (profile, score)"""
+        if not len(self):
+            return []
+
+        shared = self.shared_interests(self.interests_of(user_info))
+        age = float(user_info.get('age') or 0)
+        age_diff = np.abs(self.ages - age)
+        scores = BASE_SCORE - AGE_DIFF_PENALTY * age_diff + SHARED_INTEREST_BONUS * shared
+
+        mask = self.looking_for == (user_info.get('looking_for') or '')
+        if gender_preference in GENDER_CODES:
+            mask &= self.genders == GENDER_CODES[gender_preference]
+        if max_age_diff:
+            mask &= age_diff <= max_age_diff
+        if max_distance_km and user_info.get('latitude') is not None and user_info.get('longitude') is not None:
+            with np.errstate(invalid='ignore'):
+                mask &= self.distances_km(user_info['latitude'], user_info['longitude']) <= max_distance_km
+
+        candidates = np.flatnonzero(mask)
+        if not len(candidates):
+            return []
+        if len(candidates) > k:
+            top = np.argpartition(-scores[candidates], k - 1)[:k]
+            candidates = candidates[top]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(self.profiles[i], int(scores[i])) for i in candidates]
@@ -0,0 +1,67 @@
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ChatSessions:
+    """Registry of active random-chat pairs, sharded by chat_id.
+
+    Lookups are a plain dict read and take no lock. Pairing and ending a
+    chat lock only the shards of the two users involved, always in shard
+    order so two concurrent operations cannot deadlock.
+    """
+
+    def __init__(self, shards=64):
+        self._shards = [({}, threading.Lock()) for _ in range(shards)]
+
+    def _shard(self, chat_id):
+        return self._shards[hash(chat_id) % len(self._shards)]
+
+    def _locks(self, *chat_ids):
+        indexes = sorted({hash(c) % len(self._shards) for c in chat_ids})
+        return [self._shards[i][1] for i in indexes]
+
+    def __contains__(self, chat_id):
+        return chat_id in self._shard(chat_id)[0]
+
+    def partner_of(self, chat_id):
+        """Return the partner's chat_id, or None when not chatting"""
+        return self._shard(chat_id)[0].get(chat_id)
+
+    def pair(self, chat_id, partner_chat_id):
+        """Start a chat session between two users"""
+        locks = self._locks(chat_id, partner_chat_id)
+        for lock in locks:
+            lock.acquire()
+        try:
+            self._shard(chat_id)[0][chat_id] = partner_chat_id
+            self._shard(partner_chat_id)[0][partner_chat_id] = chat_id
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def end(self, chat_id):
+        """End the user's chat session. Returns the former partner, or None"""
+        partner_chat_id = self.partner_of(chat_id)
+        if partner_chat_id is None:
+            return None
+
+        locks = self._locks(chat_id, partner_chat_id)
+        for lock in locks:
+            lock.acquire()
+        try:
+            # The session may have been ended concurrently by the partner
+            if self._shard(chat_id)[0].get(chat_id) != partner_chat_id:
+                return None
+            del self._shard(chat_id)[0][chat_id]
+            partners = self._shard(partner_chat_id)[0]
+            if partners.get(partner_chat_id) == chat_id:
+                del partners[partner_chat_id]
+            return partner_chat_id
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def __len__(self):
+        return sum(len(sessions) for sessions, _ in self._shards) // 2
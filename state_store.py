@@ -0,0 +1,201 @@
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+import threading
+import logging
+import sqlite3
+import json
+import time
+import os
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class StateStore(ABC):
+    """Per-chat conversation state: JSON-serializable dicts with a TTL.
+
+    get returns None for missing or expired keys, set replaces the value,
+    update merges fields into it and delete drops it.
+    """
+
+    def __init__(self, namespace, ttl=None):
+        self.namespace = namespace
+        self.ttl = ttl
+
+    @abstractmethod
+    def get(self, key):
+        pass
+
+    @abstractmethod
+    def set(self, key, value, ttl=None):
+        pass
+
+    @abstractmethod
+    def delete(self, key):
+        pass
+
+    def update(self, key, ttl=None, **fields):
+        value = self.get(key) or {}
+        value.update(fields)
+        self.set(key, value, ttl)
+        return value
+
+    def _ttl(self, ttl):
+        return ttl if ttl is not None else self.ttl
+
+
+class MemoryStateStore(StateStore):
+    """In-process backend, bounded by an LRU. Lost on restart"""
+
+    def __init__(self, namespace, ttl=None, maxsize=100000):
+        super().__init__(namespace, ttl)
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key):
+        value = self._cache.get(key)
+        # Hand out a copy, as the persistent backends do
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self._cache.set(key, json.dumps(value), self._ttl(ttl))
+
+    def delete(self, key):
+        self._cache.delete(key)
+
+
+class SQLiteStateStore(StateStore):
+    """Local file backend; survives restarts of a single bot process"""
+
+    PURGE_EVERY = 1000
+
+    def __init__(self, namespace, ttl=None, path='user_data.db'):
+        super().__init__(namespace, ttl)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._writes = 0
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS conversation_state (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_conversation_state_expires_at ON conversation_state (expires_at)"
+            )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM conversation_state WHERE namespace = ? AND key = ?",
+                (self.namespace, str(key))
+            ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            self.delete(key)
+            return None
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self._ttl(ttl)
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO conversation_state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, str(key), json.dumps(value), expires_at)
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._conn.execute(
+                    "DELETE FROM conversation_state WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                    (time.time(),)
+                )
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM conversation_state WHERE namespace = ? AND key = ?",
+                (self.namespace, str(key))
+            )
+
+
+class DatabaseStateStore(StateStore):
+    """Backend in the shared database, visible to every bot worker"""
+
+    PURGE_EVERY = 1000
+
+    def __init__(self, namespace, ttl=None):
+        super().__init__(namespace, ttl)
+        self._writes = 0
+
+    def get(self, key):
+        from models import ConversationState, get_db, close_db
+
+        db = get_db()
+        try:
+            row = db.get(ConversationState, (self.namespace, str(key)))
+            if row is None:
+                return None
+            if row.expires_at is not None and row.expires_at <= datetime.utcnow():
+                db.delete(row)
+                db.commit()
+                return None
+            return json.loads(row.value)
+        finally:
+            close_db(db)
+
+    def set(self, key, value, ttl=None):
+        from models import ConversationState, get_db, close_db
+
+        ttl = self._ttl(ttl)
+        db = get_db()
+        try:
+            db.merge(ConversationState(
+                namespace=self.namespace,
+                key=str(key),
+                value=json.dumps(value),
+                expires_at=datetime.utcnow() + timedelta(seconds=ttl) if ttl else None
+            ))
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                db.query(ConversationState).filter(
+                    ConversationState.expires_at <= datetime.utcnow()
+                ).delete(synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            close_db(db)
+
+    def delete(self, key):
+        from models import ConversationState, get_db, close_db
+
+        db = get_db()
+        try:
+            db.query(ConversationState).filter(
+                ConversationState.namespace == self.namespace,
+                ConversationState.key == str(key)
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            close_db(db)
+
+
+def create_state_store(namespace, ttl=None):
+    """Build a store from STATE_BACKEND (memory, sqlite or database)"""
+    backend = os.getenv('STATE_BACKEND', 'sqlite')
+    if backend == 'memory':
+        return MemoryStateStore(namespace, ttl, maxsize=int(os.getenv('STATE_MEMORY_SIZE', '100000')))
+    if backend == 'database':
+        return DatabaseStateStore(namespace, ttl)
+    if backend == 'sqlite':
+        return SQLiteStateStore(namespace, ttl, path=os.getenv('STATE_SQLITE_PATH', 'user_data.db'))
+    raise ValueError(f"Unknown STATE_BACKEND: {backend}")
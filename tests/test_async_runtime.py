@@ -0,0 +1,58 @@
+import asyncio
+import types
+
+from async_runtime import AsyncRuntime
+from sessions import ChatSessions
+
+
+class FakeDispatcher:
+    def __init__(self, busy=()):
+        self.busy = set(busy)
+        self.dispatched = []
+
+    def is_busy(self, chat_id):
+        return chat_id in self.busy
+
+    def dispatch(self, updates):
+        self.dispatched.extend(update.update_id for update in updates)
+
+
+class FakeOutbox:
+    def __init__(self):
+        self.sent = []
+
+    def submit(self, chat_id, func, *args, **kwargs):
+        self.sent.append((chat_id, args[-1]))
+
+
+def make_update(update_id, chat_id, text):
+    message = types.SimpleNamespace(chat=types.SimpleNamespace(id=chat_id), text=text)
+    return types.SimpleNamespace(update_id=update_id, message=message)
+
+
+def run(dispatcher, updates):
+    sessions = ChatSessions()
+    sessions.pair(1, 2)
+    outbox = FakeOutbox()
+    runtime = AsyncRuntime(types.SimpleNamespace(token='123:TEST', send_message=None), sessions, outbox, dispatcher)
+    asyncio.run(runtime.process_new_updates(updates))
+    return outbox.sent
+
+
+def test_relays_chat_text_and_dispatches_the_rest():
+    dispatcher = FakeDispatcher()
+    sent = run(dispatcher, [
+        make_update(1, 1, 'hi'),
+        make_update(2, 1, '/help'),
+        make_update(3, 3, 'Ann'),
+        make_update(4, 2, 'End Chat'),
+    ])
+    assert sent == [(2, 'hi')]
+    assert dispatcher.dispatched == [2, 3, 4]
+
+
+def test_relay_waits_behind_its_chats_dispatched_updates():
+    dispatcher = FakeDispatcher(busy={1})
+    sent = run(dispatcher, [make_update(1, 1, 'hi'), make_update(2, 2, 'hello')])
+    assert sent == [(1, 'hello')]
+    assert dispatcher.dispatched == [1]
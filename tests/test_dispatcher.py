@@ -0,0 +1,67 @@
+import random
+import threading
+import time
+import types
+
+from dispatcher import LanePool, UpdateDispatcher
+
+
+def make_update(update_id, chat_id, text):
+    chat = types.SimpleNamespace(id=chat_id)
+    message = types.SimpleNamespace(chat=chat, text=text)
+    return types.SimpleNamespace(update_id=update_id, message=message, callback_query=None)
+
+
+class FakeBot:
+    def __init__(self):
+        self.threaded = True
+        self.handled = []
+        self.lock = threading.Lock()
+        self.done = threading.Semaphore(0)
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            if update.message.text == 'slow':
+                time.sleep(random.random() / 500)
+            with self.lock:
+                self.handled.append(update)
+            self.done.release()
+
+
+def classify(update):
+    return 'heavy' if update.message.text == 'slow' else 'default'
+
+
+def test_keeps_each_chats_order_across_pools():
+    bot = FakeBot()
+    dispatcher = UpdateDispatcher(classify, [LanePool('default', lanes=4), LanePool('heavy', lanes=2)])
+    dispatcher.install(bot)
+    assert not bot.threaded
+
+    rng = random.Random(7)
+    updates = [make_update(i, rng.randrange(10), rng.choice(['fast', 'slow'])) for i in range(300)]
+    bot.process_new_updates(updates)
+    for _ in updates:
+        assert bot.done.acquire(timeout=10)
+
+    for chat_id in range(10):
+        sent = [u.update_id for u in updates if u.message.chat.id == chat_id]
+        handled = [u.update_id for u in bot.handled if u.message.chat.id == chat_id]
+        assert handled == sent
+    time.sleep(0.05)
+    assert dispatcher.metrics()['busy_chats'] == 0
+
+
+def test_full_pool_rejects_without_blocking():
+    rejected = []
+    release = threading.Event()
+    pool = LanePool('heavy', lanes=1, maxsize=2, block_timeout=0,
+                    on_reject=lambda chat_id, update: rejected.append(chat_id))
+    pool.start(lambda updates: release.wait(5))
+
+    assert pool.submit(1, make_update(1, 1, 'slow'))
+    assert pool.submit(2, make_update(2, 2, 'slow'))
+    assert not pool.submit(3, make_update(3, 3, 'slow'))
+    assert rejected == [3]
+    assert pool.metrics()['rejected'] == 1
+    release.set()
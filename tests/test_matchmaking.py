@@ -0,0 +1,78 @@
+import pytest
+
+import matchmaking
+from matchmaking import MatchQueue
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    class Clock:
+        now = 1000.0
+
+    monkeypatch.setattr(matchmaking.time, 'time', lambda: Clock.now)
+    return Clock
+
+
+def test_pairs_with_oldest_compatible_waiter(clock):
+    queue = MatchQueue(ttl=None)
+    assert queue.enqueue(1, 'F', 'M', 'chat') is None
+    clock.now += 1
+    assert queue.enqueue(2, 'F', 'BOTH', 'chat') is None
+    assert queue.enqueue(3, 'M', 'F', 'chat') == 1
+    assert queue.enqueue(4, 'M', 'F', 'dating') is None
+    assert 2 in queue and 4 in queue and len(queue) == 2
+
+
+def test_position_and_eta(clock):
+    queue = MatchQueue(ttl=None)
+    for chat_id in (1, 2, 3):
+        queue.enqueue(chat_id, 'F', 'M', 'chat')
+    assert queue.status(3)['position'] == 3
+    assert queue.status(3)['eta'] is None
+
+    clock.now += 10
+    assert queue.enqueue(10, 'M', 'F', 'chat') == 1
+    clock.now += 10
+    assert queue.enqueue(11, 'M', 'F', 'chat') == 2
+    status = queue.status(3)
+    assert status['position'] == 1 and status['waiting'] == 1
+    # Matches came every 10s on average and the last one was just now
+    assert status['eta'] == pytest.approx(10.0)
+    assert queue.status(10) is None
+
+
+def test_position_skips_cancelled_waiters(clock):
+    queue = MatchQueue(ttl=None)
+    for chat_id in (1, 2, 3, 4, 5):
+        queue.enqueue(chat_id, 'F', 'M', 'chat')
+    assert queue.cancel(2)
+    assert queue.status(5)['position'] == 4
+    assert not queue.cancel(2)
+
+
+def test_expired_waiters_are_dropped_and_handed_out_once(clock):
+    queue = MatchQueue(ttl=60)
+    queue.enqueue(1, 'F', 'M', 'chat')
+    clock.now += 30
+    queue.enqueue(2, 'F', 'M', 'chat')
+    clock.now += 31
+    assert queue.expire() == [1]
+    assert queue.expire() == []
+    # Nobody is paired with a waiter who timed out
+    assert queue.enqueue(3, 'M', 'F', 'chat') == 2
+    assert queue.metrics()['buckets']['F_M_chat']['expired'] == 1
+
+
+def test_requeued_waiter_keeps_new_expiry(clock):
+    queue = MatchQueue(ttl=60)
+    queue.enqueue(1, 'F', 'M', 'chat')
+    clock.now += 50
+    queue.cancel(1)
+    queue.enqueue(1, 'F', 'M', 'chat')
+    clock.now += 20
+    # The first entry's expiry has passed but belongs to the cancelled waiter
+    assert queue.expire() == []
+    assert 1 in queue
+    clock.now += 40
+    assert queue.expire() == [1]
+    assert 1 not in queue
@@ -0,0 +1,33 @@
+import time
+
+from concurrent.futures import wait
+
+from outbound import OutboundScheduler, TokenBucket
+
+
+def test_token_bucket_goes_into_debt():
+    bucket = TokenBucket(rate=2.0, capacity=2)
+    now = bucket.updated
+    assert bucket.reserve(now) == 0
+    assert bucket.reserve(now) == 0
+    assert bucket.reserve(now) == 0.5
+    assert not bucket.is_full(now + 1.0)
+    assert bucket.is_full(now + 1.5)
+
+
+def test_keeps_each_chats_order():
+    outbox = OutboundScheduler(workers=4, global_rate=None, chat_rate=1000, chat_burst=3)
+    sent = []
+    futures = [outbox.submit(chat_id, sent.append, (chat_id, n)) for n in range(5) for chat_id in range(3)]
+    wait(futures, timeout=5)
+    for chat_id in range(3):
+        assert [n for c, n in sent if c == chat_id] == list(range(5))
+
+
+def test_idle_chat_buckets_are_dropped():
+    outbox = OutboundScheduler(workers=4, global_rate=None, chat_rate=100, chat_burst=1)
+    wait([outbox.submit(chat_id, lambda: None) for chat_id in range(500)], timeout=5)
+    # One-off sends each left a bucket behind until they refill
+    time.sleep(0.05)
+    wait([outbox.submit('last', lambda: None)], timeout=5)
+    assert list(outbox._buckets) == ['last']
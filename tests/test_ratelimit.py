@@ -0,0 +1,66 @@
+from ratelimit import GCRAStore, RateLimiter
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_burst_then_limited():
+    clock = FakeClock()
+    store = GCRAStore(clock)
+    assert all(store.acquire('chat', 1, rate=1.0, burst=5) == 0 for _ in range(5))
+    assert store.acquire('chat', 1, rate=1.0, burst=5) == 1.0
+    assert store.stats == {'allowed': 5, 'limited': 1, 'evicted': 0}
+
+
+def test_refills_at_rate():
+    clock = FakeClock()
+    store = GCRAStore(clock)
+    for _ in range(5):
+        store.acquire('chat', 1, rate=2.0, burst=5)
+    assert store.acquire('chat', 1, rate=2.0, burst=5) == 0.5
+    clock.now += 0.5
+    assert store.acquire('chat', 1, rate=2.0, burst=5) == 0
+    assert store.acquire('chat', 1, rate=2.0, burst=5) > 0
+
+
+def test_cost_spends_several_requests():
+    clock = FakeClock()
+    store = GCRAStore(clock)
+    assert store.acquire('chat', 3, rate=1.0, burst=5) == 0
+    assert store.acquire('chat', 3, rate=1.0, burst=5) == 1.0
+    assert store.acquire('chat', 2, rate=1.0, burst=5) == 0
+
+
+def test_idle_keys_are_evicted():
+    clock = FakeClock()
+    store = GCRAStore(clock)
+    store.acquire('a', 1, rate=1.0, burst=5)
+    store.acquire('b', 2, rate=1.0, burst=5)
+    clock.now += 1.5
+    store.acquire('c', 1, rate=1.0, burst=5)
+    assert len(store) == 2
+    clock.now += 0.6
+    store.acquire('c', 1, rate=1.0, burst=5)
+    assert len(store) == 1
+    assert store.stats['evicted'] == 2
+
+
+def test_limiter_weighs_commands_and_fails_open():
+    clock = FakeClock()
+    limiter = RateLimiter(GCRAStore(clock), rate_per_minute=60, burst=4, costs={'heavy': 3})
+    assert limiter.is_allowed(1, 'heavy')
+    assert not limiter.is_allowed(1, 'heavy')
+    assert limiter.is_allowed(1)
+
+    class Down:
+        def acquire(self, *args):
+            raise ConnectionError('coordinator unreachable')
+
+    limiter = RateLimiter(Down())
+    assert limiter.is_allowed(1)
+    assert limiter.stats['errors'] == 1
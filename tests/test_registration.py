@@ -0,0 +1,115 @@
+"""Run the profile setup steps of main.py against a store that hands out copies"""
+import logging
+import os
+import types
+
+import pytest
+from telebot import Handler
+from telebot import types as telebot_types
+from telebot.handler_backends import MemoryHandlerBackend
+
+MAIN = os.path.join(os.path.dirname(__file__), '..', 'main.py')
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+        self.next_steps = []
+        self.next_step_backend = MemoryHandlerBackend()
+
+    def message_handler(self, *args, **kwargs):
+        return lambda handler: handler
+
+    callback_query_handler = message_handler
+
+    def process_new_updates(self, updates):
+        pass
+
+    def reply_to(self, message, text, **kwargs):
+        self.sent.append(text)
+        return message
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+
+    def send_photo(self, chat_id, photo, caption=None, **kwargs):
+        self.sent.append(caption)
+
+    def register_next_step_handler(self, message, handler, *args):
+        self.next_steps.append(handler.__name__)
+        self.next_step_backend.register_handler(message.chat.id, Handler(handler, *args))
+
+
+@pytest.fixture
+def main(monkeypatch):
+    """main.py's handlers with its externals stubbed, as the bot script provides them"""
+    monkeypatch.setenv('STATE_BACKEND', 'memory')
+    logger = logging.getLogger('main')
+    namespace = {
+        '__name__': 'main',
+        'bot': FakeBot(),
+        'types': telebot_types,
+        'InlineKeyboardButton': telebot_types.InlineKeyboardButton,
+        'logger': logger,
+        'sanitize_text': lambda text: (text or '').strip(),
+        'validate_interests': lambda text: (True, [part.strip() for part in text.split(',')]),
+        'get_profile_quality': lambda profile: {'rating': 'Good'},
+    }
+    with open(MAIN) as source:
+        exec(compile(source.read(), MAIN, 'exec'), namespace)
+
+    saved = {}
+    namespace.update(
+        save_user_to_db=lambda chat_id, profile: saved.setdefault(chat_id, dict(profile)),
+        get_user_info=lambda chat_id: None,
+        geocode_user_location=lambda chat_id, location: None,
+        interest_index=types.SimpleNamespace(set_user_interests=lambda chat_id, interests: None),
+        broadcast=types.SimpleNamespace(subscribe=lambda chat_id: None),
+    )
+    errors = []
+    monkeypatch.setattr(logger, 'error', errors.append)
+    namespace['saved'], namespace['errors'] = saved, errors
+    return namespace
+
+
+def message(text=None, chat_id=42, photo=None):
+    return types.SimpleNamespace(
+        chat=types.SimpleNamespace(id=chat_id), text=text, location=None,
+        content_type='photo' if photo else 'text',
+        photo=[types.SimpleNamespace(file_id=photo)] if photo else None,
+        from_user=types.SimpleNamespace(username='ann'),
+    )
+
+
+def test_setup_steps_keep_every_answer(main):
+    main['user_data'].set(42, {'username': 'ann'})
+    main['ask_name'](message('Ann'))
+    main['validate_age'](message('30'))
+    main['validate_gender'](message('👩 Female'))
+    main['validate_looking_for'](message('💑 Dating'))
+    main['handle_location_or_prompt_for_location'](message('Paris'))
+    main['ask_photo'](message(photo='photo-id'))
+    main['ask_interests'](message('music, art'))
+
+    assert main['errors'] == []
+    assert main['saved'][42] == {
+        'username': 'ann', 'name': 'Ann', 'age': 30, 'gender': 'F', 'looking_for': '1',
+        'location': 'Paris', 'photo': 'photo-id', 'interests': ['music', 'art'],
+    }
+    assert main['bot'].next_steps == ['validate_age', 'validate_gender', 'validate_looking_for',
+                                      'handle_location_or_prompt_for_location', 'ask_photo', 'ask_interests']
+
+
+def test_reply_to_random_is_classed_heavy(main):
+    update = types.SimpleNamespace(callback_query=None, message=message('👥 Both'))
+    assert main['classify_update'](update) == 'default'
+    assert main['classify_update'](types.SimpleNamespace(callback_query=None, message=message('/random'))) == 'default'
+
+    main['bot'].register_next_step_handler(message('/random'), main['find_compatible_random_chat'])
+    assert main['classify_update'](update) == 'heavy'
+
+
+def test_queue_info_reports_a_chat_matched_right_after_joining(main):
+    assert main['get_queue_info'](42).startswith("❌ You are not in the queue")
+    main['chat_sessions'].pair(42, 7)
+    assert main['get_queue_info'](42).startswith("🎉 You've been matched!")
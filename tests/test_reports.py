@@ -0,0 +1,48 @@
+from reports import ReportAggregate, should_ban
+
+
+def test_counts_within_window():
+    aggregate = ReportAggregate(window_hours=3)
+    aggregate.add(1, 'spam', hour=100)
+    aggregate.add(1, 'harassment', hour=101)
+    counts = aggregate.add(1, 'spam', hour=102)
+    assert counts == {'total': 3, 'by_violation': {'spam': 2, 'harassment': 1}}
+
+
+def test_buckets_slide_out_of_window():
+    aggregate = ReportAggregate(window_hours=3)
+    aggregate.add(1, 'spam', hour=100)
+    aggregate.add(1, 'harassment', hour=101)
+    assert aggregate.counts(1, hour=102)['total'] == 2
+    assert aggregate.counts(1, hour=103) == {'total': 1, 'by_violation': {'harassment': 1}}
+    assert aggregate.counts(1, hour=104) == {'total': 0, 'by_violation': {}}
+
+
+def test_out_of_order_buckets_expire_in_order():
+    aggregate = ReportAggregate(window_hours=3)
+    aggregate.add(1, 'spam', hour=102)
+    aggregate.add(1, 'fake', hour=100)
+    assert aggregate.counts(1, hour=102)['total'] == 2
+    assert aggregate.counts(1, hour=103) == {'total': 1, 'by_violation': {'spam': 1}}
+
+
+def test_users_with_nothing_left_are_evicted():
+    aggregate = ReportAggregate(window_hours=2)
+    aggregate.add(1, 'spam', hour=100)
+    aggregate.add(2, 'spam', hour=101)
+    aggregate.add(3, 'spam', hour=102)
+    assert len(aggregate) == 2
+    assert aggregate.counts(1, hour=102)['total'] == 0
+
+
+def test_load_sets_bucket_counts():
+    aggregate = ReportAggregate(window_hours=24)
+    aggregate.add(1, 'spam', hour=100)
+    aggregate.load([(1, 'spam', 100, 2), (1, 'underage', 99, 1)])
+    assert aggregate.counts(1, hour=100) == {'total': 3, 'by_violation': {'spam': 2, 'underage': 1}}
+
+
+def test_should_ban_needs_several_reporters():
+    assert not should_ban({'total': 1, 'by_violation': {'underage': 1}})
+    assert should_ban({'total': 2, 'by_violation': {'underage': 2}})
+    assert not should_ban({'total': 2, 'by_violation': {'harassment': 2}})
@@ -0,0 +1,33 @@
+from writebehind import _Batch
+
+
+def profile(fields=None, coordinates=None, resolved_for=None):
+    return {'op': 'profile', 'chat_id': 42, 'fields': fields or {},
+            'coordinates': coordinates, 'resolved_for': resolved_for}
+
+
+def test_coordinates_for_an_older_location_are_dropped():
+    batch = _Batch([
+        profile({'location': 'Paris'}),
+        profile({'location': 'Lyon'}),
+        profile(coordinates=[48.85, 2.35], resolved_for='Paris'),
+    ])
+    assert batch.profiles[42] == {'fields': {'location': 'Lyon'}}
+
+    batch.add(profile(coordinates=[45.76, 4.84], resolved_for='Lyon'))
+    assert batch.profiles[42]['coordinates'] == [45.76, 4.84]
+
+
+def test_a_newer_location_clears_resolved_coordinates():
+    batch = _Batch([
+        profile({'location': 'Paris'}),
+        profile(coordinates=[48.85, 2.35], resolved_for='Paris'),
+        profile({'location': 'Lyon'}),
+    ])
+    assert batch.profiles[42] == {'fields': {'location': 'Lyon'}}
+
+
+def test_coordinates_survive_the_journal():
+    batch = _Batch([profile(coordinates=[48.85, 2.35], resolved_for='Paris')])
+    replayed = _Batch(batch.records())
+    assert replayed.profiles[42] == {'fields': {}, 'coordinates': [48.85, 2.35], 'resolved_for': 'Paris'}
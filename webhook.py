@@ -0,0 +1,129 @@
+import threading
+import logging
+import secrets
+import hmac
+import time
+import os
+
+from flask import Flask, Response, request
+from telebot import types
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = '/webhook'
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+app = Flask(__name__)
+
+# name -> callable returning a dict of numbers (nested dicts are flattened)
+_metrics_providers = {}
+
+
+def register_metrics(name, provider):
+    """Expose provider()'s numbers on /metrics as matchbot_<name>_<key>"""
+    _metrics_providers[name] = provider
+
+
+def render_metrics():
+    """All registered metrics in the Prometheus text format"""
+    lines = []
+
+    def emit(prefix, values):
+        for key, value in values.items():
+            if isinstance(value, dict):
+                emit(f"{prefix}_{key}", value)
+            elif isinstance(value, (bool, int, float)):
+                lines.append(f"{prefix}_{key} {float(value):g}")
+
+    for name, provider in sorted(_metrics_providers.items()):
+        try:
+            emit(f"matchbot_{name}", provider())
+        except Exception as e:
+            logger.error(f"Error collecting {name} metrics: {e}")
+    return '\n'.join(lines) + '\n'
+
+
+@app.route('/')
+def home():
+    return "I'm alive!"
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+def install_webhook_route(bot, secret_token):
+    """Accept Telegram updates on WEBHOOK_PATH, checking the secret token header.
+
+    Each update goes straight to bot.process_new_updates on the request
+    thread, i.e. to the installed UpdateDispatcher, which keeps each
+    chat's updates in order. When the dispatcher's pools are full it holds
+    the request, so a slow bot slows Telegram's deliveries down instead of
+    buffering without bound. Returns the route's stats.
+    """
+    stats = {'received': 0, 'unauthorized': 0, 'invalid': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def count(key):
+        with lock:
+            stats[key] += 1
+
+    def receive_update():
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), secret_token):
+            count('unauthorized')
+            return Response(status=403)
+        update = request.get_json(silent=True)
+        if not isinstance(update, dict) or 'update_id' not in update:
+            count('invalid')
+            return Response(status=400)
+        count('received')
+        try:
+            bot.process_new_updates([types.Update.de_json(update)])
+        except Exception as e:
+            count('errors')
+            logger.error(f"Error processing update {update['update_id']}: {e}")
+        return ''
+
+    app.add_url_rule(WEBHOOK_PATH, 'receive_update', receive_update, methods=['POST'])
+    return stats
+
+
+def serve(host='0.0.0.0', port=None, threads=None):
+    """Serve the app with waitress, blocking"""
+    from waitress import serve as waitress_serve
+
+    port = port or int(os.getenv('PORT', '8080'))
+    threads = threads or int(os.getenv('SERVER_THREADS', '8'))
+    logger.info(f"🌐 Serving on {host}:{port}")
+    waitress_serve(app, host=host, port=port, threads=threads, ident='matchbot')
+
+
+def serve_in_background(**kwargs):
+    thread = threading.Thread(target=serve, kwargs=kwargs, name='http-server')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def run_webhook(bot, base_url=None, secret_token=None):
+    """Receive updates by webhook instead of long polling, blocking.
+
+    Registers <base_url>/webhook with Telegram together with a secret
+    token (WEBHOOK_SECRET, or a random one per start) that every request
+    must echo back, then serves the webhook, / and /metrics.
+    """
+    base_url = base_url or os.getenv('WEBHOOK_URL')
+    if not base_url:
+        raise ValueError("WEBHOOK_URL must be set to run in webhook mode")
+    secret_token = secret_token or os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+
+    stats = install_webhook_route(bot, secret_token)
+    register_metrics('webhook', lambda: dict(stats))
+
+    bot.remove_webhook()
+    time.sleep(1)
+    bot.set_webhook(url=base_url.rstrip('/') + WEBHOOK_PATH, secret_token=secret_token,
+                    drop_pending_updates=True)
+    logger.info("✅ Webhook registered")
+    serve()
@@ -0,0 +1,117 @@
+import multiprocessing
+import logging
+import time
+
+from telebot import apihelper, types
+
+logger = logging.getLogger(__name__)
+
+# Update kinds whose payload carries the chat directly
+CHAT_UPDATES = ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                'my_chat_member', 'chat_member', 'chat_join_request')
+# Update kinds that only carry the user
+USER_UPDATES = ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query')
+
+
+def update_chat_id(update):
+    """chat_id an update belongs to (a raw update dict), or None"""
+    for kind in CHAT_UPDATES:
+        if kind in update:
+            return update[kind]['chat']['id']
+    if 'callback_query' in update:
+        call = update['callback_query']
+        message = call.get('message')
+        return message['chat']['id'] if message else call['from']['id']
+    for kind in USER_UPDATES:
+        if kind in update:
+            return update[kind]['from']['id']
+    if 'poll_answer' in update:
+        return (update['poll_answer'].get('user') or {}).get('id')
+    return None
+
+
+def partition(update, count):
+    chat_id = update_chat_id(update)
+    return chat_id % count if chat_id is not None else 0
+
+
+def consume_updates(bot, updates):
+    """Worker loop: hand each routed update to the bot's handlers"""
+    while True:
+        update = updates.get()
+        if update is None:
+            return
+        try:
+            bot.process_new_updates([types.Update.de_json(update)])
+        except Exception as e:
+            logger.error(f"Error processing update {update.get('update_id')}: {e}")
+
+
+class UpdateRouter:
+    """Long-polls Telegram in one process and partitions updates by chat_id.
+
+    Only one getUpdates consumer is allowed per bot token, so this router
+    owns polling and hands each raw update to worker chat_id % count. A
+    chat always lands on the same worker, which keeps its updates in order
+    and its next-step handlers in one process. The queues are bounded: a
+    backed-up worker stalls polling instead of growing memory. Workers are
+    spawned, not forked, so each builds its own connections and its own
+    write-behind journal, and a worker that dies is restarted on the same
+    queue and journal.
+    """
+
+    def __init__(self, bot, target, count, queue_size=1000, poll_timeout=30):
+        self.bot = bot
+        self.target = target
+        self.count = count
+        self.poll_timeout = poll_timeout
+        self._context = multiprocessing.get_context('spawn')
+        self.queues = [self._context.Queue(queue_size) for _ in range(count)]
+        self.processes = [None] * count
+        self.stats = {'routed': 0, 'restarts': 0}
+
+    def _spawn(self, index):
+        process = self._context.Process(target=self.target, args=(index, self.queues[index]),
+                                        name=f"bot-worker-{index}")
+        process.daemon = True
+        process.start()
+        self.processes[index] = process
+
+    def _check_workers(self):
+        for index, process in enumerate(self.processes):
+            if not process.is_alive():
+                logger.error(f"Worker {index} exited with {process.exitcode}, restarting")
+                self.stats['restarts'] += 1
+                self._spawn(index)
+
+    def route(self, update):
+        self.queues[partition(update, self.count)].put(update)
+        self.stats['routed'] += 1
+
+    def run(self, skip_pending=True):
+        for index in range(self.count):
+            self._spawn(index)
+        logger.info(f"🔀 Routing updates to {self.count} workers")
+
+        offset = None
+        if skip_pending:
+            pending = apihelper.get_updates(self.bot.token, offset=-1, timeout=0)
+            if pending:
+                offset = pending[-1]['update_id'] + 1
+
+        try:
+            while True:
+                try:
+                    updates = apihelper.get_updates(self.bot.token, offset=offset, timeout=self.poll_timeout,
+                                                    long_polling_timeout=self.poll_timeout)
+                except Exception as e:
+                    logger.error(f"❌ Polling error: {e}")
+                    time.sleep(5)
+                    continue
+                for update in updates:
+                    self.route(update)
+                    offset = update['update_id'] + 1
+                self._check_workers()
+        finally:
+            for queue in self.queues:
+                queue.put(None)
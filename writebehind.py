@@ -0,0 +1,456 @@
+from datetime import datetime
+import threading
+import logging
+import atexit
+import json
+import glob
+import time
+import re
+import os
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import InterfaceError, OperationalError, StatementError
+
+from likes import insert_likes
+from models import User, Report, get_db, close_db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOURNAL = 'write_behind.journal'
+
+
+class _Batch:
+    """Pending writes, coalesced.
+
+    Likes are keyed by (liker, liked), so repeated presses become one row;
+    a note sticks once given. Reports are keyed by (reporter, reported,
+    violation). Profile edits are merged per user, last value per field
+    winning. Resolved coordinates carry the location they were resolved
+    for and are dropped when the edit's location is a different one,
+    whether the newer location was queued before or after they arrived.
+    attempts counts the failed
+    flushes of writes that were rejected before.
+    """
+
+    def __init__(self, records=()):
+        self.likes = {}
+        self.reports = {}
+        self.profiles = {}
+        self.attempts = {}
+        for record in records:
+            self.add(record)
+
+    def __len__(self):
+        return len(self.likes) + len(self.reports) + len(self.profiles)
+
+    def add(self, record):
+        op = record['op']
+        if op == 'like':
+            key = (record['liker'], record['liked'])
+            if record.get('note') or key not in self.likes:
+                self.likes[key] = record.get('note')
+        elif op == 'report':
+            key = (record['reporter'], record['reported'], record['violation'])
+            self.reports.setdefault(key, record['ts'])
+        elif op == 'profile':
+            key = record['chat_id']
+            self._merge_profile(key, record.get('fields') or {}, record.get('coordinates'),
+                                record.get('resolved_for'))
+        else:
+            logger.error(f"Unknown write-behind record: {record}")
+            return
+        if record.get('attempts'):
+            self.attempts[(op, key)] = max(self.attempts.get((op, key), 0), record['attempts'])
+
+    def records(self):
+        """The batch as journal records"""
+        for (liker, liked), note in self.likes.items():
+            yield self._record({'op': 'like', 'liker': liker, 'liked': liked, 'note': note}, (liker, liked))
+        for (reporter, reported, violation), ts in self.reports.items():
+            yield self._record({'op': 'report', 'reporter': reporter, 'reported': reported,
+                                'violation': violation, 'ts': ts}, (reporter, reported, violation))
+        for chat_id, edit in self.profiles.items():
+            yield self._record({'op': 'profile', 'chat_id': chat_id, 'fields': edit['fields'],
+                                'coordinates': edit.get('coordinates'),
+                                'resolved_for': edit.get('resolved_for')}, chat_id)
+
+    def split(self):
+        """Two batches holding half of the writes each"""
+        records = list(self.records())
+        middle = len(records) // 2
+        return _Batch(records[:middle]), _Batch(records[middle:])
+
+    def _record(self, record, key):
+        attempts = self.attempts.get((record['op'], key))
+        if attempts:
+            record['attempts'] = attempts
+        return record
+
+    def _merge_profile(self, chat_id, fields, coordinates, resolved_for=None):
+        edit = self.profiles.setdefault(chat_id, {'fields': {}})
+        edit['fields'].update(fields)
+        if 'location' in fields:
+            edit.pop('coordinates', None)
+            edit.pop('resolved_for', None)
+        if coordinates is None:
+            return
+        location = edit['fields'].get('location')
+        if resolved_for is not None and location is not None and location != resolved_for:
+            # Resolved for an older location than the one now queued
+            return
+        edit['coordinates'] = list(coordinates)
+        edit['resolved_for'] = resolved_for
+
+
+class WriteBehindQueue:
+    """Deferred writes for likes, reports and profile edits.
+
+    Callers enqueue and return at once; a flusher thread writes everything
+    queued in one transaction, as bulk INSERT ... ON CONFLICT statements
+    and an executemany UPDATE of the edited users, when max_batch writes
+    are pending or every interval seconds.
+
+    Every write is appended to a journal before it is acknowledged. A flush
+    seals the current journal segment and deletes it only after commit, so
+    writes lost in a crash are replayed on the next start. Delivery is at
+    least once: a crash between commit and delete replays the segment,
+    which is harmless for likes and edits, and reports are keyed by their
+    journaled timestamp, so a replayed report is skipped and not counted
+    again.
+
+    When the database is unreachable the whole batch is journaled again
+    and retried. When it rejects the batch itself, e.g. a value too long
+    for its column, the batch is split in halves until the rejected writes
+    are isolated, so the rest are stored. A write rejected max_attempts
+    times is moved to a dead-letter file on its own.
+    """
+
+    def __init__(self, journal_path=DEFAULT_JOURNAL, max_batch=500, interval=1.0,
+                 max_attempts=5, fsync=False):
+        self.journal_path = journal_path
+        self.max_batch = max_batch
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.fsync = fsync
+        self._cond = threading.Condition()
+        # Flushes run one at a time so batches commit in queue order
+        self._flush_lock = threading.Lock()
+        self._pending = _Batch()
+        self._sealed = []
+        self._like_listeners = []
+        self._thread = None
+        self._closed = False
+        self.stats = {
+            'enqueued': 0, 'flushed': 0, 'flushes': 0, 'failures': 0, 'rejected': 0, 'dropped': 0,
+            'replayed': 0, 'last_flush_ms': 0.0, 'max_flush_ms': 0.0, 'total_flush_ms': 0.0,
+        }
+        self._recover()
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+
+    def add_like_listener(self, callback):
+        """Call callback(liker, liked, mutual) for each new like once it is stored"""
+        self._like_listeners.append(callback)
+
+    def like(self, liker_chat_id, liked_chat_id, note=None):
+        self._enqueue({'op': 'like', 'liker': int(liker_chat_id), 'liked': int(liked_chat_id), 'note': note})
+
+    def report(self, reporter_chat_id, reported_chat_id, violation):
+        self._enqueue({'op': 'report', 'reporter': int(reporter_chat_id),
+                       'reported': int(reported_chat_id), 'violation': violation, 'ts': time.time()})
+
+    def profile(self, chat_id, fields=None, coordinates=None, resolved_for=None):
+        """Queue profile field values and/or (lat, lon) coordinates resolved for location resolved_for"""
+        self._enqueue({'op': 'profile', 'chat_id': int(chat_id), 'fields': fields or {},
+                       'coordinates': list(coordinates) if coordinates else None,
+                       'resolved_for': resolved_for})
+
+    def depth(self):
+        with self._cond:
+            return len(self._pending)
+
+    def metrics(self):
+        with self._cond:
+            metrics = dict(self.stats, depth=len(self._pending), sealed_segments=len(self._sealed))
+        flushes = metrics['flushes']
+        metrics['avg_flush_ms'] = metrics['total_flush_ms'] / flushes if flushes else 0.0
+        return metrics
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='write-behind')
+            self._thread.daemon = True
+            self._thread.start()
+        atexit.register(self.close)
+
+    def flush(self):
+        """Write everything pending now. Returns the number of writes stored"""
+        with self._flush_lock:
+            with self._cond:
+                batch, segments = self._seal()
+            if batch is None:
+                return 0
+            return self._write(batch, segments)
+
+    def close(self):
+        """Stop the flusher and write what is left; called at interpreter exit"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+        self.flush()
+        with self._cond:
+            self._journal.close()
+
+    def _enqueue(self, record):
+        line = json.dumps(record)
+        with self._cond:
+            if self._journal.closed:
+                # Enqueued during shutdown: journal it for the next start
+                self._journal = open(self.journal_path, 'a', encoding='utf-8')
+            self._journal.write(line + '\n')
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._pending.add(record)
+            self.stats['enqueued'] += 1
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify()
+        if self._thread is None:
+            self.start()
+
+    def _requeue(self, records):
+        """Put unstored writes of a flush back ahead of everything queued since"""
+        if not records:
+            return
+        # A segment of their own sorts before the live journal, so a replay
+        # also applies newer edits on top of them
+        segment = f"{self.journal_path}.{time.time_ns()}.sealed"
+        with open(segment, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(record) + '\n' for record in records)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        with self._cond:
+            batch = _Batch(records)
+            for record in self._pending.records():
+                batch.add(record)
+            self._pending = batch
+            self._sealed.insert(0, segment)
+
+    def _recover(self):
+        """Queue the writes of journal segments left by a previous process"""
+        # Only this journal's own segments, never those of another worker's journal
+        own_segment = re.compile(re.escape(self.journal_path) + r'\.\d+\.sealed')
+        segments = sorted(
+            segment for segment in glob.glob(f"{glob.escape(self.journal_path)}.*.sealed")
+            if own_segment.fullmatch(segment)
+        )
+        if os.path.exists(self.journal_path):
+            segments.append(self._seal_segment())
+        for segment in segments:
+            with open(segment, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self._pending.add(json.loads(line))
+                        self.stats['replayed'] += 1
+                    except ValueError:
+                        # A torn last line from a crash mid-write
+                        logger.warning(f"Skipping corrupt journal line in {segment}")
+        self._sealed = segments
+        if self.stats['replayed']:
+            logger.info(f"Replaying {self.stats['replayed']} journaled writes")
+
+    def _seal_segment(self):
+        segment = f"{self.journal_path}.{time.time_ns()}.sealed"
+        os.replace(self.journal_path, segment)
+        return segment
+
+    def _seal(self):
+        """Swap out the pending batch and the journal segments that hold it"""
+        if not len(self._pending):
+            return None, []
+        batch, self._pending = self._pending, _Batch()
+        if not self._journal.closed:
+            self._journal.close()
+            self._sealed.append(self._seal_segment())
+            if not self._closed:
+                self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        segments, self._sealed = self._sealed, []
+        return batch, segments
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.interval
+                while not self._closed and len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed:
+                    return
+            self.flush()
+
+    def _write(self, batch, segments):
+        started = time.monotonic()
+        created, rejected, deferred = [], [], []
+        self._store_isolating(batch, created, rejected, deferred)
+
+        retry, dead = [], []
+        for record, error in rejected:
+            record['attempts'] = record.get('attempts', 0) + 1
+            (retry if record['attempts'] < self.max_attempts else dead).append((record, error))
+        # Writes still to be made are journaled again before their segments are removed
+        self._requeue(deferred + [record for record, _ in retry])
+        elapsed_ms = (time.monotonic() - started) * 1000
+        stored = len(batch) - len(rejected) - len(deferred)
+        with self._cond:
+            self.stats['flushes'] += 1
+            self.stats['flushed'] += stored
+            self.stats['failures'] += bool(rejected or deferred)
+            self.stats['rejected'] += len(rejected)
+            self.stats['dropped'] += len(dead)
+            self.stats['last_flush_ms'] = elapsed_ms
+            self.stats['max_flush_ms'] = max(self.stats['max_flush_ms'], elapsed_ms)
+            self.stats['total_flush_ms'] += elapsed_ms
+        if dead:
+            logger.error(f"{len(dead)} writes were rejected {self.max_attempts} times, "
+                         f"moving them to the dead-letter file")
+            with open(f"{self.journal_path}.failed", 'a', encoding='utf-8') as dead_letters:
+                dead_letters.writelines(json.dumps(dict(record, error=str(error))) + '\n' for record, error in dead)
+        self._remove_segments(segments)
+
+        for liker, liked, mutual in created:
+            for callback in self._like_listeners:
+                try:
+                    callback(liker, liked, mutual)
+                except Exception as e:
+                    logger.error(f"Error in like listener: {e}")
+        return stored
+
+    def _store_isolating(self, batch, created, rejected, deferred):
+        """Store a batch, splitting it on rejection until the rejected writes are isolated.
+
+        Collects new likes into created, (record, error) of writes the
+        database rejected into rejected, and the records left unstored
+        because the database couldn't be reached into deferred.
+        """
+        if deferred:
+            deferred.extend(batch.records())
+            return
+        try:
+            created.extend(self._store(batch))
+        except Exception as e:
+            if not _is_rejection(e):
+                logger.error(f"Write-behind flush of {len(batch)} writes failed, will retry: {e}")
+                deferred.extend(batch.records())
+            elif len(batch) == 1:
+                logger.error(f"Write-behind write rejected: {e}")
+                rejected.extend((record, e) for record in batch.records())
+            else:
+                for half in batch.split():
+                    self._store_isolating(half, created, rejected, deferred)
+
+    def _store(self, batch):
+        """Write a batch in one transaction. Returns the new likes"""
+        db = None
+        try:
+            db = get_db()
+            created = insert_likes(db, batch.likes) if batch.likes else []
+            if batch.reports:
+                inserted = db.execute(
+                    insert(Report).values([
+                        {'reporter_chat_id': reporter, 'reported_chat_id': reported, 'violation': violation,
+                         'created_at': datetime.utcfromtimestamp(ts)}
+                        for (reporter, reported, violation), ts in batch.reports.items()
+                    ])
+                    .on_conflict_do_nothing(index_elements=[
+                        Report.reporter_chat_id, Report.reported_chat_id, Report.created_at
+                    ])
+                    .returning(Report.reporter_chat_id, Report.reported_chat_id, Report.violation,
+                               Report.created_at)
+                ).all()
+                if inserted:
+                    # Imported here: reports queues its writes through this module
+                    from reports import count_reports
+                    count_reports(db, inserted)
+            if batch.profiles:
+                _apply_profile_edits(db, batch.profiles)
+            db.commit()
+            return created
+        except Exception:
+            if db is not None:
+                db.rollback()
+            raise
+        finally:
+            close_db(db)
+
+    def _remove_segments(self, segments):
+        for segment in segments:
+            try:
+                os.remove(segment)
+            except OSError as e:
+                logger.error(f"Could not remove journal segment {segment}: {e}")
+
+
+def _is_rejection(error):
+    """Whether the database refused the writes themselves, which a retry won't fix"""
+    if isinstance(error, (OperationalError, InterfaceError)) or getattr(error, 'connection_invalidated', False):
+        return False
+    return isinstance(error, (StatementError, ValueError, TypeError))
+
+
+def _apply_profile_edits(db, edits):
+    """Apply coalesced profile edits to their users with one SELECT and one UPDATE batch"""
+    users = db.query(User).filter(User.chat_id.in_(list(edits))).all()
+    for user in users:
+        edit = edits[user.chat_id]
+        for field, value in edit['fields'].items():
+            setattr(user, field, value)
+        resolved_for = edit.get('resolved_for')
+        if edit.get('coordinates') and (resolved_for is None or user.location == resolved_for):
+            user.set_coordinates(*edit['coordinates'])
+
+
+def create_write_queue():
+    """Build the write-behind queue from WRITE_BEHIND_* settings"""
+    return WriteBehindQueue(
+        journal_path=os.getenv('WRITE_BEHIND_JOURNAL', DEFAULT_JOURNAL),
+        max_batch=int(os.getenv('WRITE_BEHIND_BATCH', '500')),
+        interval=float(os.getenv('WRITE_BEHIND_INTERVAL', '1.0')),
+        fsync=os.getenv('WRITE_BEHIND_FSYNC', '0') == '1',
+    )
+
+
+def worker_journal_path(index):
+    """Journal of bot worker index, e.g. write_behind.2.journal.
+
+    A journal belongs to exactly one process: recovery seals and replays
+    its segments, so two processes sharing one would replay and delete
+    each other's writes.
+    """
+    root, ext = os.path.splitext(os.getenv('WRITE_BEHIND_JOURNAL', DEFAULT_JOURNAL))
+    return f"{root}.{index}{ext}"
+
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+
+def get_write_queue():
+    """This process's write-behind queue, built on first use.
+
+    Built lazily so that processes which never write, like the update
+    router, don't open or recover a journal.
+    """
+    global _write_queue
+    if _write_queue is None:
+        with _write_queue_lock:
+            if _write_queue is None:
+                _write_queue = create_write_queue()
+    return _write_queue